@@ -147,6 +147,7 @@ pub fn run_inference(args: InferArgs) -> Result<()> {
         no_repeat_ngram_size: app_config.inference.no_repeat_ngram_size,
         seed: app_config.inference.seed,
         use_cache: app_config.inference.use_cache,
+        cancel: None,
     };
 
     let tokenizer_for_stream = tokenizer.clone();
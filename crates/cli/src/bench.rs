@@ -207,6 +207,7 @@ fn write_report(path: &PathBuf, events: &[BenchEvent]) -> Result<()> {
     }
     let totals = totals_for_events(events);
     let value = json!({
+        "hardware": hardware_fingerprint(),
         "events": events.iter().map(event_to_json).collect::<Vec<_>>(),
         "stage_totals": totals.iter().map(stage_to_json).collect::<Vec<_>>(),
     });
@@ -216,6 +217,31 @@ fn write_report(path: &PathBuf, events: &[BenchEvent]) -> Result<()> {
     Ok(())
 }
 
+/// Same format as `hardware_fingerprint()` in scripts/model_profiles.py, so
+/// profiles ingested from this report are filed under the machine that ran it.
+#[cfg(feature = "bench-metrics")]
+fn hardware_fingerprint() -> String {
+    let gpu = std::process::Command::new("nvidia-smi")
+        .args([
+            "--query-gpu=name,memory.total",
+            "--format=csv,noheader,nounits",
+        ])
+        .output()
+        .ok()
+        .filter(|output| output.status.success())
+        .and_then(|output| {
+            let stdout = String::from_utf8_lossy(&output.stdout).into_owned();
+            let line = stdout.lines().next()?.to_owned();
+            let (name, memory_mb) = line.split_once(',')?;
+            let memory_mb: f64 = memory_mb.trim().parse().ok()?;
+            Some(format!("{} {:.0}GB", name.trim(), memory_mb / 1024.0))
+        });
+    gpu.unwrap_or_else(|| {
+        let cores = std::thread::available_parallelism().map_or(1, |n| n.get());
+        format!("cpu {} x{cores}", std::env::consts::ARCH)
+    })
+}
+
 #[cfg(feature = "bench-metrics")]
 fn event_to_json(event: &BenchEvent) -> serde_json::Value {
     json!({
@@ -1,3 +1,8 @@
+use std::sync::{
+    Arc,
+    atomic::{AtomicBool, Ordering},
+};
+
 use anyhow::{Context, Result};
 use candle_core::Device;
 use image::DynamicImage;
@@ -29,6 +34,8 @@ pub struct DecodeParameters {
     pub no_repeat_ngram_size: Option<usize>,
     pub seed: Option<u64>,
     pub use_cache: bool,
+    /// Set by the caller to stop decoding early (e.g. the streaming client went away).
+    pub cancel: Option<Arc<AtomicBool>>,
 }
 
 impl DecodeParameters {
@@ -43,8 +50,16 @@ impl DecodeParameters {
             no_repeat_ngram_size: None,
             seed: None,
             use_cache: true,
+            cancel: None,
         }
     }
+
+    /// Whether the caller asked generation to stop after the current token.
+    pub fn is_cancelled(&self) -> bool {
+        self.cancel
+            .as_ref()
+            .is_some_and(|flag| flag.load(Ordering::Relaxed))
+    }
 }
 
 impl TokenSelectionParams for DecodeParameters {
@@ -1,7 +1,10 @@
 use std::{
     convert::TryFrom,
     path::{Path, PathBuf},
-    sync::Arc,
+    sync::{
+        Arc,
+        atomic::{AtomicBool, Ordering},
+    },
 };
 
 use anyhow::{Context, Result, anyhow, ensure};
@@ -135,6 +138,8 @@ pub struct GenerateOptions<'a> {
     pub max_new_tokens: usize,
     pub eos_token_id: Option<i64>,
     pub progress_callback: ProgressCallback<'a>,
+    /// Checked after every emitted token; decoding stops once it is set.
+    pub cancel: Option<&'a AtomicBool>,
     pub use_cache: bool,
     pub temperature: f64,
     pub top_p: Option<f64>,
@@ -156,6 +161,7 @@ impl<'a> GenerateOptions<'a> {
             max_new_tokens,
             eos_token_id: None,
             progress_callback: None,
+            cancel: None,
             use_cache: true,
             temperature: 1.0,
             top_p: None,
@@ -166,6 +172,10 @@ impl<'a> GenerateOptions<'a> {
             seed: None,
         }
     }
+
+    fn is_cancelled(&self) -> bool {
+        self.cancel.is_some_and(|flag| flag.load(Ordering::Relaxed))
+    }
 }
 
 impl<'a> TokenSelectionParams for GenerateOptions<'a> {
@@ -1635,7 +1645,7 @@ impl DeepseekOcrModel {
             if let Some(cb) = progress_callback {
                 cb(generated.len(), &generated);
             }
-            if step + 1 == options.max_new_tokens {
+            if step + 1 == options.max_new_tokens || options.is_cancelled() {
                 break;
             }
             let token_index = usize::try_from(current)
@@ -1854,7 +1864,7 @@ impl DeepseekOcrModel {
             if let Some(cb) = progress_callback {
                 cb(generated.len(), &generated);
             }
-            if step + 1 == options.max_new_tokens {
+            if step + 1 == options.max_new_tokens || options.is_cancelled() {
                 break;
             }
 
@@ -2054,6 +2064,7 @@ impl deepseek_ocr_core::inference::OcrEngine for DeepseekOcrModel {
         options.no_repeat_ngram_size = params.no_repeat_ngram_size;
         options.seed = params.seed;
         options.progress_callback = stream;
+        options.cancel = params.cancel.as_deref();
 
         let generated = self.generate(&input_ids, options)?;
         let generated_tokens = generated
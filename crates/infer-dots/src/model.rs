@@ -329,6 +329,9 @@ impl OcrEngine for DotsOcrModel {
             if let Some(callback) = stream {
                 callback(generated.len(), &generated);
             }
+            if params.is_cancelled() {
+                break;
+            }
             if let Some(eos) = eos_token_id
                 && current == eos
             {
@@ -370,6 +370,9 @@ impl OcrEngine for PaddleOcrModel {
             if let Some(callback) = stream {
                 callback(generated.len(), &generated);
             }
+            if params.is_cancelled() {
+                break;
+            }
             if let Some(eos) = eos_token_id
                 && current == eos
             {
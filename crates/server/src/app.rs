@@ -45,6 +45,7 @@ pub async fn run(args: Args) -> Result<()> {
         no_repeat_ngram_size: app_config.inference.no_repeat_ngram_size,
         seed: app_config.inference.seed,
         use_cache: app_config.inference.use_cache,
+        cancel: None,
     };
 
     let state = AppState::bootstrap(
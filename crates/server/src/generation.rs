@@ -6,7 +6,7 @@ use image::DynamicImage;
 use reqwest::blocking::Client;
 use rocket::tokio;
 use tokenizers::Tokenizer;
-use tracing::info;
+use tracing::{info, warn};
 
 use crate::{
     error::ApiError,
@@ -78,7 +78,7 @@ fn generate_blocking(
     prompt: String,
     images: Vec<DynamicImage>,
     vision: VisionSettings,
-    params: DecodeParameters,
+    mut params: DecodeParameters,
     stream: Option<StreamContext>,
 ) -> Result<GenerationResult, ApiError> {
     let guard = model
@@ -89,6 +89,7 @@ fn generate_blocking(
     let mut callback_box: Option<StreamCallback> = None;
     if let Some(controller) = stream_controller.as_ref() {
         controller.send_initial();
+        params.cancel = Some(controller.cancel_flag());
         let callback = controller.callback();
         callback_box = Some(Box::new(callback));
     }
@@ -151,6 +152,17 @@ fn generate_blocking(
     );
 
     if let Some(controller) = stream_controller.as_ref() {
+        if controller.is_cancelled() {
+            warn!(
+                "[generate] client disconnected; stopped decoding after {} tokens",
+                response_tokens
+            );
+            return Ok(GenerationResult {
+                text: normalized,
+                prompt_tokens,
+                response_tokens,
+            });
+        }
         controller.flush_remaining(&generated_tokens);
         controller.finalize(&normalized, prompt_tokens, response_tokens);
     }
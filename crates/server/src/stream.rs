@@ -1,7 +1,10 @@
 use std::{
     convert::TryFrom,
     pin::Pin,
-    sync::{Arc, Mutex},
+    sync::{
+        Arc, Mutex,
+        atomic::{AtomicBool, Ordering},
+    },
 };
 
 use deepseek_ocr_core::streaming::DeltaTracker;
@@ -83,6 +86,7 @@ struct StreamControllerInner {
     tokenizer: Arc<Tokenizer>,
     kind: StreamKind,
     runtime: Mutex<StreamRuntime>,
+    cancelled: Arc<AtomicBool>,
 }
 
 #[derive(Default)]
@@ -105,6 +109,7 @@ impl StreamController {
                 tokenizer,
                 kind: context.kind,
                 runtime: Mutex::new(StreamRuntime::default()),
+                cancelled: Arc::new(AtomicBool::new(false)),
             }),
         }
     }
@@ -129,6 +134,17 @@ impl StreamController {
         }
     }
 
+    /// Flag raised once the client has gone away; pass it to the decoder as
+    /// `DecodeParameters::cancel` so generation stops instead of running to
+    /// `max_new_tokens` for nobody.
+    pub fn cancel_flag(&self) -> Arc<AtomicBool> {
+        Arc::clone(&self.inner.cancelled)
+    }
+
+    pub fn is_cancelled(&self) -> bool {
+        self.inner.cancelled.load(Ordering::Relaxed)
+    }
+
     pub fn emit_fallback(&self, text: &str) {
         self.inner.emit_delta(text.to_string(), true);
         self.inner.finalize(text, 0, 0);
@@ -136,6 +152,12 @@ impl StreamController {
 }
 
 impl StreamControllerInner {
+    fn send(&self, event: Event) {
+        if self.sender.send(event).is_err() {
+            self.cancelled.store(true, Ordering::Relaxed);
+        }
+    }
+
     fn send_initial(&self) {
         match &self.kind {
             StreamKind::Responses {
@@ -144,7 +166,7 @@ impl StreamControllerInner {
                 created,
                 ..
             } => {
-                let _ = self.sender.send(Event::json(&json!({
+                self.send(Event::json(&json!({
                     "type": "response.created",
                     "response": {
                         "id": response_id,
@@ -172,7 +194,7 @@ impl StreamControllerInner {
                         "finish_reason": serde_json::Value::Null,
                     }],
                 });
-                let _ = self.sender.send(Event::json(&payload));
+                self.send(Event::json(&payload));
                 if let Ok(mut state) = self.runtime.lock() {
                     state.role_sent = true;
                 }
@@ -214,7 +236,7 @@ impl StreamControllerInner {
                     "output_index": 0,
                     "delta": text,
                 });
-                let _ = self.sender.send(Event::json(&payload));
+                self.send(Event::json(&payload));
             }
             StreamKind::Chat {
                 completion_id,
@@ -236,12 +258,18 @@ impl StreamControllerInner {
                         "finish_reason": serde_json::Value::Null,
                     }],
                 });
-                let _ = self.sender.send(Event::json(&payload));
+                self.send(Event::json(&payload));
             }
         }
     }
 
     fn handle_progress(&self, count: usize, ids: &[i64]) {
+        // The receiver is dropped once Rocket fails to write to a disconnected
+        // client; check before doing any detokenisation work.
+        if self.sender.is_closed() {
+            self.cancelled.store(true, Ordering::Relaxed);
+            return;
+        }
         self.process_tokens(count, ids, false);
     }
 
@@ -332,8 +360,8 @@ impl StreamControllerInner {
                         },
                     }
                 });
-                let _ = self.sender.send(Event::json(&payload));
-                let _ = self.sender.send(Event::data("[DONE]"));
+                self.send(Event::json(&payload));
+                self.send(Event::data("[DONE]"));
             }
             StreamKind::Chat {
                 completion_id,
@@ -356,8 +384,8 @@ impl StreamControllerInner {
                         "total_tokens": prompt_tokens + completion_tokens,
                     }
                 });
-                let _ = self.sender.send(Event::json(&payload));
-                let _ = self.sender.send(Event::data("[DONE]"));
+                self.send(Event::json(&payload));
+                self.send(Event::data("[DONE]"));
             }
         }
     }
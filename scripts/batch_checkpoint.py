@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Resumable batch runs for DeepSeek-OCR
+A batch over tens of thousands of scans must survive crashes without paying
+GPU time twice. Two append-only files make a run resumable:
+
+  - JsonlSink: results, one JSON record per line, flushed per record and
+    fsynced every `fsync_every` records or `fsync_interval` seconds
+  - BatchCheckpoint: one {"key", "status", ...} line per finished item
+    (status "done" or "failed"), appended only after the sink holding the
+    item's result was fsynced, and itself fsynced every `fsync_every`
+    entries
+
+Page writeback order is arbitrary, so a flushed but unsynced checkpoint
+line could reach the disk before the result it vouches for; fsyncing the
+sink first rules that out, and costs one fsync per item, which is small next
+to seconds of GPU time per document. A "done" entry therefore never
+outlives its result, even across power loss.
+
+Restarting the same job loads the checkpoint once into a dict and skips
+every item already marked done with one lookup per item. Failed items run
+again unless skip_failed is set. A process crash loses nothing that was
+flushed; a power loss can lose the checkpoint entries of up to one fsync
+window, and those items are simply processed again (their results may
+then appear twice in the sink). A torn last line from a crash is cut off
+when either file is reopened.
+
+Usage:
+    python3 test_extraction.py --batch scans/ --output results.jsonl --checkpoint results.ckpt
+    python3 batch_checkpoint.py results.ckpt
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, Optional
+
+def item_key(path: str, doc_type: str) -> str:
+    """Checkpoint key: resolved path, doc type and file size"""
+    resolved = os.path.realpath(path)
+    try:
+        size = os.path.getsize(resolved)
+    except OSError:
+        size = -1
+    return f"{doc_type}:{size}:{resolved}"
+
+def _truncate_torn_tail(path: str):
+    """Drop a partial last line left by a crash mid-write"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Scan backwards for the last complete line
+        pos = size
+        block = 64 * 1024
+        while pos > 0:
+            start = max(0, pos - block)
+            f.seek(start)
+            chunk = f.read(pos - start)
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                f.truncate(start + newline + 1)
+                return
+            pos = start
+        f.truncate(0)
+
+class JsonlSink:
+    """Append-only JSONL writer with periodic fsync"""
+
+    def __init__(self, path: str, append: bool = True, fsync_every: int = 100, fsync_interval: float = 5.0):
+        """
+        Args:
+            path: Output file
+            append: Keep existing records (resume); False truncates the file
+            fsync_every: fsync after this many records
+            fsync_interval: ... or after this many seconds, whichever comes first
+        """
+        self.path = path
+        if append:
+            _truncate_torn_tail(path)
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.records = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.records += 1
+        self._unsynced += 1
+        if self.sync_due():
+            self.sync()
+
+    @property
+    def synced(self) -> bool:
+        return self._unsynced == 0
+
+    def sync_due(self) -> bool:
+        return self._unsynced > 0 and (
+            self._unsynced >= self.fsync_every
+            or time.monotonic() - self._last_sync >= self.fsync_interval
+        )
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BatchCheckpoint:
+    """Append-only log of finished batch items"""
+
+    def __init__(
+        self,
+        path: str,
+        sink: Optional[JsonlSink] = None,
+        skip_failed: bool = False,
+        fsync_every: int = 100,
+    ):
+        """
+        Args:
+            path: Checkpoint log (created if missing)
+            sink: Result sink to fsync before each entry, so a "done"
+                entry never outlives its result
+            skip_failed: Also skip items that failed in an earlier run
+            fsync_every: fsync the checkpoint after this many entries
+        """
+        self.path = path
+        self.sink = sink
+        self.skip_failed = skip_failed
+        self.fsync_every = fsync_every
+        self.status: Dict[str, str] = {}
+        self.loaded = 0
+        if os.path.exists(path):
+            _truncate_torn_tail(path)
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.status[entry["key"]] = entry["status"]
+                    self.loaded += 1
+        self._file = open(path, "a", encoding="utf-8")
+        self._pending = 0
+
+    def is_done(self, path: str, doc_type: str) -> bool:
+        status = self.status.get(item_key(path, doc_type))
+        return status == "done" or (self.skip_failed and status == "failed")
+
+    def record(self, path: str, doc_type: str, result: Dict):
+        """Mark an item finished; call after its result was written to the sink"""
+        key = item_key(path, doc_type)
+        status = "done" if result.get("success") else "failed"
+        entry = {"key": key, "status": status, "path": path, "doc_type": doc_type, "time": time.time()}
+        if status == "failed":
+            entry["error"] = result.get("error", "Unknown error")
+        # The result must be on disk before anything on disk says it is done
+        if self.sink is not None and not self.sink.synced:
+            self.sink.sync()
+        self.status[key] = status
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        if self.sink is not None and not self.sink.synced:
+            self.sink.sync()
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+
+    def counts(self) -> Dict[str, int]:
+        counts = {"done": 0, "failed": 0}
+        for status in self.status.values():
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the progress recorded in a batch checkpoint")
+    parser.add_argument("path", help="Checkpoint log written by test_extraction.py --checkpoint")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"❌ Error: Checkpoint not found: {args.path}")
+        return
+
+    with BatchCheckpoint(args.path) as checkpoint:
+        counts = checkpoint.counts()
+        print(f"📌 Checkpoint: {args.path}")
+        print("=" * 80)
+        print(f"Entries: {checkpoint.loaded}")
+        print(f"Done: {counts['done']}")
+        print(f"Failed: {counts['failed']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Concurrent batch extraction for DeepSeek-OCR
+Runs extract_document over a whole directory or manifest with bounded
+asyncio concurrency, so image encoding, network time and post-processing
+overlap with server inference.
+
+Usage:
+    python3 test_extraction.py --batch scans/ktp --doc-type ktp --concurrency 4
+    python3 test_extraction.py --batch manifest.txt --output results.jsonl
+"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from concurrency_limit import AdaptiveLimiter, is_overload, reached_server
+from endpoint_pool import print_endpoint_stats, print_hedging_stats
+from fallback_chain import print_fallback_stats
+from model_scheduler import ModelAffinityScheduler, print_scheduler_stats
+
+# PDFs and multi-page TIFFs are split into pages by multipage.MultipageExtractor
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff", ".pdf"}
+
+@dataclass
+class BatchItem:
+    """One document to extract"""
+    path: str
+    doc_type: str = "ktp"
+
+@dataclass
+class BatchSummary:
+    """Aggregate statistics for a batch run"""
+    total: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    wall_seconds: float = 0.0
+    concurrency: int = 1
+    models: Dict[str, int] = field(default_factory=dict)
+    early_stops: int = 0
+    early_stops_estimated: int = 0   # Early stops with a learned output length
+    wait_avoided_tokens: int = 0
+    wait_avoided_seconds: float = 0.0
+    loops_cut: int = 0
+    coalesced: int = 0
+    skipped: int = 0
+    near_duplicates: int = 0
+    fallback: Dict = field(default_factory=dict)
+    concurrency_limit: Dict = field(default_factory=dict)
+    endpoints: List[Dict] = field(default_factory=list)
+    hedging: Dict = field(default_factory=dict)
+    scheduler: Dict = field(default_factory=dict)
+
+    @property
+    def docs_per_second(self) -> float:
+        if self.wall_seconds <= 0:
+            return 0.0
+        return self.total / self.wall_seconds
+
+    def to_dict(self) -> Dict:
+        return {
+            "total": self.total,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "wall_seconds": self.wall_seconds,
+            "docs_per_second": self.docs_per_second,
+            "concurrency": self.concurrency,
+            "models": self.models,
+            "early_stops": self.early_stops,
+            "early_stops_estimated": self.early_stops_estimated,
+            "wait_avoided_tokens": self.wait_avoided_tokens,
+            "wait_avoided_seconds": self.wait_avoided_seconds,
+            "loops_cut": self.loops_cut,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "near_duplicates": self.near_duplicates,
+            "fallback": self.fallback,
+            "concurrency_limit": self.concurrency_limit,
+            "endpoints": self.endpoints,
+            "hedging": self.hedging,
+            "scheduler": self.scheduler,
+        }
+
+def collect_items(source: str, default_doc_type: str = "ktp") -> List[BatchItem]:
+    """
+    Collect batch items from a directory or a manifest file
+
+    A directory is scanned recursively for image files. A manifest is either
+    a text file with one `<path> [doc_type]` per line (`#` starts a comment)
+    or a JSONL file with `{"path": ..., "doc_type": ...}` records. Relative
+    manifest paths are resolved against the manifest's directory.
+    """
+    root = Path(source)
+
+    if root.is_dir():
+        return [
+            BatchItem(str(path), default_doc_type)
+            for path in sorted(root.rglob("*"))
+            if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+        ]
+
+    if not root.is_file():
+        raise FileNotFoundError(f"Batch source not found: {source}")
+
+    items = []
+    with open(root, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            if root.suffix.lower() == ".jsonl":
+                record = json.loads(line)
+                path = record["path"]
+                doc_type = record.get("doc_type", default_doc_type)
+            else:
+                parts = line.rsplit(maxsplit=1)
+                if len(parts) == 2 and not Path(line).exists():
+                    path, doc_type = parts
+                else:
+                    path, doc_type = line, default_doc_type
+
+            if not Path(path).is_absolute():
+                path = str(root.parent / path)
+            items.append(BatchItem(path, doc_type))
+
+    return items
+
+async def run_batch(
+    items: List[BatchItem],
+    extract: Callable[..., dict],
+    select_model: Callable[[str], str],
+    concurrency: int = 4,
+    model_id: Optional[str] = None,
+    on_result: Optional[Callable[[BatchItem, dict, int], None]] = None,
+    limiter: Optional[AdaptiveLimiter] = None,
+    scheduler: Optional[ModelAffinityScheduler] = None,
+) -> BatchSummary:
+    """
+    Extract all items with at most `concurrency` requests in flight
+
+    Args:
+        items: Documents to process
+        extract: extract_document-compatible callable
+        select_model: Maps a doc type to a model id (called once per doc type)
+        concurrency: Maximum number of in-flight extractions
+        model_id: Force a model for every item (skips selection)
+        on_result: Called as (item, result, completed_count) as results finish
+        limiter: Adapt the in-flight limit to server latency instead of
+            holding it at `concurrency` (which then only sizes the thread pool)
+        scheduler: Dispatch grouped by model instead of in item order; each
+            free slot takes the scheduler's next item
+
+    Returns:
+        BatchSummary with wall time and throughput
+    """
+    summary = BatchSummary(total=len(items), concurrency=concurrency)
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    # Resolve the model once per doc type instead of once per document
+    models = {}
+    for doc_type in sorted({item.doc_type for item in items}):
+        models[doc_type] = model_id or await loop.run_in_executor(
+            executor, select_model, doc_type
+        )
+
+    # Without a scheduler every slot takes the next item in order
+    if scheduler is not None:
+        for item in items:
+            scheduler.add(item, models[item.doc_type])
+    else:
+        pending = iter(items)
+
+    def next_item() -> BatchItem:
+        if scheduler is not None:
+            return scheduler.take()[0]
+        return next(pending)
+
+    async def run_one(item: BatchItem) -> dict:
+        try:
+            return await loop.run_in_executor(
+                executor,
+                lambda: extract(
+                    item.path,
+                    item.doc_type,
+                    model_id=models[item.doc_type],
+                    verbose=False,
+                ),
+            )
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    completed = 0
+
+    def record(item: BatchItem, result: dict):
+        nonlocal completed
+        completed += 1
+
+        if result.get("success"):
+            summary.succeeded += 1
+            model_used = result.get("model_used", "unknown")
+            summary.models[model_used] = summary.models.get(model_used, 0) + 1
+            early_stop = result.get("early_stop") or {}
+            if early_stop.get("stopped"):
+                summary.early_stops += 1
+                if early_stop["wait_avoided_tokens"] is not None:
+                    summary.early_stops_estimated += 1
+                    summary.wait_avoided_tokens += early_stop["wait_avoided_tokens"]
+                    summary.wait_avoided_seconds += early_stop["wait_avoided_seconds"]
+            if result.get("repetition"):
+                summary.loops_cut += 1
+            if result.get("coalesced"):
+                summary.coalesced += 1
+            if result.get("near_duplicate"):
+                summary.near_duplicates += 1
+        else:
+            summary.failed += 1
+
+        if on_result:
+            on_result(item, result, completed)
+
+    # Items are claimed by count before any await, so a worker never waits
+    # for a slot only to find the input exhausted
+    unclaimed = len(items)
+
+    async def worker():
+        nonlocal unclaimed
+        while unclaimed > 0:
+            unclaimed -= 1
+            if limiter is None:
+                item = next_item()
+                record(item, await run_one(item))
+                continue
+            started = await limiter.acquire()
+            item = next_item()
+            result = None
+            try:
+                result = await run_one(item)
+            finally:
+                await limiter.release(
+                    started,
+                    overloaded=is_overload(result),
+                    key=(models[item.doc_type], item.doc_type, (result or {}).get("page_count", 1)),
+                    sample=reached_server(result),
+                )
+            record(item, result)
+
+    start_time = time.monotonic()
+
+    try:
+        # One coroutine per slot, not per item: `concurrency` bounds the
+        # in-flight requests and the limiter (if any) bounds it further
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(items)))))
+    finally:
+        executor.shutdown(wait=False)
+
+    summary.wall_seconds = time.monotonic() - start_time
+    if limiter is not None:
+        summary.concurrency_limit = limiter.stats()
+    if scheduler is not None:
+        summary.scheduler = scheduler.stats()
+    return summary
+
+def format_result_line(item: BatchItem, result: dict, completed: int, total: int) -> str:
+    """One-line progress entry for a finished document"""
+    prefix = f"[{completed}/{total}] {item.path}"
+
+    if not result.get("success"):
+        return f"❌ {prefix}: {result.get('error', 'Unknown error')}"
+
+    details = [
+        result.get("model_used", "?"),
+        f"{result.get('duration_seconds', 0.0):.2f}s",
+    ]
+    if result.get("fields_count") is not None:
+        details.append(f"{result['fields_count']} fields")
+    if "validation" in result and not result["validation"].get("is_valid", True):
+        details.append("invalid")
+    if result.get("coalesced"):
+        details.append("coalesced")
+    if result.get("fallback", {}).get("escalated"):
+        details.append(f"escalated from {result['fallback']['chain'][0]}")
+    if result.get("near_duplicate"):
+        details.append(f"near-duplicate, distance {result['near_duplicate']['distance']}")
+    return f"✅ {prefix} ({', '.join(details)})"
+
+def print_batch_summary(summary: BatchSummary):
+    """Pretty print batch summary"""
+    print()
+    print("=" * 80)
+    print("📊 BATCH SUMMARY")
+    print("=" * 80)
+    print()
+    print(f"Documents: {summary.total} ({summary.succeeded} ok, {summary.failed} failed)")
+    if summary.skipped:
+        print(f"Skipped: {summary.skipped} completed in an earlier run")
+    if summary.concurrency_limit:
+        limit = summary.concurrency_limit
+        print(f"Concurrency: adaptive, limit {limit['limit']} of {summary.concurrency} "
+              f"(peak {limit['peak_limit']}, mean {limit['mean_limit']:.1f}, "
+              f"{limit['decreases']} backoffs, {limit['overloads']} overload errors, "
+              f"{limit['skipped']} served without the server)")
+    else:
+        print(f"Concurrency: {summary.concurrency}")
+    print(f"Wall Time: {summary.wall_seconds:.2f} seconds")
+    print(f"Throughput: {summary.docs_per_second:.2f} docs/second")
+
+    if summary.early_stops:
+        print(f"Early Stops: {summary.early_stops} documents, ~{summary.wait_avoided_tokens} tokens "
+              f"(~{summary.wait_avoided_seconds:.1f}s) of client wait avoided "
+              f"({summary.early_stops_estimated} with a learned output length)")
+    if summary.loops_cut:
+        print(f"Loops Cut: {summary.loops_cut} documents stopped on repeated output")
+    if summary.coalesced:
+        print(f"Coalesced: {summary.coalesced} documents shared an identical in-flight request")
+    if summary.near_duplicates:
+        print(f"Near-Duplicates: {summary.near_duplicates} rescans of earlier images")
+
+    if summary.models:
+        print()
+        print("Models:")
+        for model_id, count in sorted(summary.models.items()):
+            print(f"  - {model_id}: {count}")
+
+    if summary.fallback:
+        print()
+        print_fallback_stats(summary.fallback)
+
+    if summary.scheduler:
+        print()
+        print_scheduler_stats(summary.scheduler)
+
+    if summary.endpoints:
+        print()
+        print("Endpoints:")
+        print_endpoint_stats(summary.endpoints)
+    if summary.hedging:
+        print_hedging_stats(summary.hedging)
+
+    print()
+    print("=" * 80)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark events and stage totals in the crates/cli bench.rs JSON format
+Python tools record (stage, duration, fields) events here and write the
+same {"events": [...], "stage_totals": [...]} document as the Rust
+`--bench` runs, so compare_bench.py can put them side by side. Stage
+totals additionally carry p50/p90/p99 (compare_bench ignores them), and
+`recorded_at` holds the run's start as Unix time, so model_profiles.py can
+age samples by when they were measured.
+
+Usage:
+    python3 bench_report.py run.json
+"""
+
+import argparse
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ocr_client import percentile
+
+class BenchRecorder:
+    """Thread-safe collector of timed stage events"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._events: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, duration_ns: int, **fields):
+        """Add one event; fields become [{key, value}] like BenchEvent fields"""
+        event = {"stage": stage, "duration_ns": int(duration_ns), "fields": fields}
+        with self._lock:
+            self._events.append(event)
+
+    def record_seconds(self, stage: str, seconds: float, **fields):
+        self.record(stage, round(seconds * 1e9), **fields)
+
+    @contextmanager
+    def stage(self, stage: str, **fields):
+        """Time a block with perf_counter_ns and record it as `stage`"""
+        start = time.perf_counter_ns()
+        try:
+            yield fields
+        finally:
+            self.record(stage, time.perf_counter_ns() - start, **fields)
+
+    @property
+    def events(self) -> List[Dict]:
+        with self._lock:
+            return list(self._events)
+
+    def stage_totals(self) -> List[Dict]:
+        """Per-stage count/total/avg/min/max (bench.rs) plus percentiles"""
+        durations: Dict[str, List[int]] = {}
+        for event in self.events:
+            durations.setdefault(event["stage"], []).append(event["duration_ns"])
+
+        totals = []
+        for stage, values in durations.items():
+            total_ns = sum(values)
+            values_ms = [value / 1e6 for value in values]
+            totals.append({
+                "stage": stage,
+                "count": len(values),
+                "total_ms": total_ns / 1e6,
+                "total_ns": str(total_ns),
+                "avg_ms": total_ns / 1e6 / len(values),
+                "min_ms": min(values_ms),
+                "max_ms": max(values_ms),
+                "p50_ms": percentile(values_ms, 50),
+                "p90_ms": percentile(values_ms, 90),
+                "p99_ms": percentile(values_ms, 99),
+            })
+        return totals
+
+    def to_json(self, include_events: bool = True, **extra) -> Dict:
+        """bench.rs document; `extra` adds top-level keys (e.g. a summary)"""
+        events = [
+            {
+                "stage": event["stage"],
+                "duration_ms": event["duration_ns"] / 1e6,
+                "duration_ns": str(event["duration_ns"]),
+                "fields": [{"key": key, "value": value} for key, value in event["fields"].items()],
+            }
+            for event in self.events
+        ] if include_events else []
+        return {"events": events, "stage_totals": self.stage_totals(), "recorded_at": self.started_at, **extra}
+
+    def write(self, path: str, include_events: bool = True, **extra):
+        target = Path(path)
+        if target.parent and not target.parent.exists():
+            target.parent.mkdir(parents=True)
+        with open(target, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(include_events, **extra), f, indent=2, ensure_ascii=False)
+
+def print_stage_totals(totals: List[Dict], title: Optional[str] = None):
+    """Table of stage totals sorted by total time"""
+    if title:
+        print(title)
+    print(f"{'Stage':<28}{'Count':>7}{'Avg ms':>11}{'p50 ms':>11}{'p90 ms':>11}{'p99 ms':>11}{'Max ms':>11}")
+    for entry in sorted(totals, key=lambda item: item["total_ms"], reverse=True):
+        print(f"{entry['stage']:<28}{entry['count']:>7}{entry['avg_ms']:>11.1f}"
+              f"{entry.get('p50_ms', 0.0):>11.1f}{entry.get('p90_ms', 0.0):>11.1f}"
+              f"{entry.get('p99_ms', 0.0):>11.1f}{entry['max_ms']:>11.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Print stage totals of a benchmark JSON file")
+    parser.add_argument("path", help="Benchmark JSON (Rust --bench output or Python tools)")
+    args = parser.parse_args()
+
+    with open(args.path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    print_stage_totals(data.get("stage_totals", []), f"📊 {args.path}")
+
+if __name__ == "__main__":
+    main()
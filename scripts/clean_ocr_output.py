@@ -7,12 +7,17 @@ Usage:
     python3 clean_ocr_output.py < raw_output.txt
     atau
     echo "raw text" | python3 clean_ocr_output.py
+    python3 clean_ocr_output.py raw_output.txt --cut-loops
 """
 
+import argparse
 import sys
 import re
 from typing import Dict, List
 
+from field_extraction import FieldExtractor, FieldSpec
+from repetition_detector import truncate_repetitions
+
 def clean_xml_tags(text: str) -> str:
     """Remove XML-like tags from paddleocr-vl output"""
     # Remove common tags
@@ -33,37 +38,32 @@ def remove_duplicates(lines: List[str]) -> List[str]:
             prev = line
     return cleaned
 
+# KTP fields as label + value regexes (group 1 is the value) and lowercase label anchors
+KTP_FIELD_SPECS = [
+    FieldSpec('provinsi', r'(?:PROVINSI|Provinsi)', r'\s+([A-Z\s]+)', ('provinsi',)),
+    FieldSpec('kota', r'(?:KOTA|KABUPATEN|Kota|Kabupaten)', r'\s+([A-Z\s]+)', ('kota', 'kabupaten')),
+    FieldSpec('nik', r'(?:NIK|Nik)', r'\s*:?\s*(\d{16})', ('nik',)),
+    FieldSpec('nama', r'(?:Nama|NAMA)', r'\s*:?\s*([A-Z\s]+)', ('nama',)),
+    FieldSpec('tempat_lahir', r'(?:Tempat.*Lahir|TEMPAT.*LAHIR)', r'\s*:?\s*([A-Za-z\s]+),', ('tempat',)),
+    FieldSpec('tanggal_lahir', r',', r'\s*(\d{2}-\d{2}-\d{4})', (',',)),
+    FieldSpec('jenis_kelamin', r'(?:Jenis Kelamin|JENIS KELAMIN)', r'\s*:?\s*(LAKI-LAKI|PEREMPUAN)', ('jenis kelamin',)),
+    FieldSpec('gol_darah', r'(?:Gol.*Darah|GOL.*DARAH)', r'\s*:?\s*([ABO-]+)', ('gol',)),
+    FieldSpec('alamat', r'(?:Alamat|ALAMAT)', r'\s*:?\s*([A-Z0-9\s,\.]+)', ('alamat',)),
+    FieldSpec('rt_rw', r'(?:RT/RW|Rt/Rw)', r'\s*:?\s*(\d{3}/\d{3})', ('rt/rw',)),
+    FieldSpec('kelurahan', r'(?:Kel/Desa|KEL/DESA)', r'\s*:?\s*([A-Z\s]+)', ('kel/desa',)),
+    FieldSpec('kecamatan', r'(?:Kecamatan|KECAMATAN)', r'\s*:?\s*([A-Z\s]+)', ('kecamatan',)),
+    FieldSpec('agama', r'(?:Agama|AGAMA)', r'\s*:?\s*(ISLAM|KRISTEN|KATOLIK|HINDU|BUDDHA|KONGHUCU)', ('agama',)),
+    FieldSpec('status_kawin', r'(?:Status Perkawinan|STATUS PERKAWINAN)', r'\s*:?\s*(KAWIN|BELUM KAWIN|CERAI)', ('status perkawinan',)),
+    FieldSpec('pekerjaan', r'(?:Pekerjaan|PEKERJAAN)', r'\s*:?\s*([A-Z\s/]+)', ('pekerjaan',)),
+    FieldSpec('kewarganegaraan', r'(?:Kewarganegaraan|KEWARGANEGARAAN)', r'\s*:?\s*(WNI|WNA)', ('kewarganegaraan',)),
+    FieldSpec('berlaku', r'(?:Berlaku Hingga|BERLAKU HINGGA)', r'\s*:?\s*([A-Z\s]+|\d{2}-\d{2}-\d{4})', ('berlaku hingga',)),
+]
+
+_KTP_EXTRACTOR = FieldExtractor(KTP_FIELD_SPECS)
+
 def parse_ktp_fields(text: str) -> Dict[str, str]:
     """Parse KTP text into structured fields"""
-    fields = {}
-    
-    # Patterns for KTP fields
-    patterns = {
-        'provinsi': r'(?:PROVINSI|Provinsi)\s+([A-Z\s]+)',
-        'kota': r'(?:KOTA|KABUPATEN|Kota|Kabupaten)\s+([A-Z\s]+)',
-        'nik': r'(?:NIK|Nik)\s*:?\s*(\d{16})',
-        'nama': r'(?:Nama|NAMA)\s*:?\s*([A-Z\s]+)',
-        'tempat_lahir': r'(?:Tempat.*Lahir|TEMPAT.*LAHIR)\s*:?\s*([A-Za-z\s]+),',
-        'tanggal_lahir': r',\s*(\d{2}-\d{2}-\d{4})',
-        'jenis_kelamin': r'(?:Jenis Kelamin|JENIS KELAMIN)\s*:?\s*(LAKI-LAKI|PEREMPUAN)',
-        'gol_darah': r'(?:Gol.*Darah|GOL.*DARAH)\s*:?\s*([ABO-]+)',
-        'alamat': r'(?:Alamat|ALAMAT)\s*:?\s*([A-Z0-9\s,\.]+)',
-        'rt_rw': r'(?:RT/RW|Rt/Rw)\s*:?\s*(\d{3}/\d{3})',
-        'kelurahan': r'(?:Kel/Desa|KEL/DESA)\s*:?\s*([A-Z\s]+)',
-        'kecamatan': r'(?:Kecamatan|KECAMATAN)\s*:?\s*([A-Z\s]+)',
-        'agama': r'(?:Agama|AGAMA)\s*:?\s*(ISLAM|KRISTEN|KATOLIK|HINDU|BUDDHA|KONGHUCU)',
-        'status_kawin': r'(?:Status Perkawinan|STATUS PERKAWINAN)\s*:?\s*(KAWIN|BELUM KAWIN|CERAI)',
-        'pekerjaan': r'(?:Pekerjaan|PEKERJAAN)\s*:?\s*([A-Z\s/]+)',
-        'kewarganegaraan': r'(?:Kewarganegaraan|KEWARGANEGARAAN)\s*:?\s*(WNI|WNA)',
-        'berlaku': r'(?:Berlaku Hingga|BERLAKU HINGGA)\s*:?\s*([A-Z\s]+|\d{2}-\d{2}-\d{4})',
-    }
-    
-    for field, pattern in patterns.items():
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            fields[field] = match.group(1).strip()
-    
-    return fields
+    return _KTP_EXTRACTOR.search(text)
 
 def format_ktp_output(fields: Dict[str, str]) -> str:
     """Format KTP fields into readable output"""
@@ -128,9 +128,18 @@ def format_as_json(fields: Dict[str, str]) -> str:
     return json.dumps(fields, indent=2, ensure_ascii=False)
 
 def main():
+    parser = argparse.ArgumentParser(description="Clean paddleocr-vl output and parse KTP fields")
+    parser.add_argument('file', nargs='?', help='Raw output file (default: stdin)')
+    parser.add_argument(
+        '--cut-loops',
+        action='store_true',
+        help='Cut the output at a back-to-back repetition loop (see repetition_detector.py)'
+    )
+    args = parser.parse_args()
+    
     # Read input from stdin or file
-    if len(sys.argv) > 1:
-        with open(sys.argv[1], 'r', encoding='utf-8') as f:
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
             raw_text = f.read()
     else:
         raw_text = sys.stdin.read()
@@ -138,7 +147,12 @@ def main():
     # Step 1: Clean XML tags
     cleaned_text = clean_xml_tags(raw_text)
     
-    # Step 2: Remove duplicate lines
+    # Step 2: Optionally cut a repetition loop, then drop duplicate lines
+    if args.cut_loops:
+        cleaned_text, loop_info = truncate_repetitions(cleaned_text)
+        if loop_info:
+            print(f"\n✂️  Repetition loop removed at char {loop_info.cut_at} "
+                  f"(period {loop_info.period}, {loop_info.repeats} copies)")
     lines = cleaned_text.split('\n')
     unique_lines = remove_duplicates(lines)
     cleaned_text = '\n'.join(unique_lines)
@@ -37,6 +37,11 @@ FRIENDLY_STAGE_NAMES: Dict[str, str] = {
     "vision.prepare_inputs": "Vision – Prepare Inputs",
     "vision.compute_projection": "Vision – Project Features",
     "vision.prepare_masks": "Vision – Prepare Masks",
+    "load.end_to_end": "Load – End-to-End Latency",
+    "load.queue": "Load – Client Queue",
+    "load.service": "Load – Request Service",
+    "load.ttft": "Load – Time to First Token",
+    "load.generate": "Load – Token Generation",
 }
 
 
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Adaptive client concurrency for DeepSeek-OCR batch runs
+The server runs one generation at a time per model (SharedModel mutex), so
+requests beyond what it can absorb only wait in its queue until they hit
+the client read timeout. AdaptiveLimiter finds the useful number of
+in-flight requests from observed latency (AIMD):
+
+  - baseline: the uncontended latency, a running minimum that drifts up
+    slowly (`baseline_drift` per sample) so it follows heavier documents.
+    One baseline is kept per key (model, doc type and page count in batch
+    runs), so a fast document type does not make a slow one look
+    overloaded. Results that never reached the server (cache hits,
+    coalesced waits) are not latency samples: a 1 ms hit would pin the
+    baseline and make every real request look slow
+  - additive increase: every completion within `tolerance` x baseline adds
+    1/limit, i.e. about one slot per round of `limit` completions
+  - multiplicative decrease: a completion slower than that, a timeout, a
+    connection error or a 5xx multiplies the limit by `backoff`, at most
+    once per round trip (requests sent before the last decrease are not
+    counted again)
+
+With one server the limit settles around tolerance (one request generating,
+one queued); with an EndpointPool it grows with the number of servers.
+
+Usage:
+    python3 test_extraction.py --batch scans/ --concurrency 16 --adaptive-concurrency
+"""
+
+import asyncio
+import time
+from typing import Dict, Hashable, Optional
+
+OVERLOAD_ERROR_MARKERS = ("timed out", "timeout", "Connection refused", "API error: 5")
+
+def is_overload(result: Optional[Dict]) -> bool:
+    """True for failures that mean "send less": timeouts, refused connections, 5xx"""
+    if not result or result.get("success"):
+        return False
+    error = str(result.get("error", ""))
+    return any(marker in error for marker in OVERLOAD_ERROR_MARKERS)
+
+def reached_server(result: Optional[Dict]) -> bool:
+    """False for results answered without a generation (cache hits, coalesced waits)"""
+    if not result:
+        return True
+    if result.get("pages"):
+        return any(reached_server(page) for page in result["pages"])
+    return not (result.get("cache_hit") or result.get("coalesced"))
+
+class AdaptiveLimiter:
+    """AIMD limit on in-flight requests for asyncio workers"""
+
+    def __init__(
+        self,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        initial_limit: Optional[int] = None,
+        tolerance: float = 2.0,
+        backoff: float = 0.7,
+        baseline_drift: float = 0.001,
+    ):
+        """
+        Args:
+            min_limit: Never go below this many in-flight requests
+            max_limit: Never go above this many (e.g. --concurrency)
+            initial_limit: Starting limit (default: min_limit)
+            tolerance: Latency up to tolerance x baseline counts as uncontended
+            backoff: Multiplier applied to the limit on overload
+            baseline_drift: Relative upward drift of the baseline per sample
+        """
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("Need 1 <= min_limit <= max_limit")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.baseline_drift = baseline_drift
+        self._limit = float(initial_limit or min_limit)
+        self.in_flight = 0
+        self.baselines: Dict[Hashable, float] = {}
+        self._condition = asyncio.Condition()
+        self._last_decrease = 0.0
+        self._stats = {"samples": 0, "skipped": 0, "increases": 0, "decreases": 0, "overloads": 0}
+        self._peak = self.limit
+        self._started = time.monotonic()
+        self._changed = self._started
+        self._limit_seconds = 0.0  # Integral of limit over time, for the mean
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, min(self.max_limit, int(self._limit)))
+
+    async def acquire(self) -> float:
+        """Wait for a free slot; returns the start time to pass to release()"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(
+        self,
+        started: float,
+        overloaded: bool = False,
+        key: Hashable = None,
+        sample: bool = True,
+    ):
+        """
+        Free a slot and adjust the limit from this request's latency
+
+        Args:
+            started: Value returned by acquire()
+            overloaded: The request failed with a timeout, refusal or 5xx
+            key: Latency class of the request (its own baseline)
+            sample: False when the server was not involved (cache hit,
+                coalesced); the slot is freed without adjusting the limit
+        """
+        now = time.monotonic()
+        async with self._condition:
+            self.in_flight -= 1
+            if sample or overloaded:
+                self._observe(started, now - started, overloaded, now, key)
+            else:
+                self._stats["skipped"] += 1
+            self._condition.notify_all()
+
+    def _observe(self, started: float, latency: float, overloaded: bool, now: float, key: Hashable = None):
+        self._stats["samples"] += 1
+        baseline = self.baselines.get(key)
+        if overloaded:
+            self._stats["overloads"] += 1
+        else:
+            if baseline is None:
+                baseline = latency
+            else:
+                baseline = min(latency, baseline * (1 + self.baseline_drift))
+            self.baselines[key] = baseline
+
+        before = self.limit
+        if overloaded or (baseline is not None and latency > self.tolerance * baseline):
+            if started >= self._last_decrease:
+                self._limit = max(float(self.min_limit), self._limit * self.backoff)
+                self._last_decrease = now
+                self._stats["decreases"] += 1
+        else:
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+
+        if self.limit != before:
+            if self.limit > before:
+                self._stats["increases"] += 1
+            self._limit_seconds += before * (now - self._changed)
+            self._changed = now
+            self._peak = max(self._peak, self.limit)
+
+    def stats(self) -> Dict:
+        """Current limit and how it moved; `limit` is the exported gauge"""
+        now = time.monotonic()
+        elapsed = now - self._started
+        limit_seconds = self._limit_seconds + self.limit * (now - self._changed)
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "peak_limit": self._peak,
+            "mean_limit": limit_seconds / elapsed if elapsed > 0 else float(self.limit),
+            "baseline_seconds": {
+                "/".join(map(str, key)) if isinstance(key, tuple) else str(key): seconds
+                for key, seconds in self.baselines.items()
+            },
+            **self._stats,
+        }
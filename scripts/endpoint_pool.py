@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+Multi-server dispatch for DeepSeek-OCR
+Every server keeps one model behind a Mutex and runs one generation at a
+time, so throughput scales by running several servers. EndpointPool spreads
+requests over them:
+
+  - least outstanding requests: each request goes to the endpoint with the
+    fewest requests in flight
+  - model affinity: /v1/models tells which models an endpoint can serve,
+    but not which one is loaded. The server swaps models on demand, so the
+    pool remembers the model of each endpoint's last request and charges
+    `swap_cost` extra outstanding requests to endpoints that would have to
+    swap
+  - health: /health is probed in the background; endpoints failing
+    `fail_threshold` times in a row (probes or requests) are ejected and
+    come back after `recover_threshold` successful probes
+  - hedging (optional, streaming only): a stream that has not produced its
+    first delta within the observed `hedge_percentile` TTFT of its model is
+    sent a second time to another endpoint. The first to deliver a delta
+    wins and the other stream is closed. Hedges are paid from a credit that
+    grows by `hedge_budget` per request, so at most that share of traffic
+    is duplicated. The server stops decoding at the next token once the
+    closed stream's client is gone, but a loser still in its queue or
+    prefill runs until then, so its slot stays charged for the expected
+    remaining TTFT. Servers built before that cancellation decode the loser
+    to max_tokens; the pool cannot see this and under-counts their load
+
+EndpointPool offers the OCRClient methods used by extract_document (post,
+stream_chat, get, health, close), so it can be passed as `client=`.
+
+Usage:
+    python3 test_extraction.py --batch scans/ --endpoints http://gpu1:23333/v1 http://gpu2:23333/v1
+    python3 endpoint_pool.py http://gpu1:23333/v1 http://gpu2:23333/v1
+"""
+
+import argparse
+import collections
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import requests
+
+from ocr_client import DEFAULT_API_KEY, RETRY_STATUS_CODES, ChatStream, OCRClient, percentile
+
+class Endpoint:
+    """One server: its client, health state, loaded model and request stats"""
+
+    def __init__(self, client: OCRClient, latency_window: int = 1000):
+        self.client = client
+        self.api_base = client.api_base
+        self.healthy = True
+        self.models: Optional[Set[str]] = None   # None: unknown, assume all
+        self.loaded_model: Optional[str] = None
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.requests = 0
+        self.errors = 0
+        self.swaps = 0
+        self.ejections = 0
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.busy_seconds = 0.0
+
+    def serves(self, model_id: Optional[str]) -> bool:
+        return model_id is None or self.models is None or model_id in self.models
+
+    def to_dict(self, wall_seconds: float) -> Dict:
+        latencies = list(self.latencies)
+        completed = self.requests - self.errors
+        return {
+            "api_base": self.api_base,
+            "healthy": self.healthy,
+            "loaded_model": self.loaded_model,
+            "requests": self.requests,
+            "errors": self.errors,
+            "swaps": self.swaps,
+            "ejections": self.ejections,
+            "outstanding": self.outstanding,
+            "docs_per_second": completed / wall_seconds if wall_seconds > 0 else 0.0,
+            "utilization": self.busy_seconds / wall_seconds if wall_seconds > 0 else 0.0,
+            "latency_seconds": {
+                "avg": sum(latencies) / len(latencies) if latencies else 0.0,
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p99": percentile(latencies, 99),
+            },
+        }
+
+class EndpointPool:
+    """Route requests across several OCR servers"""
+
+    def __init__(
+        self,
+        api_bases: List[str],
+        api_key: str = DEFAULT_API_KEY,
+        probe_interval: float = 5.0,
+        fail_threshold: int = 2,
+        recover_threshold: int = 1,
+        max_retries: int = 2,
+        swap_cost: float = 1.0,
+        hedge_percentile: Optional[float] = None,
+        hedge_budget: float = 0.05,
+        hedge_min_samples: int = 20,
+        **client_kwargs: Any,
+    ):
+        """
+        Args:
+            api_bases: Server base URLs including the /v1 prefix
+            api_key: Bearer token sent with every request
+            probe_interval: Seconds between background health probes (0 disables)
+            fail_threshold: Consecutive failures before an endpoint is ejected
+            recover_threshold: Consecutive good probes before it is used again
+            max_retries: Extra attempts on other endpoints after a connection
+                error or 5xx (not after a read timeout)
+            swap_cost: Outstanding requests a model swap is considered worth
+            hedge_percentile: Hedge streams slower to a first delta than this
+                TTFT percentile (None disables hedging)
+            hedge_budget: Largest share of streams that may be hedged
+            hedge_min_samples: TTFT samples per model before hedging starts
+            client_kwargs: Passed to each endpoint's OCRClient (timeouts, pool size)
+        """
+        if not api_bases:
+            raise ValueError("EndpointPool needs at least one endpoint")
+
+        # Failover happens across endpoints, so per-endpoint clients do not retry
+        client_kwargs["max_retries"] = 0
+        self.endpoints = [
+            Endpoint(OCRClient(api_base, api_key, **client_kwargs)) for api_base in api_bases
+        ]
+        self.api_base = self.endpoints[0].api_base if len(self.endpoints) == 1 else \
+            f"pool[{', '.join(endpoint.api_base for endpoint in self.endpoints)}]"
+        self.fail_threshold = fail_threshold
+        self.recover_threshold = recover_threshold
+        self.max_retries = max_retries
+        self.swap_cost = swap_cost
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.hedge_min_samples = hedge_min_samples
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+        self.hedge_stats = {
+            "streams": 0, "hedged": 0, "hedge_wins": 0, "skipped_budget": 0,
+            "loser_tokens": 0, "loser_seconds": 0.0, "served_seconds": 0.0,
+        }
+        self._ttft: Dict[Optional[str], collections.deque] = {}
+        self._hedge_credit = 0.0
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stop = threading.Event()
+
+        for endpoint in self.endpoints:
+            self.probe(endpoint)
+            # Unreachable at startup: wait for the prober instead of the threshold
+            endpoint.healthy = endpoint.consecutive_failures == 0
+
+        self._prober = None
+        if probe_interval > 0:
+            self._prober = threading.Thread(
+                target=self._probe_loop, args=(probe_interval,), name="endpoint-probe", daemon=True
+            )
+            self._prober.start()
+
+    # Health
+
+    def probe(self, endpoint: Endpoint):
+        """Check /health (and learn /v1/models) for one endpoint"""
+        ok = endpoint.client.health()
+        if ok and endpoint.models is None:
+            endpoint.models = self._fetch_models(endpoint)
+        with self._lock:
+            if ok:
+                endpoint.consecutive_failures = 0
+                endpoint.consecutive_successes += 1
+                if not endpoint.healthy and endpoint.consecutive_successes >= self.recover_threshold:
+                    endpoint.healthy = True
+                    endpoint.loaded_model = None  # Restarted servers start empty
+            else:
+                endpoint.consecutive_successes = 0
+                self._record_failure(endpoint)
+
+    def _fetch_models(self, endpoint: Endpoint) -> Optional[Set[str]]:
+        try:
+            response = endpoint.client.get("/models", timeout=endpoint.client.connect_timeout)
+            if response.status_code == 200:
+                return {entry["id"] for entry in response.json().get("data", [])}
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            pass
+        return None
+
+    def _probe_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            for endpoint in self.endpoints:
+                self.probe(endpoint)
+
+    def _record_failure(self, endpoint: Endpoint):
+        """Count a failure (caller holds the lock); eject at the threshold"""
+        endpoint.consecutive_failures += 1
+        endpoint.consecutive_successes = 0
+        if endpoint.healthy and endpoint.consecutive_failures >= self.fail_threshold:
+            endpoint.healthy = False
+            endpoint.ejections += 1
+
+    # Routing
+
+    def choose(self, model_id: Optional[str] = None, exclude: Optional[Set[int]] = None) -> Endpoint:
+        """
+        Pick an endpoint and reserve a slot on it
+
+        Healthy endpoints that can serve the model are ranked by outstanding
+        requests plus swap_cost when the endpoint has another model loaded;
+        ties go to the endpoint with fewer requests so far.
+        """
+        exclude = exclude or set()
+        with self._lock:
+            candidates = [
+                endpoint for index, endpoint in enumerate(self.endpoints)
+                if endpoint.healthy and index not in exclude and endpoint.serves(model_id)
+            ]
+            if not candidates:
+                raise requests.exceptions.ConnectionError(
+                    f"No healthy endpoint available for model {model_id or '(any)'}"
+                )
+            endpoint = min(
+                candidates,
+                key=lambda candidate: (
+                    candidate.outstanding + (self.swap_cost if self._needs_swap(candidate, model_id) else 0),
+                    candidate.requests,
+                ),
+            )
+            if self._needs_swap(endpoint, model_id):
+                endpoint.swaps += 1
+            if model_id is not None:
+                endpoint.loaded_model = model_id
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            self.stats["requests"] += 1
+            return endpoint
+
+    @staticmethod
+    def _needs_swap(endpoint: Endpoint, model_id: Optional[str]) -> bool:
+        return model_id is not None and endpoint.loaded_model not in (None, model_id)
+
+    def _release(self, endpoint: Endpoint, started: float, ok: bool, linger: float = 0.0):
+        if linger > 0:
+            # The server is still working on a request the client dropped
+            timer = threading.Timer(linger, self._release, args=(endpoint, started, ok))
+            timer.daemon = True
+            timer.start()
+            return
+        elapsed = time.monotonic() - started
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.busy_seconds += elapsed
+            if ok:
+                endpoint.consecutive_failures = 0
+                endpoint.latencies.append(elapsed)
+            else:
+                endpoint.errors += 1
+                self._record_failure(endpoint)
+
+    def _dispatch(self, model_id: Optional[str], send, tried: Optional[Set[int]] = None):
+        """
+        Run `send(endpoint)` with failover to other endpoints
+
+        Indexes of the endpoints used are added to `tried` as they are picked,
+        under the pool lock, so another thread may snapshot it while holding it.
+        Connection errors and retryable statuses (returned, or raised as
+        HTTPError by stream_chat) count against the endpoint and move on to
+        the next one. Read timeouts count against the endpoint but are not
+        re-sent, so a slow generation is not started twice.
+        """
+        tried = set() if tried is None else tried
+        attempt = 0
+        while True:
+            endpoint = self.choose(model_id, tried)
+            with self._lock:
+                tried.add(self.endpoints.index(endpoint))
+            started = time.monotonic()
+            try:
+                result = send(endpoint)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
+                status = getattr(e.response, "status_code", None)
+                if isinstance(e, requests.exceptions.HTTPError) and status not in RETRY_STATUS_CODES:
+                    self._release(endpoint, started, ok=True)  # The request was refused, not the endpoint broken
+                    raise
+                self._release(endpoint, started, ok=False)
+                if isinstance(e, requests.exceptions.ReadTimeout) or \
+                        attempt >= self.max_retries or len(tried) >= len(self.endpoints):
+                    with self._lock:
+                        self.stats["failures"] += 1
+                    raise
+            else:
+                status = getattr(result, "status_code", None)
+                if isinstance(result, ChatStream):
+                    # Slot stays reserved until the stream is exhausted or closed
+                    result.add_done_callback(
+                        lambda stream: self._release(
+                            endpoint, started, ok=stream.error is None, linger=stream.linger
+                        )
+                    )
+                    return result
+                failed = status in RETRY_STATUS_CODES
+                self._release(endpoint, started, ok=not failed)
+                if not failed or attempt >= self.max_retries or len(tried) >= len(self.endpoints):
+                    return result
+                result.close()
+            attempt += 1
+            with self._lock:
+                self.stats["retries"] += 1
+
+    # OCRClient-compatible interface
+
+    def post(self, path: str, payload: Any = None, data: Optional[bytes] = None, **kwargs) -> requests.Response:
+        model_id = payload.get("model") if isinstance(payload, dict) else None
+        return self._dispatch(model_id, lambda endpoint: endpoint.client.post(path, payload, data=data, **kwargs))
+
+    def stream_chat(self, payload: Dict, path: str = "/chat/completions", data: Optional[bytes] = None) -> ChatStream:
+        if self.hedge_percentile is None or len(self.endpoints) < 2:
+            return self._dispatch(payload.get("model"), lambda endpoint: endpoint.client.stream_chat(payload, path, data=data))
+        return self._hedged_stream(payload, path, data)
+
+    # Hedging
+
+    def hedge_threshold(self, model_id: Optional[str]) -> Optional[float]:
+        """TTFT after which a stream is hedged; None until enough samples"""
+        with self._lock:
+            samples = list(self._ttft.get(model_id, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return percentile(samples, self.hedge_percentile)
+
+    def _take_hedge_credit(self) -> bool:
+        with self._lock:
+            if self._hedge_credit >= 1.0:
+                self._hedge_credit -= 1.0
+                self.hedge_stats["hedged"] += 1
+                return True
+            self.hedge_stats["skipped_budget"] += 1
+            return False
+
+    def _hedged_stream(self, payload: Dict, path: str, data: Optional[bytes]) -> "HedgedStream":
+        """
+        Stream with a backup request once the first delta is overdue
+
+        Each attempt runs in a thread that opens the stream (the server
+        sends headers with the first token) and reads the first delta. The
+        first attempt to get one, or to finish, wins; the loser is closed,
+        which drops its connection. See `_abandon` for what that costs.
+        """
+        model_id = payload.get("model")
+        started = time.perf_counter()
+        arrivals: queue.Queue = queue.Queue()
+        decided = threading.Event()
+        streams: List[ChatStream] = []
+        streams_lock = threading.Lock()
+        with self._lock:
+            self.hedge_stats["streams"] += 1
+            self._hedge_credit = min(self._hedge_credit + self.hedge_budget, 1.0 + self.hedge_budget)
+
+        def attempt(tried: Set[int], hedge: bool):
+            try:
+                stream = self._dispatch(
+                    model_id, lambda endpoint: endpoint.client.stream_chat(payload, path, data=data), tried
+                )
+            except Exception as e:
+                arrivals.put((hedge, None, None, None, e))
+                return
+            with streams_lock:
+                late = decided.is_set()
+                streams.append(stream)
+            if late:
+                self._abandon(stream, model_id)
+                return
+            iterator = iter(stream)
+            try:
+                first = next(iterator, None)
+            except Exception as e:
+                arrivals.put((hedge, stream, None, None, e))
+                return
+            arrivals.put((hedge, stream, iterator, first, None))
+
+        primary_tried: Set[int] = set()
+        threading.Thread(target=attempt, args=(primary_tried, False), daemon=True).start()
+        pending = 1
+        hedged = False
+        threshold = self.hedge_threshold(model_id)
+        while True:
+            timeout = None
+            if threshold is not None:
+                timeout = max(0.0, started + threshold - time.perf_counter())
+            try:
+                hedge, stream, iterator, first, error = arrivals.get(timeout=timeout)
+            except queue.Empty:
+                threshold = None  # At most one hedge per request
+                if self._take_hedge_credit():
+                    with self._lock:
+                        hedge_tried = set(primary_tried)  # The primary may still be failing over
+                    threading.Thread(target=attempt, args=(hedge_tried, True), daemon=True).start()
+                    pending += 1
+                    hedged = True
+                continue
+            pending -= 1
+            if error is not None and pending > 0:
+                continue  # The other attempt may still succeed
+            break
+
+        with streams_lock:
+            decided.set()
+            losers = [other for other in streams if other is not stream]
+        for loser in losers:
+            self._abandon(loser, model_id)
+        if error is not None:
+            raise error
+
+        ttft = time.perf_counter() - started
+        with self._lock:
+            self._ttft.setdefault(model_id, collections.deque(maxlen=1000)).append(ttft)
+            if hedge:
+                self.hedge_stats["hedge_wins"] += 1
+        if hedge:
+            # Report latency as the caller saw it, from the original request
+            stream.metrics.start = started
+        stream.add_done_callback(self._record_served)
+        return HedgedStream(stream, first, iterator, hedged=hedged)
+
+    def _abandon(self, stream: ChatStream, model_id: Optional[str]):
+        """
+        Close a losing attempt and account for the server work it still costs
+
+        The server checks for a gone client after every token, so a loser
+        that already streamed stops at once. One that has not reached its
+        first token still finishes queueing and prefill; its endpoint stays
+        charged for the median TTFT left, so choose() does not route new
+        work to a server that is busy with it.
+        """
+        if stream.closed:
+            return
+        if stream.metrics.first_delta is None:
+            with self._lock:
+                samples = list(self._ttft.get(model_id, ()))
+            if samples:
+                stream.linger = max(0.0, percentile(samples, 50) - stream.metrics.total_seconds)
+        stream.close()
+        with self._lock:
+            # +1: the token the server was decoding when the client went away
+            self.hedge_stats["loser_tokens"] += stream.metrics.tokens + 1
+            self.hedge_stats["loser_seconds"] += stream.metrics.total_seconds + stream.linger
+
+    def _record_served(self, stream: ChatStream):
+        with self._lock:
+            self.hedge_stats["served_seconds"] += stream.metrics.total_seconds
+
+    def reset_hedging_stats(self):
+        """Zero the hedge counters (TTFT samples are kept)"""
+        with self._lock:
+            self.hedge_stats = dict.fromkeys(self.hedge_stats, 0)
+
+    def hedging_stats(self) -> Dict:
+        """
+        Hedges sent, how often they won, and the extra load they cost
+
+        extra_load is server time spent on losing attempts (until close plus
+        the charged linger) over the time of the streams that were served,
+        and loser_tokens the tokens those attempts decoded. Both assume the
+        server stops a stream whose client is gone.
+        """
+        with self._lock:
+            stats = dict(self.hedge_stats)
+            thresholds = {model: len(samples) for model, samples in self._ttft.items()}
+        stats["extra_load"] = stats["loser_seconds"] / stats["served_seconds"] if stats["served_seconds"] else 0.0
+        stats["win_rate"] = stats["hedge_wins"] / stats["hedged"] if stats["hedged"] else 0.0
+        stats["thresholds"] = {model: self.hedge_threshold(model) for model in thresholds}
+        return stats
+
+    def chat_completion(self, payload: Dict) -> Dict:
+        response = self.post("/chat/completions", payload)
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self._dispatch(None, lambda endpoint: endpoint.client.get(path, **kwargs))
+
+    def health(self) -> bool:
+        """True if at least one endpoint is healthy"""
+        return any(endpoint.healthy for endpoint in self.endpoints)
+
+    def endpoint_stats(self) -> List[Dict]:
+        wall_seconds = time.monotonic() - self._started
+        with self._lock:
+            return [endpoint.to_dict(wall_seconds) for endpoint in self.endpoints]
+
+    def close(self):
+        self._stop.set()
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class HedgedStream:
+    """ChatStream view of the attempt that won a hedged request"""
+
+    def __init__(self, stream: ChatStream, first: Optional[str], iterator: Iterator[str], hedged: bool):
+        self.stream = stream
+        self.hedged = hedged
+        self._first = first
+        self._iterator = iterator
+
+    def __iter__(self) -> Iterator[str]:
+        if self._first is not None:
+            first, self._first = self._first, None
+            yield first
+        yield from self._iterator
+
+    def __getattr__(self, name: str):
+        # content, usage, metrics, finish_reason, closed, add_done_callback
+        return getattr(self.stream, name)
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def print_hedging_stats(stats: Dict):
+    """One line of hedging volume and outcome"""
+    print(f"🪁 Hedging: {stats['hedged']}/{stats['streams']} streams hedged "
+          f"(+{stats['extra_load'] * 100:.1f}% server time, {stats['loser_tokens']} tokens "
+          f"decoded by losers), {stats['hedge_wins']} won by the hedge "
+          f"({stats['win_rate'] * 100:.0f}%), {stats['skipped_budget']} over budget")
+    for model, threshold in sorted(stats["thresholds"].items(), key=lambda item: str(item[0])):
+        if threshold is not None:
+            print(f"   {model}: hedge after {threshold:.2f}s")
+
+def print_endpoint_stats(stats: List[Dict]):
+    """Per-endpoint throughput and latency table"""
+    print(f"{'Endpoint':<36}{'State':>9}{'Reqs':>7}{'Errs':>6}{'Swaps':>7}{'Docs/s':>9}{'Util':>7}{'p50 s':>8}{'p90 s':>8}")
+    for entry in stats:
+        latency = entry["latency_seconds"]
+        state = "up" if entry["healthy"] else "ejected"
+        print(f"{entry['api_base']:<36}{state:>9}{entry['requests']:>7}{entry['errors']:>6}"
+              f"{entry['swaps']:>7}{entry['docs_per_second']:>9.3f}{entry['utilization'] * 100:>6.0f}%"
+              f"{latency['p50']:>8.2f}{latency['p90']:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Probe a pool of OCR endpoints")
+    parser.add_argument("endpoints", nargs="+", help="Server base URLs (including /v1)")
+    args = parser.parse_args()
+
+    pool = EndpointPool(args.endpoints, probe_interval=0)
+    print("🌐 Endpoint pool")
+    print("=" * 80)
+    for endpoint in pool.endpoints:
+        status = "✅ healthy" if endpoint.healthy else "❌ unreachable"
+        models = ", ".join(sorted(endpoint.models)) if endpoint.models else "unknown"
+        print(f"{endpoint.api_base}: {status}")
+        print(f"   Models: {models}")
+    pool.close()
+
+if __name__ == "__main__":
+    main()
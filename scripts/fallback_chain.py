@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Validation-driven model fallback for DeepSeek-OCR
+ModelSelector.DOC_TYPE_MAPPING names two models per document type. The
+fallback chain runs the faster of the two first, checks the result (request
+errors, KTPCleaner validation, unparseable JSON for other doc types) and
+sends only the documents that fail to the next model. Most traffic then
+runs on the cheap model and only the hard documents pay for the expensive
+one.
+
+Per tier the chain tracks attempts, accepted results, escalations and
+cumulative latency, so the escalation rate shows whether the cheap model is
+good enough for a document type.
+
+Usage:
+    python3 test_extraction.py scan.jpg ktp --fallback
+    python3 test_extraction.py --batch scans/ --fallback
+    python3 fallback_chain.py --doc-type ktp
+"""
+
+import argparse
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from model_selector import ModelSelector, parse_document_type
+
+def model_chain(doc_type: str) -> List[str]:
+    """Mapped models for a doc type, fastest first"""
+    primary, fallback = ModelSelector.DOC_TYPE_MAPPING[parse_document_type(doc_type)]
+    return sorted([primary, fallback], key=lambda model: ModelSelector.MODELS[model].speed_seconds)
+
+def escalation_reason(result: Dict) -> Optional[str]:
+    """Why a result is not usable, or None if it is"""
+    if not result.get("success"):
+        return result.get("error", "request failed")
+    validation = result.get("validation")
+    if validation is not None and not validation.get("is_valid", True):
+        errors = validation.get("errors") or ["validation failed"]
+        return errors[0]
+    if "validation" not in result and result.get("extracted_data") is None:
+        return "response is not valid JSON"
+    return None
+
+def _score(result: Dict) -> tuple:
+    """Rank results when every tier failed: usable, then field count"""
+    return (escalation_reason(result) is None, bool(result.get("success")), result.get("fields_count") or 0)
+
+class FallbackChain:
+    """Run an extract function down a model chain until a result validates"""
+
+    def __init__(
+        self,
+        extract: Callable[..., dict],
+        chain_for: Callable[[str], List[str]] = model_chain,
+    ):
+        """
+        Args:
+            extract: extract_document-compatible callable
+            chain_for: Maps a doc type to its models, cheapest first
+        """
+        self.extract = extract
+        self.chain_for = chain_for
+        self._lock = threading.Lock()
+        self._tiers: Dict[int, Dict] = {}
+        self._doc_types: Dict[str, Dict[str, int]] = {}
+
+    def __call__(self, image_path: str, doc_type: str = "ktp", model_id: Optional[str] = None, **kwargs) -> dict:
+        """
+        Extract with escalation
+
+        A given model_id becomes the first tier, followed by the rest of
+        the doc type's chain.
+        """
+        chain = self.chain_for(doc_type)
+        if model_id:
+            chain = [model_id] + [model for model in chain if model != model_id]
+
+        attempts = []
+        results = []
+        for tier, model in enumerate(chain):
+            start = time.perf_counter()
+            result = self.extract(image_path, doc_type, model_id=model, **kwargs)
+            seconds = time.perf_counter() - start
+            reason = escalation_reason(result)
+            results.append(result)
+            attempts.append({"tier": tier, "model": model, "seconds": seconds, "accepted": reason is None})
+            if reason is not None:
+                attempts[-1]["reason"] = reason
+            self._record(tier, model, seconds, reason is None, last=tier == len(chain) - 1)
+            if reason is None:
+                break
+
+        if attempts[-1]["accepted"]:
+            final_tier = len(results) - 1
+        else:
+            # Every tier failed: keep the most useful result, cheapest on ties
+            final_tier = max(range(len(results)), key=lambda tier: (_score(results[tier]), -tier))
+        final = dict(results[final_tier])
+        final["fallback"] = {
+            "chain": chain,
+            "tier": final_tier,
+            "escalated": len(attempts) > 1,
+            "attempts": attempts,
+            "total_seconds": sum(attempt["seconds"] for attempt in attempts),
+        }
+        with self._lock:
+            counts = self._doc_types.setdefault(doc_type, {"documents": 0, "escalated": 0, "unresolved": 0})
+            counts["documents"] += 1
+            counts["escalated"] += len(attempts) > 1
+            counts["unresolved"] += not attempts[-1]["accepted"]
+        return final
+
+    def _record(self, tier: int, model: str, seconds: float, accepted: bool, last: bool):
+        with self._lock:
+            stats = self._tiers.setdefault(tier, {
+                "attempts": 0, "accepted": 0, "escalated": 0, "unresolved": 0,
+                "seconds": 0.0, "models": {},
+            })
+            stats["attempts"] += 1
+            stats["seconds"] += seconds
+            stats["models"][model] = stats["models"].get(model, 0) + 1
+            if accepted:
+                stats["accepted"] += 1
+            elif last:
+                stats["unresolved"] += 1
+            else:
+                stats["escalated"] += 1
+
+    def stats(self) -> Dict:
+        """Per-tier attempts, escalation rate and cumulative latency; per-doc-type escalation"""
+        with self._lock:
+            tiers = []
+            for tier, stats in sorted(self._tiers.items()):
+                attempts = stats["attempts"]
+                tiers.append({
+                    "tier": tier,
+                    **{key: value for key, value in stats.items() if key != "models"},
+                    "models": dict(stats["models"]),
+                    "escalation_rate": stats["escalated"] / attempts if attempts else 0.0,
+                    "avg_seconds": stats["seconds"] / attempts if attempts else 0.0,
+                })
+            doc_types = {
+                doc_type: {**counts, "escalation_rate": counts["escalated"] / counts["documents"]}
+                for doc_type, counts in self._doc_types.items()
+            }
+        return {"tiers": tiers, "doc_types": doc_types}
+
+def print_fallback_stats(stats: Dict):
+    """Tier table: how much traffic each model tier carried and what it cost"""
+    print("🪜 Fallback chain")
+    print(f"{'Tier':<6}{'Models':<30}{'Attempts':>9}{'Accepted':>9}{'Escalated':>10}{'Rate':>7}{'Total s':>10}{'Avg s':>8}")
+    for tier in stats["tiers"]:
+        models = ", ".join(sorted(tier["models"]))
+        print(f"{tier['tier']:<6}{models:<30}{tier['attempts']:>9}{tier['accepted']:>9}"
+              f"{tier['escalated']:>10}{tier['escalation_rate'] * 100:>6.1f}%"
+              f"{tier['seconds']:>10.1f}{tier['avg_seconds']:>8.2f}")
+    for doc_type, counts in sorted(stats["doc_types"].items()):
+        print(f"   {doc_type}: {counts['escalated']}/{counts['documents']} escalated "
+              f"({counts['escalation_rate'] * 100:.1f}%), {counts['unresolved']} unresolved")
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the fallback model chain per document type")
+    parser.add_argument("--doc-type", help="Only this document type")
+    args = parser.parse_args()
+
+    doc_types = [args.doc_type] if args.doc_type else sorted(
+        doc_type.value for doc_type in ModelSelector.DOC_TYPE_MAPPING
+    )
+    for doc_type in doc_types:
+        chain = model_chain(doc_type)
+        tiers = " -> ".join(f"{model} ({ModelSelector.MODELS[model].speed_seconds:g}s)" for model in chain)
+        print(f"{doc_type:<12}{tiers}")
+
+if __name__ == "__main__":
+    main()
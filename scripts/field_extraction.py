@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Compiled field extraction engine for KTP OCR output
+Both KTP parsers (ktp_cleaner.KTPCleaner and clean_ocr_output.parse_ktp_fields)
+describe fields as label regexes. FieldExtractor compiles a field table once
+per process and serves both:
+
+  - line mode: all labels form one anchored alternation with a named group
+    per field, so each line costs a single match; the first label (in table
+    order) that matches the line start wins and the rest of the line is the
+    value
+  - search mode: each field gives literal anchors (lowercase label prefixes).
+    The anchors are located with str.find on the lowercased text and the
+    field's compiled label+value regex is only tried at those positions, so
+    every field still gets its leftmost match, exactly like re.search
+
+Search mode does not scan with the alternation: CPython's regex engine tries
+every branch at every position, which measured slower than the separate
+searches it was meant to replace.
+
+Usage:
+    python3 field_extraction.py --bench
+    python3 field_extraction.py --bench --docs 20000
+"""
+
+import argparse
+import functools
+import random
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+@dataclass(frozen=True)
+class FieldSpec:
+    """
+    One field: a label regex and, for search mode, a value regex (group 1)
+    and anchors - lowercase literals one of which starts every label match
+    """
+    name: str
+    label: str
+    value: str = ''
+    anchors: Tuple[str, ...] = ()
+
+class FieldExtractor:
+    """All field labels compiled into one regex, matched in a single pass"""
+
+    def __init__(self, specs: Iterable[FieldSpec], flags: int = re.IGNORECASE):
+        self.specs: List[FieldSpec] = list(specs)
+        branches = '|'.join(f'(?P<f{i}>{spec.label})' for i, spec in enumerate(self.specs))
+        self._labels = re.compile(branches, flags)
+        self._names = {f'f{i}': spec.name for i, spec in enumerate(self.specs)}
+        self._full = [re.compile(f'(?:{spec.label}){spec.value}', flags) for spec in self.specs]
+
+    def match_line(self, line: str) -> Optional[Tuple[str, str]]:
+        """Return (field, value) when the stripped line starts with a label"""
+        line = line.strip()
+        match = self._labels.match(line)
+        if match is None:
+            return None
+        value = line[match.end():].lstrip(':- ').strip()
+        return self._names[match.lastgroup], value
+
+    def extract_lines(self, text: str) -> Dict[str, str]:
+        """Line mode: later lines overwrite earlier values of the same field"""
+        data = {}
+        for line in text.split('\n'):
+            found = self.match_line(line)
+            if found and found[1]:
+                data[found[0]] = found[1]
+        return data
+
+    def search(self, text: str) -> Dict[str, str]:
+        """Search mode: leftmost match of each field anywhere in the text
+
+        Every spec needs a value regex whose group 1 is the field value.
+        """
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # Some characters change length when lowercased; offsets would drift
+            lowered = None
+        
+        fields = {}
+        for spec, full in zip(self.specs, self._full):
+            match = self._first_match(full, spec.anchors, text, lowered)
+            if match:
+                fields[spec.name] = match.group(1).strip()
+        return fields
+    
+    @staticmethod
+    def _first_match(full, anchors, text: str, lowered: Optional[str]):
+        if not anchors or lowered is None:
+            return full.search(text)
+        
+        # Next occurrence of every anchor; try candidates in text order
+        starts = {anchor: lowered.find(anchor) for anchor in anchors}
+        while True:
+            live = [pos for pos in starts.values() if pos >= 0]
+            if not live:
+                return None
+            pos = min(live)
+            match = full.match(text, pos)
+            if match:
+                return match
+            for anchor, start in starts.items():
+                if start == pos:
+                    starts[anchor] = lowered.find(anchor, pos + 1)
+
+@functools.lru_cache(maxsize=None)
+def _compile_mapping(items: Tuple[Tuple[str, str], ...]) -> FieldExtractor:
+    return FieldExtractor(FieldSpec(name, pattern) for pattern, name in items)
+
+def line_extractor(mapping: Dict[str, str]) -> FieldExtractor:
+    """Compiled line-mode extractor for a {label_regex: field} table (cached)"""
+    return _compile_mapping(tuple(mapping.items()))
+
+def _sample_documents(count: int, seed: int = 0) -> List[str]:
+    """Synthetic KTP outputs in the layouts the models produce"""
+    rng = random.Random(seed)
+    names = ["BUDI SANTOSO", "SITI AMINAH", "ANDI WIJAYA", "DEWI LESTARI"]
+    cities = ["JAKARTA", "BANDUNG", "SURABAYA", "MEDAN"]
+    docs = []
+    for _ in range(count):
+        nik = ''.join(rng.choice('0123456789') for _ in range(16))
+        lines = [
+            "PROVINSI DKI JAKARTA",
+            f"KOTA {rng.choice(cities)}",
+            f"NIK : {nik}",
+            f"Nama : {rng.choice(names)}",
+            f"Tempat/Tgl Lahir : {rng.choice(cities)}, {rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(1960, 2005)}",
+            f"Jenis Kelamin : {rng.choice(['LAKI-LAKI', 'PEREMPUAN'])} Gol. Darah : {rng.choice('ABO')}",
+            f"Alamat : JL MERDEKA NO {rng.randint(1, 200)}",
+            f"RT/RW : {rng.randint(1, 20):03d}/{rng.randint(1, 20):03d}",
+            "Kel/Desa : GAMBIR",
+            "Kecamatan : GAMBIR",
+            f"Agama : {rng.choice(['ISLAM', 'KRISTEN', 'HINDU'])}",
+            f"Status Perkawinan : {rng.choice(['KAWIN', 'BELUM KAWIN'])}",
+            "Pekerjaan : KARYAWAN SWASTA",
+            "Kewarganegaraan : WNI",
+            "Berlaku Hingga : SEUMUR HIDUP",
+        ]
+        if rng.random() < 0.3:
+            lines = [line.replace(' : ', ': ') for line in lines]
+        docs.append('\n'.join(lines))
+    return docs
+
+def _legacy_clean_lines(mapping: Dict[str, str], raw_text: str) -> Dict[str, str]:
+    """Previous KTPCleaner line loop (every pattern tried per line, then re.sub)"""
+    data = {}
+    for line in raw_text.strip().split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        for pattern, field_name in mapping.items():
+            if re.match(pattern, line, re.IGNORECASE):
+                value = re.sub(pattern, '', line, flags=re.IGNORECASE).strip()
+                value = value.lstrip(':- ').strip()
+                if value:
+                    data[field_name] = value
+                break
+    return data
+
+def _legacy_search(specs: List[FieldSpec], text: str) -> Dict[str, str]:
+    """Previous parse_ktp_fields loop (one re.search per field)"""
+    fields = {}
+    for spec in specs:
+        match = re.search(f'(?:{spec.label}){spec.value}', text, re.IGNORECASE)
+        if match:
+            fields[spec.name] = match.group(1).strip()
+    return fields
+
+def _time_per_doc(func, docs: List[str]) -> float:
+    start = time.perf_counter()
+    for doc in docs:
+        func(doc)
+    return (time.perf_counter() - start) / len(docs) * 1e6
+
+def run_bench(doc_count: int):
+    """Compare per-document cost of the compiled engine with the old loops"""
+    from ktp_cleaner import KTPCleaner
+    from clean_ocr_output import KTP_FIELD_SPECS, parse_ktp_fields
+
+    docs = _sample_documents(doc_count)
+    mapping = KTPCleaner.FIELD_MAPPINGS
+    extractor = line_extractor(mapping)
+    mismatches = sum(
+        _legacy_clean_lines(mapping, doc) != extractor.extract_lines(doc)
+        or _legacy_search(KTP_FIELD_SPECS, doc) != parse_ktp_fields(doc)
+        for doc in docs
+    )
+
+    cases = [
+        ("ktp_cleaner line mode",
+         lambda doc: _legacy_clean_lines(mapping, doc), extractor.extract_lines),
+        ("parse_ktp_fields search",
+         lambda doc: _legacy_search(KTP_FIELD_SPECS, doc), parse_ktp_fields),
+    ]
+
+    print("=" * 80)
+    print(f"⏱️  FIELD EXTRACTION BENCH ({doc_count} documents)")
+    print("=" * 80)
+    print()
+    print(f"{'Case':<28}{'Legacy µs/doc':>16}{'Compiled µs/doc':>18}{'Speedup':>10}")
+    for label, legacy, compiled in cases:
+        legacy_us = _time_per_doc(legacy, docs)
+        compiled_us = _time_per_doc(compiled, docs)
+        print(f"{label:<28}{legacy_us:>16.1f}{compiled_us:>18.1f}{legacy_us / compiled_us:>9.1f}x")
+    print()
+    print(f"Output mismatches vs legacy: {mismatches}")
+    print("=" * 80)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiled KTP field extraction engine")
+    parser.add_argument("--bench", action="store_true", help="Run the per-document microbenchmark")
+    parser.add_argument("--docs", type=int, default=5000, help="Synthetic documents for --bench")
+    args = parser.parse_args()
+
+    if not args.bench:
+        parser.print_help()
+        return
+    run_bench(args.docs)
+
+if __name__ == "__main__":
+    main()
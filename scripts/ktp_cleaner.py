@@ -2,11 +2,24 @@
 """
 Clean and structure OCR output from DeepSeek-OCR
 Converts messy text output to clean JSON format
+
+Usage:
+    python3 ktp_cleaner.py ktp_output.txt
+    python3 ktp_cleaner.py --batch results.jsonl --output cleaned.jsonl --drop-raw-text
 """
 
-import re
+import argparse
 import json
-from typing import Dict, List, Optional
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from field_extraction import line_extractor
 
 class KTPCleaner:
     """Clean and structure KTP extraction output"""
@@ -65,37 +78,37 @@ class KTPCleaner:
         r'Kota\s*[:\-]?\s*': 'Kota',
     }
     
+    # Fields a KTP result must contain to be valid
+    REQUIRED_FIELDS = [
+        'NIK', 'Nama', 'Tempat_Lahir', 'Tanggal_Lahir',
+        'Jenis_Kelamin', 'Alamat', 'Agama', 'Kewarganegaraan'
+    ]
+    
+    def __init__(self):
+        # All FIELD_MAPPINGS labels as one anchored alternation, compiled once per process
+        self.extractor = line_extractor(self.FIELD_MAPPINGS)
+    
     def clean(self, raw_text: str) -> Dict[str, str]:
         """Clean and structure raw OCR text"""
         
-        # Split into lines
-        lines = raw_text.strip().split('\n')
-        
-        # Extract fields
-        data = {}
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Try to match with field mappings
-            for pattern, field_name in self.FIELD_MAPPINGS.items():
-                match = re.match(pattern, line, re.IGNORECASE)
-                if match:
-                    # Extract value (everything after the pattern)
-                    value = re.sub(pattern, '', line, flags=re.IGNORECASE).strip()
-                    value = value.lstrip(':- ').strip()
-                    
-                    if value:
-                        data[field_name] = value
-                    break
+        # Extract fields (one regex match per line)
+        data = self.extractor.extract_lines(raw_text.strip())
         
         # Post-process specific fields
         data = self._post_process(data)
         
         return data
     
+    def _extract_line(self, line: str, data: Dict[str, str]) -> bool:
+        """Match one line against the field mappings; True if a value was stored"""
+        found = self.extractor.match_line(line)
+        if not found or not found[1]:
+            return False
+        
+        field_name, value = found
+        data[field_name] = value
+        return True
+    
     def _post_process(self, data: Dict[str, str]) -> Dict[str, str]:
         """Post-process extracted data"""
         
@@ -149,12 +162,7 @@ class KTPCleaner:
         }
         
         # Required fields
-        required_fields = [
-            'NIK', 'Nama', 'Tempat_Lahir', 'Tanggal_Lahir',
-            'Jenis_Kelamin', 'Alamat', 'Agama', 'Kewarganegaraan'
-        ]
-        
-        for field in required_fields:
+        for field in self.REQUIRED_FIELDS:
             if field not in data or not data[field]:
                 validation['errors'].append(f"Missing required field: {field}")
                 validation['is_valid'] = False
@@ -181,12 +189,63 @@ class KTPCleaner:
         return validation
 
 
-def clean_ktp_output(raw_text: str) -> Dict[str, any]:
+class StreamingKTPCleaner:
+    """
+    Incrementally clean KTP output while it is being generated
+    
+    Feed streamed text deltas; every completed line goes through the same
+    field mappings as KTPCleaner.clean. `feed` returns True once all required
+    fields are present and the result passes validation, so the caller can
+    stop the generation early.
+    """
+    
+    def __init__(self, required_fields: Optional[List[str]] = None):
+        self.cleaner = KTPCleaner()
+        self.required_fields = required_fields or KTPCleaner.REQUIRED_FIELDS
+        self.raw_data: Dict[str, str] = {}
+        self.lines_seen = 0
+        self.complete = False
+        self._pending = ''
+    
+    def feed(self, delta: str) -> bool:
+        """Add streamed text; return True once the result is complete"""
+        if self.complete:
+            return True
+        
+        self._pending += delta
+        if '\n' not in delta:
+            return False
+        
+        *lines, self._pending = self._pending.split('\n')
+        changed = False
+        for line in lines:
+            self.lines_seen += 1
+            if self.cleaner._extract_line(line, self.raw_data):
+                changed = True
+        
+        if changed:
+            self.complete = self._check_complete()
+        return self.complete
+    
+    def _check_complete(self) -> bool:
+        data = self.cleaner._post_process(dict(self.raw_data))
+        if any(not data.get(field) for field in self.required_fields):
+            return False
+        return self.cleaner.validate(data)['is_valid']
+    
+    @property
+    def data(self) -> Dict[str, str]:
+        """Cleaned fields extracted so far"""
+        return self.cleaner._post_process(dict(self.raw_data))
+
+
+def clean_ktp_output(raw_text: str, include_raw_text: bool = True) -> Dict[str, any]:
     """
     Clean and structure KTP OCR output
     
     Args:
         raw_text: Raw OCR output text
+        include_raw_text: Echo raw_text back in the result
     
     Returns:
         Dict with cleaned data, validation, and metadata
@@ -200,32 +259,173 @@ def clean_ktp_output(raw_text: str) -> Dict[str, any]:
     # Validate
     validation = cleaner.validate(cleaned_data)
     
-    return {
+    result = {
         'data': cleaned_data,
         'validation': validation,
-        'fields_extracted': len(cleaned_data),
-        'raw_text': raw_text
+        'fields_extracted': len(cleaned_data)
     }
+    if include_raw_text:
+        result['raw_text'] = raw_text
+    return result
 
 
-def main():
-    """CLI for testing"""
-    import sys
+# Keys holding raw model output in JSONL records (test_extraction --output uses raw_response)
+RAW_TEXT_KEYS = ('raw_text', 'raw_response', 'content')
+
+
+def _iter_tasks(source: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """Cheap per-record tasks: (path, None) for files, (line_no, line) for JSONL"""
+    root = Path(source)
     
-    if len(sys.argv) < 2:
-        print("Usage: python3 ktp_cleaner.py <raw_text_file>")
-        print("\nExample:")
-        print("  python3 ktp_cleaner.py ktp_output.txt")
-        sys.exit(1)
+    if root.is_dir():
+        for path in sorted(root.rglob('*.txt')):
+            yield str(path), None
+        return
     
-    # Read raw text
-    with open(sys.argv[1], 'r') as f:
-        raw_text = f.read()
+    with open(root, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                yield str(line_no), line
+
+
+def _load_task(task: Tuple[str, Optional[str]]) -> Tuple[str, Optional[str]]:
+    """
+    Turn a task into (record_id, raw_text); raw_text is None if absent
     
-    # Clean and structure
-    result = clean_ktp_output(raw_text)
+    Raises ValueError for a JSONL line that is not a JSON object.
+    """
+    record_id, line = task
+    if line is None:
+        with open(record_id, 'r', encoding='utf-8') as f:
+            return record_id, f.read()
+    
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f'Invalid JSON on line {record_id}: {e}')
+    if not isinstance(record, dict):
+        raise ValueError(f'Line {record_id} is not a JSON object')
+    record_id = str(record.get('id', record.get('path', record_id)))
+    raw_text = next((record[key] for key in RAW_TEXT_KEYS if record.get(key) is not None), None)
+    return record_id, raw_text
+
+
+def iter_raw_records(source: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Stream (record_id, raw_text) pairs from a JSONL file or a directory
+    
+    A directory is scanned recursively for .txt files (id = file path). JSONL
+    records take their id from "id" or "path" (else the line number) and
+    their text from the first of RAW_TEXT_KEYS present. Malformed lines
+    (e.g. a torn tail after a crash) yield raw_text None.
+    """
+    for task in _iter_tasks(source):
+        try:
+            yield _load_task(task)
+        except ValueError:
+            yield task[0], None
+
+
+def _clean_chunk(chunk: List[Tuple[str, Optional[str]]], include_raw_text: bool) -> Tuple[List[str], int]:
+    """Worker: load and clean one chunk, return (serialized JSONL lines, valid count)"""
+    lines = []
+    valid = 0
+    for task in chunk:
+        try:
+            record_id, raw_text = _load_task(task)
+        except ValueError as e:
+            lines.append(json.dumps({'id': task[0], 'error': str(e)}, ensure_ascii=False) + '\n')
+            continue
+        if raw_text is None:
+            record = {'id': record_id, 'error': 'No raw text in record'}
+        else:
+            record = {'id': record_id, **clean_ktp_output(raw_text, include_raw_text)}
+            valid += record['validation']['is_valid']
+        lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+    return lines, valid
+
+
+def _chunks(records: Iterable, size: int) -> Iterator[List]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def clean_batch(
+    source: str,
+    output_path: str,
+    workers: Optional[int] = None,
+    chunk_size: int = 256,
+    include_raw_text: bool = True
+) -> Dict[str, any]:
+    """
+    Clean every raw output in `source` with a process pool
+    
+    Records are parsed and cleaned by the workers in chunks of `chunk_size`
+    and written to one JSONL file in input order. At most 2 chunks per worker are in flight, so memory
+    stays bounded regardless of input size.
+    
+    Returns:
+        Dict with record counts, wall time and throughput
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * 2
+    records = 0
+    valid = 0
+    start_time = time.perf_counter()
     
-    # Print result
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(output_path, 'w', encoding='utf-8') as output:
+        pending = deque()
+        
+        def write_oldest():
+            nonlocal records, valid
+            lines, chunk_valid = pending.popleft().result()
+            output.writelines(lines)
+            records += len(lines)
+            valid += chunk_valid
+        
+        for chunk in _chunks(_iter_tasks(source), chunk_size):
+            pending.append(executor.submit(_clean_chunk, chunk, include_raw_text))
+            if len(pending) >= max_pending:
+                write_oldest()
+        while pending:
+            write_oldest()
+    
+    seconds = time.perf_counter() - start_time
+    per_second = records / seconds if seconds > 0 else 0.0
+    return {
+        'records': records,
+        'valid': valid,
+        'seconds': seconds,
+        'workers': workers,
+        'records_per_second': per_second,
+        'records_per_second_per_core': per_second / workers
+    }
+
+
+def print_batch_stats(stats: Dict[str, any], output_path: str):
+    """Pretty print batch cleaning stats"""
+    print("=" * 80)
+    print("📊 KTP BATCH CLEANING")
+    print("=" * 80)
+    print()
+    print(f"Records: {stats['records']} ({stats['valid']} valid)")
+    print(f"Workers: {stats['workers']}")
+    print(f"Wall Time: {stats['seconds']:.2f} seconds")
+    print(f"Throughput: {stats['records_per_second']:.0f} records/second "
+          f"({stats['records_per_second_per_core']:.0f} per core)")
+    print()
+    print(f"💾 Saved to: {output_path}")
+
+
+def print_single_result(result: Dict[str, any]):
+    """Pretty print one cleaned KTP result"""
     print("=" * 80)
     print("📊 CLEANED KTP DATA")
     print("=" * 80)
@@ -250,9 +450,54 @@ def main():
             print(f"  - {warning}")
     
     print()
+
+
+def main():
+    """CLI for testing and batch re-cleaning"""
+    parser = argparse.ArgumentParser(
+        description="Clean raw KTP OCR output",
+        epilog="""
+Examples:
+  python3 ktp_cleaner.py ktp_output.txt
+  python3 ktp_cleaner.py --batch results.jsonl --output cleaned.jsonl --drop-raw-text
+  python3 ktp_cleaner.py --batch raw_outputs/ --workers 8 --chunk-size 512
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('raw_text_file', nargs='?', help='Single raw text file to clean')
+    parser.add_argument('--batch', metavar='SOURCE', help='JSONL file or directory of .txt raw outputs')
+    parser.add_argument('--output', help='Batch JSONL output (default: <source>_cleaned.jsonl)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, default=256, help='Records per worker task')
+    parser.add_argument('--drop-raw-text', action='store_true', help='Do not echo raw_text in the output')
+    args = parser.parse_args()
+    
+    if args.batch:
+        output_path = args.output or f"{args.batch.rstrip('/').rsplit('.jsonl', 1)[0]}_cleaned.jsonl"
+        stats = clean_batch(
+            args.batch,
+            output_path,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            include_raw_text=not args.drop_raw_text
+        )
+        print_batch_stats(stats, output_path)
+        return
+    
+    if not args.raw_text_file:
+        parser.print_help()
+        sys.exit(1)
+    
+    # Read raw text
+    with open(args.raw_text_file, 'r') as f:
+        raw_text = f.read()
+    
+    # Clean and structure
+    result = clean_ktp_output(raw_text, include_raw_text=not args.drop_raw_text)
+    print_single_result(result)
     
     # Save cleaned output
-    output_file = sys.argv[1].replace('.txt', '_cleaned.json')
+    output_file = args.raw_text_file.replace('.txt', '_cleaned.json')
     with open(output_file, 'w') as f:
         json.dump(result, f, indent=2, ensure_ascii=False)
     
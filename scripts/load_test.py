@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Load generator and latency-percentile benchmark for the OCR server
+Replays a corpus of images against /v1/chat/completions for a fixed
+duration, either open-loop at a fixed arrival rate (uniform or Poisson
+arrivals, independent of how fast the server answers) or closed-loop at a
+fixed concurrency, and reports sustained throughput and latency
+percentiles under load instead of the one-at-a-time speed_seconds figures
+in model_selector.py.
+
+Latencies in open-loop mode are measured from the scheduled arrival time,
+so time spent waiting for a free client slot (queue) is part of end-to-end
+latency rather than silently omitted. Time-to-first-token also includes
+any wait for the server's model lock.
+
+With several --endpoints the requests go through an EndpointPool, and
+--hedge enables hedged streams on it; --hedge-baseline first runs the same
+load without hedging so the report shows the p99 change against the extra
+requests the hedges cost.
+
+Results are written in the bench.rs JSON shape (stage_totals), so runs
+against different models or hosts can be compared with compare_bench.py.
+
+Usage:
+    python3 load_test.py scans/ktp --rate 0.5 --duration 300 --output a100_q4k.json
+    python3 load_test.py scans/ktp --concurrency 4 --duration 120 --model deepseek-ocr
+    python3 load_test.py scans/ktp --rate 2 --endpoints http://gpu1:23333/v1 http://gpu2:23333/v1 --hedge 95 --hedge-baseline
+    python3 compare_bench.py a100_q4k.json l4_q4k.json
+"""
+
+import argparse
+import base64
+import collections
+import itertools
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from batch_extraction import BatchItem, collect_items
+from bench_report import BenchRecorder, print_stage_totals
+from endpoint_pool import EndpointPool, print_hedging_stats
+from ocr_client import OCRClient, percentile
+from test_extraction import API_BASE, API_KEY, PROMPTS, build_chat_payload
+
+@dataclass
+class RequestSample:
+    """Timeline of one load-test request (perf_counter seconds)"""
+    item: BatchItem
+    scheduled: float
+    dispatched: float = 0.0
+    first_token: Optional[float] = None
+    finished: float = 0.0
+    ok: bool = False
+    error: Optional[str] = None
+    completion_tokens: int = 0
+
+    @property
+    def queue(self) -> float:
+        return self.dispatched - self.scheduled
+
+    @property
+    def end_to_end(self) -> float:
+        return self.finished - self.scheduled
+
+    @property
+    def service(self) -> float:
+        return self.finished - self.dispatched
+
+    @property
+    def ttft(self) -> Optional[float]:
+        if self.first_token is None:
+            return None
+        return self.first_token - self.dispatched
+
+class LoadTest:
+    """Drive one load pattern against the server and collect samples"""
+
+    def __init__(
+        self,
+        client: OCRClient,
+        items: List[BatchItem],
+        model_id: str,
+        stream: bool = True,
+        max_tokens: int = 2048,
+        image_cache_bytes: int = 64 * 1024 * 1024,
+    ):
+        """
+        Args:
+            image_cache_bytes: Bound on the encoded images kept between
+                requests (least recently used are dropped first)
+        """
+        self.client = client
+        self.items = items
+        self.model_id = model_id
+        self.stream = stream
+        self.max_tokens = max_tokens
+        self.samples: List[RequestSample] = []
+        self._lock = threading.Lock()
+        self._next_item = itertools.cycle(items)
+        self.image_cache_bytes = image_cache_bytes
+        self._images: "collections.OrderedDict[str, str]" = collections.OrderedDict()
+        self._images_size = 0
+
+    def next_item(self) -> BatchItem:
+        with self._lock:
+            return next(self._next_item)
+
+    def _image_base64(self, path: str) -> str:
+        with self._lock:
+            encoded = self._images.get(path)
+            if encoded is not None:
+                self._images.move_to_end(path)
+                return encoded
+        with open(path, "rb") as f:
+            encoded = base64.b64encode(f.read()).decode()
+        with self._lock:
+            if path not in self._images:
+                self._images[path] = encoded
+                self._images_size += len(encoded)
+            while self._images_size > self.image_cache_bytes and len(self._images) > 1:
+                _, dropped = self._images.popitem(last=False)
+                self._images_size -= len(dropped)
+        return encoded
+
+    def send(self, sample: RequestSample):
+        """Issue one request and fill in the sample timeline"""
+        sample.dispatched = time.perf_counter()
+        try:
+            payload = build_chat_payload(
+                self.model_id,
+                self._image_base64(sample.item.path),
+                PROMPTS.get(sample.item.doc_type, PROMPTS["ktp"]),
+                max_tokens=self.max_tokens,
+            )
+            if self.stream:
+                with self.client.stream_chat(payload) as chat_stream:
+                    for _ in chat_stream:
+                        if sample.first_token is None:
+                            sample.first_token = time.perf_counter()
+                    sample.completion_tokens = chat_stream.metrics.tokens
+            else:
+                response = self.client.post("/chat/completions", payload)
+                if response.status_code != 200:
+                    raise RuntimeError(f"HTTP {response.status_code}")
+                usage = response.json().get("usage") or {}
+                sample.completion_tokens = usage.get("completion_tokens", 0)
+            sample.ok = True
+        except Exception as e:
+            sample.error = f"{type(e).__name__}: {e}"
+        finally:
+            sample.finished = time.perf_counter()
+            with self._lock:
+                self.samples.append(sample)
+
+    def run_open_loop(self, rate: float, duration: float, arrivals: str = "poisson", max_in_flight: int = 64):
+        """Fire requests at `rate`/s for `duration` seconds regardless of response times"""
+        rng = random.Random()
+        start = time.perf_counter()
+        next_arrival = start
+        with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="load") as executor:
+            while next_arrival < start + duration:
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, RequestSample(self.next_item(), scheduled=next_arrival))
+                gap = rng.expovariate(rate) if arrivals == "poisson" else 1.0 / rate
+                next_arrival += gap
+        return start
+
+    def run_closed_loop(self, concurrency: int, duration: float):
+        """Keep `concurrency` requests in flight for `duration` seconds"""
+        start = time.perf_counter()
+        deadline = start + duration
+
+        def worker():
+            while time.perf_counter() < deadline:
+                self.send(RequestSample(self.next_item(), scheduled=time.perf_counter()))
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return start
+
+def summarize(samples: List[RequestSample], start: float, warmup: float, duration: float) -> Dict:
+    """Throughput and error rate over the measured window (after warmup)"""
+    window_start = start + warmup
+    window_end = start + duration
+    measured = [sample for sample in samples if sample.scheduled >= window_start]
+    ok = [sample for sample in measured if sample.ok]
+    completed_in_window = [sample for sample in ok if sample.finished <= window_end]
+    window = max(window_end - window_start, 1e-9)
+    errors = len(measured) - len(ok)
+
+    latencies = [sample.end_to_end for sample in ok]
+    ttfts = [sample.ttft for sample in ok if sample.ttft is not None]
+    queues = [sample.queue for sample in ok]
+    tokens = sum(sample.completion_tokens for sample in completed_in_window)
+
+    def pcts(values: List[float]) -> Dict:
+        return {f"p{p}": percentile(values, p) for p in (50, 90, 99)}
+
+    return {
+        "requests": len(measured),
+        "succeeded": len(ok),
+        "errors": errors,
+        "error_rate": errors / len(measured) if measured else 0.0,
+        "window_seconds": window,
+        "docs_per_second": len(completed_in_window) / window,
+        "tokens_per_second": tokens / window,
+        "end_to_end_seconds": pcts(latencies),
+        "ttft_seconds": pcts(ttfts),
+        "queue_seconds": pcts(queues),
+        "error_samples": sorted({sample.error for sample in measured if sample.error})[:5],
+    }
+
+def record_samples(recorder: BenchRecorder, samples: List[RequestSample], start: float, warmup: float):
+    """Turn measured samples into bench events (stage per latency component)"""
+    for sample in samples:
+        if sample.scheduled < start + warmup or not sample.ok:
+            continue
+        fields = {"path": sample.item.path, "tokens": sample.completion_tokens}
+        recorder.record_seconds("load.end_to_end", sample.end_to_end, **fields)
+        recorder.record_seconds("load.queue", sample.queue, **fields)
+        recorder.record_seconds("load.service", sample.service, **fields)
+        if sample.ttft is not None:
+            recorder.record_seconds("load.ttft", sample.ttft, **fields)
+            recorder.record_seconds("load.generate", sample.finished - sample.first_token, **fields)
+
+def print_summary(summary: Dict, config: Dict, totals: List[Dict]):
+    """Pretty print load test results"""
+    print()
+    print("=" * 80)
+    print("📈 LOAD TEST RESULTS")
+    print("=" * 80)
+    print()
+    target = ", ".join(config["endpoints"]) if config.get("endpoints") else config["api_base"]
+    print(f"Target: {target} ({config['model']})")
+    if config["mode"] == "open":
+        print(f"Load: open-loop {config['rate']:.2f} req/s ({config['arrivals']})")
+    else:
+        print(f"Load: closed-loop concurrency {config['concurrency']}")
+    print(f"Window: {summary['window_seconds']:.0f}s after {config['warmup']:.0f}s warmup")
+    print()
+    print(f"Requests: {summary['requests']} ({summary['succeeded']} ok, {summary['errors']} errors, "
+          f"{summary['error_rate'] * 100:.1f}% error rate)")
+    print(f"Sustained: {summary['docs_per_second']:.3f} docs/second, "
+          f"{summary['tokens_per_second']:.1f} tokens/second")
+    for label, key in (("End-to-end", "end_to_end_seconds"), ("TTFT", "ttft_seconds"), ("Queue", "queue_seconds")):
+        values = summary[key]
+        print(f"{label + ':':<12} p50 {values['p50']:.2f}s  p90 {values['p90']:.2f}s  p99 {values['p99']:.2f}s")
+    if "hedging" in summary:
+        print()
+        print_hedging_stats(summary["hedging"])
+    if "baseline" in summary:
+        print_hedge_comparison(summary["baseline"], summary)
+    if summary["error_samples"]:
+        print()
+        print("Errors:")
+        for error in summary["error_samples"]:
+            print(f"  - {error}")
+    print()
+    print_stage_totals(totals)
+    print()
+    print("=" * 80)
+
+def print_hedge_comparison(baseline: Dict, hedged: Dict):
+    """p99 with hedging against the unhedged baseline phase, and the load it cost"""
+    print()
+    print(f"Hedging vs baseline (+{hedged['hedging']['extra_load'] * 100:.1f}% server time):")
+    for label, key in (("End-to-end", "end_to_end_seconds"), ("TTFT", "ttft_seconds")):
+        before, after = baseline[key]["p99"], hedged[key]["p99"]
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"  {label + ' p99:':<16} {before:.2f}s -> {after:.2f}s ({change:+.1f}%)")
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Open/closed-loop load test for the OCR server",
+        epilog="""
+Examples:
+  python3 load_test.py scans/ktp --rate 0.5 --duration 300 --output run.json
+  python3 load_test.py manifest.txt --concurrency 4 --duration 120 --model paddleocr-vl-q4k
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("corpus", help="Image directory or manifest (same format as --batch)")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--rate", type=float, help="Open loop: arrivals per second")
+    mode.add_argument("--concurrency", type=int, help="Closed loop: requests kept in flight")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson",
+                        help="Open-loop inter-arrival distribution")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to generate load")
+    parser.add_argument("--warmup", type=float, default=0.0, help="Leading seconds excluded from stats")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Open loop: client-side request slots")
+    parser.add_argument("--model", default="paddleocr-vl", help="Model id to load-test")
+    parser.add_argument("--doc-type", default="ktp", help="Doc type for directory corpora")
+    parser.add_argument("--api-base", default=API_BASE, help="Server base URL (default: %(default)s)")
+    parser.add_argument("--endpoints", nargs="+", metavar="URL",
+                        help="Spread load over several servers (overrides --api-base)")
+    parser.add_argument("--hedge", type=float, metavar="PCT",
+                        help="With --endpoints: hedge streams slower to a first token than this TTFT percentile")
+    parser.add_argument("--hedge-budget", type=float, default=0.05,
+                        help="Largest share of requests that may be hedged (default: %(default)s)")
+    parser.add_argument("--hedge-baseline", action="store_true",
+                        help="Run the same load without hedging first and compare p99")
+    parser.add_argument("--retries", type=int, default=0, help="Client retries (0 reports raw errors)")
+    parser.add_argument("--max-tokens", type=int, default=2048, help="max_tokens per request")
+    parser.add_argument("--no-stream", action="store_true", help="Use non-streaming requests (no TTFT)")
+    parser.add_argument("--output", help="Write bench JSON (stage_totals) to this file")
+    parser.add_argument("--events", action="store_true", help="Include per-request events in the output")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.warmup >= args.duration:
+        print("❌ --warmup must be shorter than --duration")
+        sys.exit(1)
+
+    try:
+        items = collect_items(args.corpus, args.doc_type)
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if not items:
+        print(f"❌ No images found in {args.corpus}")
+        sys.exit(1)
+
+    if args.hedge is not None and (not args.endpoints or len(args.endpoints) < 2 or args.no_stream):
+        print("❌ --hedge needs streaming and at least two --endpoints")
+        sys.exit(1)
+
+    slots = args.concurrency or args.max_in_flight
+    if args.endpoints:
+        client = EndpointPool(
+            args.endpoints,
+            API_KEY,
+            max_retries=args.retries,
+            hedge_percentile=args.hedge,
+            hedge_budget=args.hedge_budget,
+            pool_maxsize=slots,
+        )
+    else:
+        client = OCRClient(
+            api_base=args.api_base,
+            api_key=API_KEY,
+            pool_maxsize=slots,
+            max_retries=args.retries,
+        )
+
+    config = {
+        "mode": "open" if args.rate else "closed",
+        "rate": args.rate,
+        "arrivals": args.arrivals,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "model": args.model,
+        "api_base": args.api_base,
+        "endpoints": args.endpoints,
+        "hedge_percentile": args.hedge,
+        "hedge_budget": args.hedge_budget if args.hedge is not None else None,
+        "stream": not args.no_stream,
+        "corpus_size": len(items),
+    }
+
+    print("🚦 DeepSeek-OCR Load Test")
+    print("=" * 80)
+    print(f"Corpus: {args.corpus} ({len(items)} images)")
+    print(f"Running for {args.duration:.0f}s...")
+    print("=" * 80)
+
+    def run_phase() -> tuple:
+        load = LoadTest(client, items, args.model, stream=not args.no_stream, max_tokens=args.max_tokens)
+        if args.rate:
+            start = load.run_open_loop(args.rate, args.duration, args.arrivals, args.max_in_flight)
+        else:
+            start = load.run_closed_loop(args.concurrency, args.duration)
+        return load, start
+
+    baseline = None
+    if args.hedge is not None and args.hedge_baseline:
+        # Same load without hedges; also collects the TTFT samples hedging starts from
+        print("Baseline phase (no hedging)...")
+        client.hedge_budget = 0.0
+        load, start = run_phase()
+        baseline = summarize(load.samples, start, args.warmup, args.duration)
+        client.hedge_budget = args.hedge_budget
+        client.reset_hedging_stats()
+        print("Hedged phase...")
+
+    load, start = run_phase()
+    summary = summarize(load.samples, start, args.warmup, args.duration)
+    if args.hedge is not None:
+        summary["hedging"] = client.hedging_stats()
+    if baseline is not None:
+        summary["baseline"] = baseline
+    client.close()
+
+    recorder = BenchRecorder()
+    record_samples(recorder, load.samples, start, args.warmup)
+    print_summary(summary, config, recorder.stage_totals())
+
+    if args.output:
+        recorder.write(args.output, include_events=args.events, summary=summary, config=config)
+        print(f"💾 Bench JSON saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""
+Local mock of the DeepSeek-OCR server for client benchmarking
+Implements /health, /v1/models, /v1/chat/completions and /v1/responses
+(plain JSON and SSE streaming) with the response shapes of
+crates/server/src/models.rs and stream.rs, so the Python client, cache and
+scheduler code can be load-tested without a GPU box.
+
+Simulated server behaviour:
+  - outputs are replayed from recorded raw outputs (JSONL or a directory of
+    .txt files) or generated from a KTP template, deterministically per image
+  - prefill time grows with the predicted prompt tokens (vision_tokens);
+    every token is emitted after a jittered per-token delay, scaled by the
+    model's speed in model_selector
+  - one generation per loaded model at a time (the model Mutex in AppState)
+    and a swap delay whenever a different model is requested
+  - like the real server, decoding is not cancelled when a streaming client
+    disconnects (--cancel-on-disconnect models a server that does)
+
+Usage:
+    python3 mock_ocr_server.py --port 8000 --profile gpu
+    python3 mock_ocr_server.py --replay results.jsonl --token-ms 30 --swap-ms 4000
+    python3 test_extraction.py ktp.jpg ktp --api-base http://127.0.0.1:8000/v1
+"""
+
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ktp_cleaner import iter_raw_records
+from model_selector import ModelSelector
+from vision_tokens import CHARS_PER_TOKEN, image_dimensions, model_family, predict_prefill_tokens
+
+@dataclass
+class LatencyProfile:
+    """Latency model of one server setup (all times in milliseconds)"""
+    prefill_ms: float          # Fixed cost before the first token
+    prefill_ms_per_1k: float   # Additional prefill per 1000 prompt tokens
+    token_ms: float            # Mean per-token decode latency
+    jitter: float              # Log-normal sigma applied to every delay
+    swap_ms: float             # Unload + load when another model is requested
+
+LATENCY_PROFILES = {
+    "instant": LatencyProfile(0, 0, 0, 0, 0),
+    "gpu": LatencyProfile(120, 450, 25, 0.25, 6000),
+    "cpu": LatencyProfile(900, 6000, 140, 0.35, 20000),
+}
+
+# Reference model for the per-model speed multiplier
+REFERENCE_MODEL = "paddleocr-vl"
+
+# Text tokens assumed for an image when its size cannot be decoded
+FALLBACK_IMAGE_TOKENS = 273
+
+MISSING_IMAGE_MARKDOWN = (
+    "⚠️ **Image Required**\n\n- This OCR backend expects at least one `<image>` placeholder "
+    "or attached image.\n- Please include `input_image` / `image_url`, or add `<image>` inside the prompt."
+)
+
+KTP_TEMPLATE = """PROVINSI {provinsi}
+KOTA {kota}
+NIK : {nik}
+Nama : {nama}
+Tempat/Tgl Lahir : {kota}, {tanggal}
+Jenis Kelamin : {gender} Gol. Darah : {darah}
+Alamat : {alamat}
+RT/RW : {rt}/{rw}
+Kel/Desa : {kelurahan}
+Kecamatan : {kecamatan}
+Agama : {agama}
+Status Perkawinan : {status}
+Pekerjaan : {pekerjaan}
+Kewarganegaraan : WNI
+Berlaku Hingga : SEUMUR HIDUP"""
+
+ERROR_TYPES = {400: "invalid_request_error", 404: "not_found_error"}
+
+_TOKEN_PATTERN = re.compile(r'\s*\S{1,4}|\s+')
+
+class MockError(Exception):
+    """Error rendered like ApiError (status + {"error": {message, type}})"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.error_type = ERROR_TYPES.get(status, "internal_error")
+
+def split_tokens(text: str) -> List[str]:
+    """Approximate tokenizer: up to 4 non-space characters per token"""
+    return _TOKEN_PATTERN.findall(text)
+
+def render_ktp(seed: int) -> str:
+    """Deterministic KTP output for one image"""
+    rng = random.Random(seed)
+    city = rng.choice(["JAKARTA PUSAT", "BANDUNG", "SURABAYA", "SEMARANG"])
+    return KTP_TEMPLATE.format(
+        provinsi=rng.choice(["DKI JAKARTA", "JAWA BARAT", "JAWA TIMUR", "JAWA TENGAH"]),
+        kota=city,
+        nik=''.join(rng.choice('0123456789') for _ in range(16)),
+        nama=rng.choice(["BUDI SANTOSO", "SITI AMINAH", "ANDI WIJAYA", "DEWI LESTARI"]),
+        tanggal=f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(1960, 2005)}",
+        gender=rng.choice(["LAKI-LAKI", "PEREMPUAN"]),
+        darah=rng.choice("ABO"),
+        alamat=f"JL MERDEKA NO {rng.randint(1, 200)}",
+        rt=f"{rng.randint(1, 20):03d}",
+        rw=f"{rng.randint(1, 20):03d}",
+        kelurahan=rng.choice(["GAMBIR", "CIDADAP", "GUBENG"]),
+        kecamatan=rng.choice(["GAMBIR", "CIDADAP", "GUBENG"]),
+        agama=rng.choice(["ISLAM", "KRISTEN", "KATOLIK", "HINDU", "BUDDHA"]),
+        status=rng.choice(["KAWIN", "BELUM KAWIN"]),
+        pekerjaan=rng.choice(["KARYAWAN SWASTA", "PELAJAR/MAHASISWA", "WIRASWASTA"]),
+    )
+
+def parse_messages(messages: List[Dict]) -> Tuple[str, List[bytes]]:
+    """Flatten chat/responses messages into (prompt text, decoded images)"""
+    texts = []
+    images = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content:
+            part_type = part.get("type")
+            if part_type in ("text", "input_text"):
+                texts.append(part.get("text", ""))
+            elif part_type in ("image_url", "input_image"):
+                url = part.get("image_url")
+                url = url.get("url", "") if isinstance(url, dict) else (url or "")
+                images.append(decode_data_url(url))
+                texts.append("<image>")
+    return "\n".join(texts), images
+
+def decode_data_url(url: str) -> bytes:
+    """Image bytes of a base64 data URL (remote URLs are hashed as-is)"""
+    if not url.startswith("data:"):
+        return url.encode("utf-8")
+    try:
+        return base64.b64decode(url.split(",", 1)[1], validate=False)
+    except (IndexError, binascii.Error):
+        raise MockError(400, "invalid base64 image payload")
+
+class MockOCRBackend:
+    """Generation side of the mock: model state, outputs and latency"""
+
+    def __init__(
+        self,
+        profile: LatencyProfile,
+        models: Optional[List[str]] = None,
+        replay: Optional[List[str]] = None,
+        error_rate: float = 0.0,
+        loop_rate: float = 0.0,
+        default_max_tokens: int = 2048,
+        cancel_on_disconnect: bool = False,
+        seed: Optional[int] = None,
+    ):
+        self.profile = profile
+        self.models = models or list(ModelSelector.MODELS)
+        self.replay = replay or []
+        self.error_rate = error_rate
+        self.loop_rate = loop_rate
+        self.default_max_tokens = default_max_tokens
+        self.cancel_on_disconnect = cancel_on_disconnect
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+        # AppState: one loaded model, each behind its own Mutex
+        self.current_model: Optional[str] = None
+        self._state_lock = threading.Lock()
+        self._swap_lock = threading.Lock()
+        self._model_locks: Dict[str, threading.Lock] = {model: threading.Lock() for model in self.models}
+
+        self.stats = {
+            "requests": 0,
+            "streams": 0,
+            "swaps": 0,
+            "errors": 0,
+            "disconnects": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "busy_seconds": 0.0,
+        }
+        self._stats_lock = threading.Lock()
+
+    def count(self, key: str, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _delay(self, mean_ms: float) -> float:
+        """Log-normal delay in seconds with the given mean"""
+        if mean_ms <= 0:
+            return 0.0
+        sigma = self.profile.jitter
+        with self._rng_lock:
+            sample = self._rng.lognormvariate(math.log(mean_ms) - sigma * sigma / 2, sigma) if sigma else mean_ms
+        return sample / 1000
+
+    def _chance(self, rate: float) -> bool:
+        with self._rng_lock:
+            return self._rng.random() < rate
+
+    def speed_factor(self, model_id: str) -> float:
+        config = ModelSelector.MODELS.get(model_id)
+        reference = ModelSelector.MODELS.get(REFERENCE_MODEL)
+        if config is None or reference is None:
+            return 1.0
+        return config.speed_seconds / reference.speed_seconds
+
+    def prepare(self, model_id: str) -> str:
+        """Validate the model and swap it in (AppState.prepare_generation)"""
+        if model_id not in self.models:
+            raise MockError(400, f"requested model `{model_id}` is not available")
+
+        if self.current_model == model_id:
+            return model_id
+        with self._swap_lock:
+            if self.current_model != model_id:
+                time.sleep(self._delay(self.profile.swap_ms))
+                with self._state_lock:
+                    self.current_model = model_id
+                self.count("swaps")
+        return model_id
+
+    def output_for(self, prompt: str, images: List[bytes]) -> str:
+        """Replayed or templated raw output, stable for the same image"""
+        digest = hashlib.sha256(b"".join(images) or prompt.encode("utf-8")).digest()
+        seed = int.from_bytes(digest[:8], "big")
+        if self.replay:
+            return self.replay[seed % len(self.replay)]
+        if "ktp" in prompt.lower():
+            return render_ktp(seed)
+        return json.dumps({"document": "mock", "id": digest.hex()[:12]}, indent=2)
+
+    def prompt_tokens(self, model_id: str, prompt: str, images: List[bytes]) -> int:
+        tokens = math.ceil(len(prompt) / CHARS_PER_TOKEN)
+        for image in images:
+            try:
+                width, height = image_dimensions(image)
+                tokens += predict_prefill_tokens(model_id, width, height, "")
+            except Exception:
+                tokens += FALLBACK_IMAGE_TOKENS
+        return tokens
+
+    def generate(
+        self,
+        model_id: str,
+        prompt: str,
+        images: List[bytes],
+        max_tokens: int,
+        usage: Dict[str, int],
+    ) -> Iterator[str]:
+        """
+        Yield output tokens with simulated latency while holding the model lock
+
+        `usage` is filled with prompt/completion token counts. Closing the
+        generator early (client gone) keeps decoding unless the backend
+        cancels on disconnect, just like the real server.
+        """
+        if self._chance(self.error_rate):
+            self.count("errors")
+            raise MockError(500, "simulated inference failure")
+
+        text = self.output_for(prompt, images)
+        tokens = split_tokens(text)
+        if self._chance(self.loop_rate):
+            # Degenerate output: the last lines repeat until max_tokens
+            tail = split_tokens("\n" + "\n".join(text.splitlines()[-3:]))
+            while len(tokens) < max_tokens:
+                tokens.extend(tail)
+        tokens = tokens[:max_tokens]
+
+        usage["prompt_tokens"] = self.prompt_tokens(model_id, prompt, images)
+        usage["completion_tokens"] = 0
+        factor = self.speed_factor(model_id)
+        prefill_ms = self.profile.prefill_ms + self.profile.prefill_ms_per_1k * usage["prompt_tokens"] / 1000
+
+        with self._model_locks[model_id]:
+            start = time.perf_counter()
+            try:
+                time.sleep(self._delay(prefill_ms * factor))
+                for index, token in enumerate(tokens):
+                    time.sleep(self._delay(self.profile.token_ms * factor))
+                    usage["completion_tokens"] = index + 1
+                    yield token
+            except GeneratorExit:
+                self.count("disconnects")
+                if not self.cancel_on_disconnect:
+                    for _ in tokens[usage["completion_tokens"]:]:
+                        time.sleep(self._delay(self.profile.token_ms * factor))
+                raise
+            finally:
+                self.count("busy_seconds", time.perf_counter() - start)
+                self.count("prompt_tokens", usage["prompt_tokens"])
+                self.count("completion_tokens", usage["completion_tokens"])
+
+class MockOCRHandler(BaseHTTPRequestHandler):
+    """HTTP/1.1 keep-alive handler mirroring the Rocket routes"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "deepseek-ocr-mock"
+    backend: MockOCRBackend = None
+    quiet = True
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path in ("/health", "/v1/health"):
+            self._send_body(200, b"ok", "text/plain; charset=utf-8")
+        elif path == "/v1/models":
+            now = int(time.time())
+            self._send_json(200, {
+                "object": "list",
+                "data": [
+                    {"id": model, "object": "model", "created": now, "owned_by": model_family(model)}
+                    for model in self.backend.models
+                ],
+            })
+        elif path == "/mock/stats":
+            self._send_json(200, {**self.backend.stats, "current_model": self.backend.current_model})
+        else:
+            self._send_error(MockError(404, f"no route for GET {path}"))
+
+    def do_OPTIONS(self):
+        self._send_body(200, b"", "text/plain")
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                request = json.loads(body)
+            except json.JSONDecodeError as e:
+                raise MockError(400, f"invalid JSON body: {e}")
+
+            if path == "/v1/chat/completions":
+                self._complete(request, request.get("messages", []), chat=True)
+            elif path == "/v1/responses":
+                self._complete(request, request.get("input", []), chat=False)
+            else:
+                raise MockError(404, f"no route for POST {path}")
+        except MockError as e:
+            self._send_error(e)
+
+    def _complete(self, request: Dict, messages: List[Dict], chat: bool):
+        backend = self.backend
+        backend.count("requests")
+        model_id = backend.prepare(request.get("model", ""))
+        prompt, images = parse_messages(messages)
+        stream = bool(request.get("stream"))
+        max_tokens = (
+            request.get("max_tokens") if chat
+            else request.get("max_output_tokens") or request.get("max_tokens")
+        ) or backend.default_max_tokens
+
+        usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        if "<image>" not in prompt:
+            tokens = (text for text in [MISSING_IMAGE_MARKDOWN])
+        else:
+            tokens = backend.generate(model_id, prompt, images, int(max_tokens), usage)
+
+        if stream:
+            backend.count("streams")
+            self._stream(tokens, model_id, usage, chat)
+        else:
+            text = "".join(tokens)
+            self._send_json(200, _full_response(model_id, text, usage, chat))
+
+    def _stream(self, tokens: Iterator[str], model_id: str, usage: Dict[str, int], chat: bool):
+        created = int(time.time())
+        if chat:
+            ids = {"id": f"chatcmpl-{uuid.uuid4()}", "object": "chat.completion.chunk",
+                   "created": created, "model": model_id}
+        else:
+            ids = {"id": f"resp-{uuid.uuid4()}", "object": "response",
+                   "created": created, "model": model_id}
+            output_id = f"msg-{uuid.uuid4()}"
+
+        # Fail before headers so errors surface as proper HTTP status codes
+        try:
+            first = next(tokens, None)
+        except MockError as e:
+            self._send_error(e)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        parts = []
+        try:
+            if chat:
+                self._event({**ids, "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]})
+            else:
+                self._event({"type": "response.created", "response": ids})
+
+            token = first
+            while token is not None:
+                parts.append(token)
+                if chat:
+                    self._event({**ids, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+                else:
+                    self._event({"type": "response.output_text.delta", "response": ids,
+                                 "output_id": output_id, "output_index": 0, "delta": token})
+                token = next(tokens, None)
+
+            total = usage["prompt_tokens"] + usage["completion_tokens"]
+            if chat:
+                self._event({**ids, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                             "usage": {**usage, "total_tokens": total}})
+            else:
+                self._event({"type": "response.completed", "response": {
+                    **ids,
+                    "output": [{"id": output_id, "type": "message", "role": "assistant",
+                                "content": [{"type": "output_text", "text": "".join(parts)}]}],
+                    "usage": {"input_tokens": usage["prompt_tokens"],
+                              "output_tokens": usage["completion_tokens"], "total_tokens": total},
+                }})
+            self._event("[DONE]")
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            # Runs the generator's disconnect handling (decode continues or stops)
+            tokens.close()
+
+    def _event(self, payload):
+        data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        self._chunk(f"data: {data}\n\n".encode("utf-8"))
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict):
+        self._send_body(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _send_error(self, error: MockError):
+        self._send_json(error.status, {"error": {"message": str(error), "type": error.error_type}})
+
+def _full_response(model_id: str, text: str, usage: Dict[str, int], chat: bool) -> Dict:
+    """Non-streaming ChatCompletionResponse / ResponsesResponse"""
+    created = int(time.time())
+    total = {**usage, "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"]}
+    if chat:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4()}",
+            "object": "chat.completion",
+            "created": created,
+            "model": model_id,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": total,
+        }
+    return {
+        "id": f"resp-{uuid.uuid4()}",
+        "object": "response",
+        "created": created,
+        "model": model_id,
+        "output": [{
+            "id": f"msg-{uuid.uuid4()}",
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": text}],
+        }],
+        "usage": total,
+    }
+
+def serve(backend: MockOCRBackend, host: str = "127.0.0.1", port: int = 8000, quiet: bool = True) -> ThreadingHTTPServer:
+    """Create a threaded mock server (call serve_forever or run it in a thread)"""
+    handler = type("BoundMockOCRHandler", (MockOCRHandler,), {"backend": backend, "quiet": quiet})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def load_replay(source: str) -> List[str]:
+    """Raw outputs to replay from a JSONL file or a directory of .txt files"""
+    return [raw_text for _, raw_text in iter_raw_records(source) if raw_text]
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock DeepSeek-OCR server with simulated latency")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address")
+    parser.add_argument("--port", type=int, default=8000, help="Port")
+    parser.add_argument("--profile", choices=sorted(LATENCY_PROFILES), default="gpu", help="Base latency profile")
+    parser.add_argument("--prefill-ms", type=float, help="Override fixed prefill latency")
+    parser.add_argument("--prefill-ms-per-1k", type=float, help="Override prefill latency per 1000 prompt tokens")
+    parser.add_argument("--token-ms", type=float, help="Override mean per-token latency")
+    parser.add_argument("--jitter", type=float, help="Override log-normal sigma of all delays")
+    parser.add_argument("--swap-ms", type=float, help="Override model swap latency")
+    parser.add_argument("--models", nargs="+", help="Served model ids (default: model_selector models)")
+    parser.add_argument("--replay", help="JSONL or directory of recorded raw outputs to replay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--loop-rate", type=float, default=0.0, help="Fraction of outputs that loop until max_tokens")
+    parser.add_argument("--max-tokens", type=int, default=2048, help="Default max_tokens")
+    parser.add_argument("--cancel-on-disconnect", action="store_true", help="Stop decoding when a stream client leaves")
+    parser.add_argument("--seed", type=int, help="Seed for latency, error and loop sampling")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    overrides = {
+        key: value for key, value in {
+            "prefill_ms": args.prefill_ms,
+            "prefill_ms_per_1k": args.prefill_ms_per_1k,
+            "token_ms": args.token_ms,
+            "jitter": args.jitter,
+            "swap_ms": args.swap_ms,
+        }.items() if value is not None
+    }
+    profile = replace(LATENCY_PROFILES[args.profile], **overrides)
+
+    backend = MockOCRBackend(
+        profile,
+        models=args.models,
+        replay=load_replay(args.replay) if args.replay else None,
+        error_rate=args.error_rate,
+        loop_rate=args.loop_rate,
+        default_max_tokens=args.max_tokens,
+        cancel_on_disconnect=args.cancel_on_disconnect,
+        seed=args.seed,
+    )
+    server = serve(backend, args.host, args.port, quiet=not args.verbose)
+
+    print("🧪 Mock DeepSeek-OCR server")
+    print("=" * 80)
+    print(f"Listening: http://{args.host}:{args.port}/v1")
+    print(f"Profile: {args.profile} {json.dumps(asdict(profile))}")
+    print(f"Models: {', '.join(backend.models)}")
+    if backend.replay:
+        print(f"Replay: {len(backend.replay)} recorded outputs")
+    print("=" * 80)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Stopped")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
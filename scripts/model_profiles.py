@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Measured model performance profiles for DeepSeek-OCR
+ModelSelector.MODELS carries speed_seconds, vram_gb and accuracy_pct as
+hand-entered estimates, which drift as kernels and quantizations change.
+ProfileStore ingests benchmark JSON in the bench.rs format and keeps, per
+hardware fingerprint and model:
+
+  - latency samples (seconds per document, newest `max_samples` kept)
+  - peak memory observations in GB, when the run reports them
+
+Latency comes from the first stage found among LATENCY_STAGES: load_test
+end-to-end latency, test_extraction's client.http (server time as seen by
+the client) or decode.generate from `deepseek-ocr-cli --bench-output`.
+The model is taken from each event's `model` field, then the document's
+`config.model`, then --model. Peak memory is read from a top-level
+`peak_memory_bytes` / `peak_vram_bytes` key or given with --peak-memory-gb.
+Samples are dated by the document's `recorded_at` (written by BenchRecorder),
+else by the file's modification time, so an old run ingested today is not
+counted as fresh.
+
+Profiles belong to the server that ran the model, not to the machine
+running these scripts (test_extraction usually reaches the server over an
+SSH tunnel). A run is filed under its `hardware` key, written by
+`deepseek-ocr-cli --bench-output` on the server, else under --hardware;
+runs with neither are rejected. Selection reads the profiles of the
+fingerprint it is given and never falls back to the local one. Run
+`model_profiles.py fingerprint` on the server to get its fingerprint.
+
+Samples older than `max_age_days` are ignored, and a model without fresh
+samples has no profile, so ModelSelector falls back to its constants.
+
+Usage:
+    python3 model_profiles.py fingerprint                  # on the server
+    python3 model_profiles.py --hardware "NVIDIA L4 22GB" ingest run.json --model paddleocr-vl-q4k --store profiles.json
+    python3 model_profiles.py show --store profiles.json
+    python3 model_selector.py --doc-type ktp --priority speed --profiles profiles.json --profile-hardware "NVIDIA L4 22GB"
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ocr_client import percentile
+
+LATENCY_STAGES = ("load.end_to_end", "client.http", "decode.generate")
+PEAK_MEMORY_KEYS = ("peak_memory_bytes", "peak_vram_bytes")
+
+_STORE_IDS = itertools.count()
+
+@functools.lru_cache(maxsize=1)
+def hardware_fingerprint() -> str:
+    """GPU name and memory from nvidia-smi, else the CPU architecture and core count"""
+    try:
+        result = subprocess.run(
+            ["nvidia-smi", "--query-gpu=name,memory.total", "--format=csv,noheader,nounits"],
+            capture_output=True,
+            text=True,
+            timeout=5
+        )
+        if result.returncode == 0 and result.stdout.strip():
+            name, memory_mb = [part.strip() for part in result.stdout.strip().split("\n")[0].split(",")]
+            return f"{name} {float(memory_mb) / 1024:.0f}GB"
+    except (OSError, subprocess.SubprocessError, ValueError):
+        pass
+    return f"cpu {platform.machine()} x{os.cpu_count() or 1}"
+
+def _event_seconds(event: Dict) -> float:
+    if "duration_ms" in event:
+        return float(event["duration_ms"]) / 1000
+    return int(event["duration_ns"]) / 1e9
+
+def _event_fields(event: Dict) -> Dict:
+    fields = event.get("fields") or {}
+    if isinstance(fields, list):
+        return {field["key"]: field["value"] for field in fields}
+    return fields
+
+def latency_stage(data: Dict) -> Optional[str]:
+    """The stage of a bench document that measures per-document latency"""
+    stages = {event["stage"] for event in data.get("events") or []}
+    stages |= {entry["stage"] for entry in data.get("stage_totals") or []}
+    return next((stage for stage in LATENCY_STAGES if stage in stages), None)
+
+class ModelProfile:
+    """Measured latency and memory of one model on one machine"""
+
+    def __init__(self, samples: Optional[List[List[float]]] = None, memory: Optional[List[List[float]]] = None):
+        self.samples = samples or []   # [timestamp, seconds]
+        self.memory = memory or []     # [timestamp, peak GB]
+
+    def summary(self, max_age_seconds: float, now: float) -> Optional[Dict]:
+        """Percentiles over fresh samples, or None when there are none"""
+        cutoff = now - max_age_seconds
+        latencies = [seconds for stamp, seconds in self.samples if stamp >= cutoff]
+        if not latencies:
+            return None
+        memory = [gb for stamp, gb in self.memory if stamp >= cutoff]
+        newest = max(stamp for stamp, _ in self.samples)
+        return {
+            "samples": len(latencies),
+            "p50_seconds": percentile(latencies, 50),
+            "p95_seconds": percentile(latencies, 95),
+            "peak_memory_gb": max(memory) if memory else None,
+            "age_seconds": now - newest,
+        }
+
+class ProfileStore:
+    """JSON-backed profiles keyed by hardware fingerprint and model"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_age_days: float = 30.0,
+        max_samples: int = 1000,
+        hardware: Optional[str] = None,
+    ):
+        """
+        Args:
+            path: JSON file to load from and save to (None: in memory only)
+            max_age_days: Samples older than this are ignored
+            max_samples: Latency samples kept per model, newest first
+            hardware: Fingerprint of the server whose profiles are selected,
+                and the one runs without a `hardware` key are filed under.
+                None: no profile is selected and such runs are rejected
+        """
+        self.path = path
+        self.max_age_seconds = max_age_days * 86400
+        self.max_samples = max_samples
+        self.hardware = hardware
+        self.version = 0  # Bumped on every change, for memoized selections
+        self._store_id = next(_STORE_IDS)  # Unlike id(), never reused by another store
+        # Staleness is checked at this granularity by memoized selections
+        self.freshness_seconds = max(1.0, min(3600.0, self.max_age_seconds / 100))
+        self._profiles: Dict[str, Dict[str, ModelProfile]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for hardware_key, models in data.get("profiles", {}).items():
+                self._profiles[hardware_key] = {
+                    model: ModelProfile(entry["samples"], entry["memory"]) for model, entry in models.items()
+                }
+
+    def add(self, model: str, latencies: List[float], peak_memory_gb: Optional[float] = None,
+            timestamp: Optional[float] = None, hardware: Optional[str] = None):
+        """Record latency samples (and a peak memory reading) for `model` on `hardware`"""
+        hardware = hardware or self.hardware
+        if hardware is None:
+            raise ValueError("No hardware fingerprint for these samples: pass --hardware")
+        stamp = timestamp or time.time()
+        with self._lock:
+            profile = self._profiles.setdefault(hardware, {}).setdefault(model, ModelProfile())
+            profile.samples.extend([stamp, seconds] for seconds in latencies)
+            profile.samples.sort(key=lambda sample: sample[0])
+            del profile.samples[:-self.max_samples]
+            if peak_memory_gb is not None:
+                profile.memory.append([stamp, peak_memory_gb])
+                profile.memory.sort(key=lambda sample: sample[0])
+                del profile.memory[:-self.max_samples]
+            self.version += 1
+
+    def ingest(self, data: Dict, model: Optional[str] = None, stage: Optional[str] = None,
+               peak_memory_gb: Optional[float] = None, timestamp: Optional[float] = None) -> Dict[str, int]:
+        """
+        Add the latency samples of one bench document
+
+        Samples are dated by the document's `recorded_at` when present,
+        else by `timestamp`, else now. They are filed under the document's
+        `hardware` when present, else under this store's fingerprint.
+
+        Returns the number of samples added per model.
+        """
+        timestamp = data.get("recorded_at") or timestamp
+        hardware = data.get("hardware") or self.hardware
+        if hardware is None:
+            raise ValueError("Run carries no server hardware fingerprint: pass --hardware")
+        stage = stage or latency_stage(data)
+        if stage is None:
+            raise ValueError(f"No latency stage found (looked for {', '.join(LATENCY_STAGES)})")
+        default_model = model or (data.get("config") or {}).get("model")
+        if peak_memory_gb is None:
+            peak_bytes = next((data[key] for key in PEAK_MEMORY_KEYS if data.get(key)), None)
+            peak_memory_gb = peak_bytes / 1024 ** 3 if peak_bytes else None
+
+        per_model: Dict[str, List[float]] = {}
+        events = [event for event in data.get("events") or [] if event["stage"] == stage]
+        for event in events:
+            event_model = _event_fields(event).get("model") or default_model
+            if event_model is None:
+                raise ValueError("Events carry no model: pass --model")
+            per_model.setdefault(event_model, []).append(_event_seconds(event))
+        if not events:
+            # Written without per-event output: the median is the best single sample
+            entry = next(entry for entry in data.get("stage_totals") or [] if entry["stage"] == stage)
+            if default_model is None:
+                raise ValueError("Stage totals carry no model: pass --model")
+            per_model[default_model] = [entry.get("p50_ms", entry["avg_ms"]) / 1000]
+
+        for model_id, latencies in per_model.items():
+            self.add(model_id, latencies, peak_memory_gb, timestamp, hardware)
+        return {model_id: len(latencies) for model_id, latencies in per_model.items()}
+
+    def cache_token(self) -> Tuple[int, int, int]:
+        """
+        Changes whenever selections from this store may change
+
+        New samples bump `version`; the time bucket advances every
+        `freshness_seconds`, so samples ageing out are noticed within 1% of
+        max_age_days (at most an hour).
+        """
+        return self._store_id, self.version, int(time.time() // self.freshness_seconds)
+
+    def profile(self, model: str) -> Optional[Dict]:
+        """Fresh measurements of `model` on the selected hardware, or None"""
+        if self.hardware is None:
+            return None
+        with self._lock:
+            entry = self._profiles.get(self.hardware, {}).get(model)
+            return entry.summary(self.max_age_seconds, time.time()) if entry else None
+
+    def report(self) -> List[Dict]:
+        """One row per hardware and model, stale ones included"""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for hardware_key, models in sorted(self._profiles.items()):
+                for model, entry in sorted(models.items()):
+                    fresh = entry.summary(self.max_age_seconds, now)
+                    newest = max((stamp for stamp, _ in entry.samples), default=0.0)
+                    rows.append({
+                        "hardware": hardware_key,
+                        "model": model,
+                        "stale": fresh is None,
+                        "age_seconds": now - newest,
+                        **(fresh or {"samples": 0, "p50_seconds": None, "p95_seconds": None, "peak_memory_gb": None}),
+                    })
+        return rows
+
+    def save(self, path: Optional[str] = None):
+        """Write the store atomically (temp file + rename)"""
+        target = path or self.path
+        if not target:
+            return
+        with self._lock:
+            data = {"profiles": {
+                hardware_key: {
+                    model: {"samples": entry.samples, "memory": entry.memory}
+                    for model, entry in models.items()
+                }
+                for hardware_key, models in self._profiles.items()
+            }}
+        temp = f"{target}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp, target)
+
+def print_profiles(store: ProfileStore):
+    """Table of stored profiles; stale rows are marked"""
+    print(f"📐 Model profiles (max age {store.max_age_seconds / 86400:g} days, "
+          f"selected hardware: {store.hardware or '(none)'})")
+    print(f"{'Hardware':<28}{'Model':<22}{'Samples':>8}{'p50 s':>8}{'p95 s':>8}{'Peak GB':>9}{'Age':>9}")
+    for row in store.report():
+        if row["stale"]:
+            measured = f"{'stale':>8}{'':>8}{'':>9}"
+        else:
+            peak = f"{row['peak_memory_gb']:.1f}" if row["peak_memory_gb"] is not None else "-"
+            measured = f"{row['p50_seconds']:>8.2f}{row['p95_seconds']:>8.2f}{peak:>9}"
+        print(f"{row['hardware'][:27]:<28}{row['model']:<22}{row['samples']:>8}{measured}"
+              f"{row['age_seconds'] / 86400:>8.1f}d")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect measured model profiles")
+    parser.add_argument("--store", default="model_profiles.json", help="Profile store (default: %(default)s)")
+    parser.add_argument("--max-age-days", type=float, default=30.0, help="Ignore samples older than this")
+    parser.add_argument("--hardware",
+                        help="Server fingerprint for runs without a `hardware` key, and to select in `show`")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="Add bench JSON runs to the store")
+    ingest.add_argument("runs", nargs="+", help="Bench JSON files (--bench-output, load_test --output)")
+    ingest.add_argument("--model", help="Model id for runs whose events do not name one")
+    ingest.add_argument("--stage", help=f"Latency stage (default: first of {', '.join(LATENCY_STAGES)})")
+    ingest.add_argument("--peak-memory-gb", type=float, help="Peak memory of these runs")
+    commands.add_parser("show", help="Print the stored profiles")
+    commands.add_parser("fingerprint", help="Print this machine's fingerprint (run it on the server)")
+    args = parser.parse_args()
+
+    if args.command == "fingerprint":
+        print(hardware_fingerprint())
+        return
+
+    store = ProfileStore(args.store, max_age_days=args.max_age_days, hardware=args.hardware)
+    if args.command == "ingest":
+        for run in args.runs:
+            with open(run, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            try:
+                added = store.ingest(data, args.model, args.stage, args.peak_memory_gb,
+                                     timestamp=os.path.getmtime(run))
+            except ValueError as e:
+                print(f"❌ {run}: {e}")
+                continue
+            counts = ", ".join(f"{model}: {count}" for model, count in sorted(added.items()))
+            print(f"✅ {run}: {counts}")
+        store.save()
+        print(f"💾 Profiles saved to: {args.store}")
+        print()
+    print_profiles(store)
+
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,58 @@
 Intelligent Model Selector for DeepSeek-OCR
 Auto-select optimal model based on document type, server resources, and requirements
 
+Importable as a library: recommend() returns the same report as --json,
+memoized per (doc type, priority, available VRAM). VRAM is detected once
+per process (detect_vram.cache_clear() re-probes), so a selection after
+the first costs a dictionary lookup instead of an interpreter start and
+an nvidia-smi call.
+
+With a model_profiles.ProfileStore (--profiles), selection uses measured
+p50/p95 latency and peak memory from the target server's benchmark runs
+(--profile-hardware) where fresh ones exist, and the MODELS constants
+otherwise.
+
 Usage:
     python3 model_selector.py --doc-type ktp
     python3 model_selector.py --doc-type ijazah --vram 8
     python3 model_selector.py --analyze image.jpg
+    python3 model_selector.py --doc-type ktp --bench-selection 20
+    python3 model_selector.py --doc-type ktp --priority speed --profiles model_profiles.json
 """
 
 import argparse
+import collections
+import copy
+import functools
 import json
 import subprocess
 import sys
+import threading
+import time
+from pathlib import Path
 from typing import Dict, Tuple, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from enum import Enum
 
+@functools.lru_cache(maxsize=1)
+def detect_vram() -> float:
+    """Total VRAM of the first GPU in GB via nvidia-smi (16 GB if unknown), probed once"""
+    try:
+        result = subprocess.run(
+            ['nvidia-smi', '--query-gpu=memory.total', '--format=csv,noheader,nounits'],
+            capture_output=True,
+            text=True,
+            timeout=5
+        )
+        if result.returncode == 0:
+            vram_mb = float(result.stdout.strip().split('\n')[0])
+            return vram_mb / 1024.0  # Convert to GB
+    except:
+        pass
+    
+    # Default to conservative 16GB if cannot detect
+    return 16.0
+
 class DocumentType(Enum):
     """Supported document types"""
     KTP = "ktp"
@@ -129,32 +167,40 @@ class ModelSelector:
         DocumentType.UNKNOWN: ("paddleocr-vl", "paddleocr-vl-q4k"),
     }
     
-    def __init__(self, available_vram_gb: Optional[float] = None):
+    def __init__(self, available_vram_gb: Optional[float] = None, profiles=None):
         """
         Initialize model selector
         
         Args:
             available_vram_gb: Available VRAM in GB. If None, will try to detect.
+            profiles: model_profiles.ProfileStore with measured latency and
+                peak memory (None: use the MODELS constants)
         """
         self.available_vram = available_vram_gb or self._detect_vram()
+        self.profiles = profiles
         
     def _detect_vram(self) -> float:
-        """Detect available VRAM using nvidia-smi"""
-        try:
-            result = subprocess.run(
-                ['nvidia-smi', '--query-gpu=memory.total', '--format=csv,noheader,nounits'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                vram_mb = float(result.stdout.strip().split('\n')[0])
-                return vram_mb / 1024.0  # Convert to GB
-        except:
-            pass
-        
-        # Default to conservative 16GB if cannot detect
-        return 16.0
+        """Detect available VRAM using nvidia-smi (cached per process)"""
+        return detect_vram()
+    
+    def _profile(self, name: str) -> Optional[Dict]:
+        """Fresh measured profile of a model on the target server, if any"""
+        return self.profiles.profile(name) if self.profiles is not None else None
+    
+    def _config(self, name: str) -> ModelConfig:
+        """MODELS entry with measured p50 latency and peak memory substituted"""
+        config = self.MODELS[name]
+        measured = self._profile(name)
+        if measured is None:
+            return config
+        config = replace(config, speed_seconds=measured["p50_seconds"])
+        if measured["peak_memory_gb"] is not None:
+            config = replace(config, vram_gb=measured["peak_memory_gb"])
+        return config
+    
+    def _p95_seconds(self, name: str) -> float:
+        measured = self._profile(name)
+        return measured["p95_seconds"] if measured else self.MODELS[name].speed_seconds
     
     def select_model(
         self, 
@@ -181,32 +227,38 @@ class ModelSelector:
         
         candidates = [primary, fallback]
         
-        # Filter by available VRAM
+        # Filter by available VRAM (measured peak memory when profiled)
         valid_models = [
-            (name, self.MODELS[name]) 
+            (name, self._config(name)) 
             for name in candidates 
-            if self.MODELS[name].vram_gb <= self.available_vram
+            if self._config(name).vram_gb <= self.available_vram
         ]
         
         if not valid_models:
             # Fallback to smallest model
             model_name = "paddleocr-vl-q4k"
-            config = self.MODELS[model_name]
+            config = self._config(model_name)
             reason = f"⚠️ Insufficient VRAM ({self.available_vram:.1f}GB). Using lightest model."
             return model_name, config, reason
         
         # Apply priority selection
         if priority == "speed" or batch_mode:
-            # Sort by speed (fastest first)
-            valid_models.sort(key=lambda x: x[1].speed_seconds)
+            # Sort by speed (fastest first): median, then tail latency
+            valid_models.sort(key=lambda x: (x[1].speed_seconds, self._p95_seconds(x[0])))
             model_name, config = valid_models[0]
-            reason = f"✅ Selected for SPEED: {config.speed_seconds}s per doc"
+            if self._profile(model_name):
+                reason = (f"✅ Selected for SPEED: {config.speed_seconds:.2f}s p50, "
+                          f"{self._p95_seconds(model_name):.2f}s p95 per doc (measured)")
+            else:
+                reason = f"✅ Selected for SPEED: {config.speed_seconds}s per doc"
             
         elif priority == "memory":
             # Sort by VRAM usage (lowest first)
             valid_models.sort(key=lambda x: x[1].vram_gb)
             model_name, config = valid_models[0]
             reason = f"✅ Selected for MEMORY: {config.vram_gb:.1f}GB VRAM"
+            if (self._profile(model_name) or {}).get("peak_memory_gb") is not None:
+                reason += " (measured peak)"
             
         elif priority == "accuracy":
             # Sort by accuracy (highest first)
@@ -229,14 +281,36 @@ class ModelSelector:
         """
         Generate detailed recommendation report
         
+        Reports are memoized per (doc type, priority, available VRAM,
+        profile store cache token), keeping the REPORT_CACHE_SIZE most
+        recently used; each call returns its own copy.
+        
         Returns:
             Dictionary with model selection details and alternatives
         """
+        profiles_key = self.profiles.cache_token() if self.profiles is not None else None
+        key = (doc_type, priority, self.available_vram, profiles_key)
+        with _REPORT_CACHE_LOCK:
+            report = _REPORT_CACHE.get(key)
+            if report is not None:
+                _REPORT_CACHE.move_to_end(key)
+        if report is None:
+            report = self._build_report(doc_type, priority)
+            with _REPORT_CACHE_LOCK:
+                _REPORT_CACHE[key] = report
+                # The profile token changes with every new time bucket and
+                # sample, so old keys are never hit again
+                while len(_REPORT_CACHE) > REPORT_CACHE_SIZE:
+                    _REPORT_CACHE.popitem(last=False)
+        return copy.deepcopy(report)
+    
+    def _build_report(self, doc_type: DocumentType, priority: str) -> Dict:
         model_id, config, reason = self.select_model(doc_type, priority)
         
         # Get alternatives
         alternatives = []
-        for name, model_config in self.MODELS.items():
+        for name in self.MODELS:
+            model_config = self._config(name)
             if name != model_id and model_config.vram_gb <= self.available_vram:
                 if doc_type.value in model_config.best_for or not model_config.best_for:
                     alternatives.append({
@@ -244,6 +318,7 @@ class ModelSelector:
                         "vram_gb": model_config.vram_gb,
                         "speed_seconds": model_config.speed_seconds,
                         "accuracy_pct": model_config.accuracy_pct,
+                        "measured": self._profile(name) is not None,
                         "notes": model_config.notes
                     })
         
@@ -257,6 +332,8 @@ class ModelSelector:
                 "vram_gb": config.vram_gb,
                 "speed_seconds": config.speed_seconds,
                 "accuracy_pct": config.accuracy_pct,
+                "p95_seconds": self._p95_seconds(model_id),
+                "measured": self._profile(model_id) is not None,
                 "notes": config.notes,
                 "reason": reason
             },
@@ -293,6 +370,53 @@ class ModelSelector:
         
         return tips
 
+REPORT_CACHE_SIZE = 256
+_REPORT_CACHE: Dict[Tuple[DocumentType, str, float, Optional[Tuple[int, int, int]]], Dict] = collections.OrderedDict()
+_REPORT_CACHE_LOCK = threading.Lock()
+
+def recommend(
+    doc_type: str,
+    priority: str = "balanced",
+    available_vram_gb: Optional[float] = None,
+    profiles=None
+) -> Dict:
+    """
+    Recommendation report for a doc type name (library entry point)
+    
+    Same content as `model_selector.py --doc-type ... --json`, except that
+    unknown doc types get the UNKNOWN mapping instead of an error.
+    """
+    selector = ModelSelector(available_vram_gb=available_vram_gb, profiles=profiles)
+    return selector.get_recommendation_report(parse_document_type(doc_type), priority)
+
+def benchmark_selection(doc_type: str, priority: str, runs: int) -> Dict[str, float]:
+    """Mean seconds per selection: CLI subprocess, in-process cold, in-process memoized"""
+    script = str(Path(__file__).resolve())
+    timings = {}
+    
+    start = time.perf_counter()
+    for _ in range(runs):
+        subprocess.run(
+            [sys.executable, script, "--doc-type", doc_type, "--priority", priority, "--json"],
+            capture_output=True,
+            text=True
+        )
+    timings["subprocess"] = (time.perf_counter() - start) / runs
+    
+    start = time.perf_counter()
+    for _ in range(runs):
+        detect_vram.cache_clear()
+        _REPORT_CACHE.clear()
+        recommend(doc_type, priority)
+    timings["in_process_cold"] = (time.perf_counter() - start) / runs
+    
+    recommend(doc_type, priority)
+    start = time.perf_counter()
+    for _ in range(runs * 1000):
+        recommend(doc_type, priority)
+    timings["in_process_memoized"] = (time.perf_counter() - start) / (runs * 1000)
+    return timings
+
 def parse_document_type(doc_type_str: str) -> DocumentType:
     """Parse document type from string"""
     doc_type_str = doc_type_str.lower().strip()
@@ -337,6 +461,13 @@ Examples:
   
   # Get JSON output for API integration
   python3 model_selector.py --doc-type ijazah --json
+  
+  # Per-call selection cost: CLI subprocess vs in-process (cold and memoized)
+  python3 model_selector.py --doc-type ktp --bench-selection 20
+  
+  # Rank by latency measured on the target server (see model_profiles.py)
+  python3 model_selector.py --doc-type ktp --priority speed --profiles model_profiles.json \\
+      --profile-hardware "NVIDIA L4 22GB"
         """
     )
     
@@ -371,6 +502,32 @@ Examples:
         help='Output as JSON'
     )
     
+    parser.add_argument(
+        '--bench-selection',
+        type=int,
+        metavar='RUNS',
+        help='Benchmark per-call selection overhead over RUNS calls'
+    )
+    
+    parser.add_argument(
+        '--profiles',
+        metavar='PATH',
+        help='Profile store from model_profiles.py: rank by measured latency and memory'
+    )
+    
+    parser.add_argument(
+        '--profile-hardware',
+        metavar='FINGERPRINT',
+        help='Server whose profiles to use (model_profiles.py fingerprint, run on the server)'
+    )
+    
+    parser.add_argument(
+        '--profile-max-age-days',
+        type=float,
+        default=30.0,
+        help='Ignore profile samples older than this (default: 30)'
+    )
+    
     parser.add_argument(
         '--list-models',
         action='store_true',
@@ -378,6 +535,8 @@ Examples:
     )
     
     args = parser.parse_args()
+    if args.profiles and not args.profile_hardware:
+        parser.error("--profiles needs --profile-hardware: profiles are per server, not this machine")
     
     # List models if requested
     if args.list_models:
@@ -399,8 +558,23 @@ Examples:
         print("Supported types: ktp, sim, ijazah, sertifikat, passport, kk, npwp, akta, invoice, receipt, form", file=sys.stderr)
         sys.exit(1)
     
+    if args.bench_selection:
+        priority = args.priority if not args.batch else "speed"
+        timings = benchmark_selection(args.doc_type, priority, args.bench_selection)
+        print(f"\n⏱️  Model selection overhead ({args.bench_selection} runs, {doc_type.value})\n")
+        for label, seconds in timings.items():
+            print(f"   {label:<22}{seconds * 1000:>12.4f} ms/call")
+        print(f"\n   Memoized speedup over subprocess: {timings['subprocess'] / timings['in_process_memoized']:,.0f}x\n")
+        return
+    
+    profiles = None
+    if args.profiles:
+        from model_profiles import ProfileStore
+        profiles = ProfileStore(args.profiles, max_age_days=args.profile_max_age_days,
+                                hardware=args.profile_hardware)
+    
     # Initialize selector
-    selector = ModelSelector(available_vram_gb=args.vram)
+    selector = ModelSelector(available_vram_gb=args.vram, profiles=profiles)
     
     # Get recommendation
     report = selector.get_recommendation_report(
@@ -420,7 +594,10 @@ Examples:
         rec = report['recommended_model']
         print(f"✅ Recommended Model: {rec['model_id']}")
         print(f"   VRAM Required: {rec['vram_gb']:.1f}GB")
-        print(f"   Expected Speed: {rec['speed_seconds']:.1f}s per document")
+        if rec['measured']:
+            print(f"   Measured Speed: {rec['speed_seconds']:.2f}s p50, {rec['p95_seconds']:.2f}s p95 per document")
+        else:
+            print(f"   Expected Speed: {rec['speed_seconds']:.1f}s per document")
         print(f"   Accuracy: {rec['accuracy_pct']:.0f}%")
         print(f"   Reason: {rec['reason']}")
         print(f"   Notes: {rec['notes']}")
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Multi-page PDF and TIFF ingestion for DeepSeek-OCR
+Ijazah transcripts and KK scans arrive as multi-page PDFs and TIFFs, while
+the server takes one image per request. MultipageExtractor rasterizes pages
+in a process pool and hands each page to extract_document as soon as it is
+rendered, so later pages render while earlier ones are on the GPU:
+
+    render:     [p1][p2][p3][p4]
+    inference:      [  p1  ][  p2  ][  p3  ][  p4  ]
+
+Rendering runs at most `prefetch` pages ahead of the pages being extracted.
+Rendered pages are written as JPEG to a temporary directory and uploaded
+from disk. Page results are put back in page order and merged into one
+document result; the report shows how much rendering overlapped inference.
+
+PDFs need pypdfium2 (pip install pypdfium2); TIFFs only need Pillow.
+Single-page TIFFs are sent as they are.
+
+Usage:
+    python3 test_extraction.py transcript.pdf ijazah --dpi 200
+    python3 test_extraction.py --batch scans/ --render-workers 4
+    python3 multipage.py transcript.pdf --dpi 150 --output pages/
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+DEFAULT_DPI = 200
+PDF_POINTS_PER_INCH = 72
+
+def _require(path: str):
+    if Path(path).suffix.lower() == ".pdf":
+        if pdfium is None:
+            raise RuntimeError("pypdfium2 is required for PDF input: pip install pypdfium2")
+    elif Image is None:
+        raise RuntimeError("Pillow is required for TIFF input: pip install pillow")
+
+def page_count(path: str) -> int:
+    """Number of pages (PDF) or frames (TIFF); 1 for anything else"""
+    suffix = Path(path).suffix.lower()
+    if suffix not in (".pdf", ".tif", ".tiff"):
+        return 1
+    _require(path)
+    if suffix == ".pdf":
+        document = pdfium.PdfDocument(path)
+        try:
+            return len(document)
+        finally:
+            document.close()
+    with Image.open(path) as image:
+        return getattr(image, "n_frames", 1)
+
+def is_multipage(path: str) -> bool:
+    """PDFs always need rasterizing; TIFFs only when they hold several pages"""
+    suffix = Path(path).suffix.lower()
+    if suffix == ".pdf":
+        return True
+    if suffix in (".tif", ".tiff") and Image is not None:
+        try:
+            return page_count(path) > 1
+        except OSError:
+            return False
+    return False
+
+def render_page(path: str, index: int, dpi: int, output_path: str, quality: int = 90) -> Dict:
+    """Rasterize one page to a JPEG file (runs in a worker process)"""
+    started = time.monotonic()
+    _require(path)
+    if Path(path).suffix.lower() == ".pdf":
+        document = pdfium.PdfDocument(path)
+        try:
+            page = document[index]
+            image = page.render(scale=dpi / PDF_POINTS_PER_INCH).to_pil()
+            page.close()
+        finally:
+            document.close()
+    else:
+        with Image.open(path) as tiff:
+            tiff.seek(index)
+            source_dpi = float((tiff.info.get("dpi") or (dpi, dpi))[0]) or dpi
+            image = tiff.convert("RGB")
+        # Scanned pixels are never upsampled, only reduced to the target DPI
+        scale = dpi / source_dpi
+        if scale < 1:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+    image.convert("RGB").save(output_path, "JPEG", quality=quality)
+    return {
+        "index": index,
+        "path": output_path,
+        "width": image.width,
+        "height": image.height,
+        "started": started,
+        "finished": time.monotonic(),
+    }
+
+def _union(intervals: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    merged: List[Tuple[float, float]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def overlap_seconds(a: List[Tuple[float, float]], b: List[Tuple[float, float]]) -> float:
+    """Time during which some interval of `a` and some interval of `b` were both running"""
+    a, b = _union(a), _union(b)
+    total = 0.0
+    i = j = 0
+    while i < len(a) and j < len(b):
+        total += max(0.0, min(a[i][1], b[j][1]) - max(a[i][0], b[j][0]))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return total
+
+def merge_pages(pages: List[Dict]) -> Optional[Dict]:
+    """
+    Combine per-page extracted_data in page order
+
+    The first page that has a field wins; list fields (transcript rows,
+    family members) are concatenated across pages.
+    """
+    merged: Dict = {}
+    found = False
+    for page in pages:
+        data = page.get("extracted_data")
+        if not isinstance(data, dict):
+            continue
+        found = True
+        for key, value in data.items():
+            if key not in merged or merged[key] in (None, "", [], {}):
+                merged[key] = value
+            elif isinstance(merged[key], list) and isinstance(value, list):
+                merged[key] = merged[key] + value
+    return merged if found else None
+
+class MultipageExtractor:
+    """Pipelined page rendering and extraction around an extract function"""
+
+    def __init__(
+        self,
+        extract: Callable[..., dict],
+        dpi: int = DEFAULT_DPI,
+        render_workers: Optional[int] = None,
+        page_concurrency: int = 2,
+        prefetch: int = 2,
+    ):
+        """
+        Args:
+            extract: extract_document-compatible callable (or a FallbackChain)
+            dpi: Target resolution of rendered pages
+            render_workers: Rasterizer processes (default: CPU count, at most 4)
+            page_concurrency: Pages of one document extracted at the same time
+            prefetch: Rendered pages kept ready beyond those being extracted
+        """
+        self.extract = extract
+        self.dpi = dpi
+        self.render_workers = render_workers or max(1, min(4, os.cpu_count() or 1))
+        self.page_concurrency = max(1, page_concurrency)
+        self.prefetch = max(0, prefetch)
+        self._renderers: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "documents": 0, "pages": 0, "failed_pages": 0,
+            "render_seconds": 0.0, "inference_seconds": 0.0,
+            "wall_seconds": 0.0, "overlap_seconds": 0.0,
+        }
+
+    def _get_renderers(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._renderers is None:
+                # pdfium is not thread-safe, and spawn avoids forking a threaded client
+                self._renderers = ProcessPoolExecutor(
+                    max_workers=self.render_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._renderers
+
+    def __call__(self, image_path: str, doc_type: str = "ktp", **kwargs) -> dict:
+        if not is_multipage(image_path):
+            return self.extract(image_path, doc_type, **kwargs)
+        return self.extract_pages(image_path, doc_type, **kwargs)
+
+    def extract_pages(self, path: str, doc_type: str = "ktp", **kwargs) -> dict:
+        """Render and extract every page of `path`, overlapping the two"""
+        started = time.monotonic()
+        try:
+            count = page_count(path)
+        except (OSError, RuntimeError) as e:
+            return {"success": False, "error": f"Cannot open multi-page document: {e}"}
+
+        results: List[Optional[Dict]] = [None] * count
+        render_intervals: List[Tuple[float, float]] = []
+        inference_intervals: List[Tuple[float, float]] = []
+        renderers = self._get_renderers()
+
+        with tempfile.TemporaryDirectory(prefix="ocr-pages-") as workdir, \
+                ThreadPoolExecutor(max_workers=self.page_concurrency) as inference:
+            renders: Dict = {}
+            extractions: Dict = {}
+            next_page = 0
+
+            def submit_render():
+                nonlocal next_page
+                output_path = os.path.join(workdir, f"page-{next_page + 1:04d}.jpg")
+                future = renderers.submit(render_page, path, next_page, self.dpi, output_path)
+                renders[future] = next_page
+                next_page += 1
+                return future
+
+            def extract_page(page: Dict) -> Dict:
+                page_started = time.monotonic()
+                try:
+                    result = dict(self.extract(page["path"], doc_type, **kwargs))
+                except Exception as e:
+                    result = {"success": False, "error": f"{type(e).__name__}: {e}"}
+                finished = time.monotonic()
+                result["page"] = page["index"] + 1
+                result["render_seconds"] = page["finished"] - page["started"]
+                result["inference_window"] = (page_started, finished)
+                return result
+
+            # Pages rendering, rendered or being extracted; bounds memory and disk
+            window = self.page_concurrency + self.prefetch
+            pending = {submit_render() for _ in range(min(count, window))}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in renders:
+                        index = renders.pop(future)
+                        try:
+                            page = future.result()
+                        except Exception as e:
+                            results[index] = {"success": False, "page": index + 1,
+                                              "error": f"Render failed: {type(e).__name__}: {e}"}
+                        else:
+                            render_intervals.append((page["started"], page["finished"]))
+                            extraction = inference.submit(extract_page, page)
+                            extractions[extraction] = page
+                            pending.add(extraction)
+                            continue
+                    else:
+                        page = extractions.pop(future)
+                        result = future.result()
+                        inference_intervals.append(result.pop("inference_window"))
+                        results[page["index"]] = result
+                        os.remove(page["path"])
+                    if next_page < count:
+                        pending.add(submit_render())
+
+        wall = time.monotonic() - started
+        document = self._assemble(path, results, wall, render_intervals, inference_intervals)
+        with self._lock:
+            self._stats["documents"] += 1
+            self._stats["pages"] += count
+            self._stats["failed_pages"] += sum(not page.get("success") for page in results)
+            for key in ("render_seconds", "inference_seconds", "wall_seconds", "overlap_seconds"):
+                self._stats[key] += document["multipage"][key]
+        return document
+
+    def _assemble(
+        self,
+        path: str,
+        pages: List[Dict],
+        wall: float,
+        render_intervals: List[Tuple[float, float]],
+        inference_intervals: List[Tuple[float, float]],
+    ) -> Dict:
+        failed = [page for page in pages if not page.get("success")]
+        merged = merge_pages(pages)
+        models = sorted({page["model_used"] for page in pages if page.get("model_used")})
+        render_seconds = sum(end - start for start, end in render_intervals)
+        inference_seconds = sum(end - start for start, end in inference_intervals)
+        document = {
+            "success": not failed,
+            "model_used": ", ".join(models) or None,
+            "duration_seconds": wall,
+            "image_size_kb": os.path.getsize(path) / 1024,
+            "raw_response": "\n\n".join(page.get("raw_response", "") for page in pages),
+            "extracted_data": merged,
+            "fields_count": len(merged) if merged else 0,
+            "page_count": len(pages),
+            "pages": pages,
+            "multipage": {
+                "dpi": self.dpi,
+                "render_seconds": render_seconds,
+                "inference_seconds": inference_seconds,
+                "wall_seconds": wall,
+                "serial_seconds": render_seconds + inference_seconds,
+                "overlap_seconds": overlap_seconds(render_intervals, inference_intervals),
+            },
+        }
+        if failed:
+            document["error"] = f"{len(failed)}/{len(pages)} pages failed: " \
+                                f"page {failed[0].get('page')}: {failed[0].get('error', 'Unknown error')}"
+        if merged is None:
+            document["note"] = "No page returned valid JSON, returning raw text"
+        return document
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        with self._lock:
+            if self._renderers is not None:
+                self._renderers.shutdown()
+                self._renderers = None
+
+def print_multipage_stats(stats: Dict):
+    """One line of pipelining totals over all multi-page documents"""
+    if not stats["documents"]:
+        return
+    serial = stats["render_seconds"] + stats["inference_seconds"]
+    print(f"📑 Multi-page: {stats['documents']} documents, {stats['pages']} pages "
+          f"({stats['failed_pages']} failed); render {stats['render_seconds']:.1f}s + "
+          f"inference {stats['inference_seconds']:.1f}s = {serial:.1f}s serial, "
+          f"{stats['wall_seconds']:.1f}s pipelined ({stats['overlap_seconds']:.1f}s overlapped)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Rasterize a multi-page PDF or TIFF like the extraction pipeline does")
+    parser.add_argument("path", help="PDF or TIFF document")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI, help="Target resolution (default: %(default)s)")
+    parser.add_argument("--output", default=".", help="Directory for the page JPEGs")
+    args = parser.parse_args()
+
+    try:
+        count = page_count(args.path)
+    except (OSError, RuntimeError) as e:
+        print(f"❌ Error: {e}")
+        return
+
+    os.makedirs(args.output, exist_ok=True)
+    print(f"📑 {args.path}: {count} pages at {args.dpi} DPI")
+    print("=" * 80)
+    stem = Path(args.path).stem
+    for index in range(count):
+        output_path = os.path.join(args.output, f"{stem}-page-{index + 1:04d}.jpg")
+        page = render_page(args.path, index, args.dpi, output_path)
+        print(f"   Page {index + 1}: {page['width']}x{page['height']} in "
+              f"{page['finished'] - page['started']:.2f}s -> {output_path}")
+
+if __name__ == "__main__":
+    main()
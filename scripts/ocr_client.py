@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Pooled HTTP client for the DeepSeek-OCR OpenAI-compatible API
+Keeps connections alive across requests (important over the SSH tunnel) and
+retries connection failures and 5xx responses with jittered exponential backoff.
+Read timeouts are not retried: the server may still be generating, and
+re-sending the request would start the same generation again.
+
+Usage:
+    from ocr_client import OCRClient
+
+    client = OCRClient("http://localhost:23333/v1", pool_maxsize=8)
+    response = client.post("/chat/completions", payload)
+    result = await client.apost("/chat/completions", payload)
+
+    with client.stream_chat(payload) as stream:
+        for delta in stream:
+            print(delta, end="")
+    print(stream.metrics.to_dict())
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_API_BASE = "http://localhost:23333/v1"
+DEFAULT_API_KEY = "dummy"  # Not validated by server
+
+# Status codes worth retrying: server-side failures, not client mistakes
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+
+class OCRStreamError(Exception):
+    """Error event received in the middle of an SSE stream"""
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile (pct in 0..100) of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def iter_sse_data(response: requests.Response) -> Iterator[str]:
+    """Yield the `data:` payload of each server-sent event until [DONE]"""
+    data_lines = []
+    # chunk_size=None yields bytes as they arrive instead of waiting for a full
+    # buffer; lines are decoded here because SSE responses carry no charset
+    for raw_line in response.iter_lines(chunk_size=None):
+        line = raw_line.decode("utf-8", errors="replace")
+        if line == "":
+            if data_lines:
+                data = "\n".join(data_lines)
+                data_lines = []
+                if data == "[DONE]":
+                    return
+                yield data
+            continue
+        if line.startswith(":"):
+            continue  # SSE comment / keep-alive
+        if line.startswith("data:"):
+            data_lines.append(line[5:].lstrip(" "))
+    if data_lines:
+        data = "\n".join(data_lines)
+        if data != "[DONE]":
+            yield data
+
+class StreamMetrics:
+    """Timing of a streamed generation, measured on the monotonic clock"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_delta: Optional[float] = None
+        self.end: Optional[float] = None
+        self.delta_times: List[float] = []
+        self.completion_tokens: Optional[int] = None
+
+    def record_delta(self):
+        now = time.perf_counter()
+        if self.first_delta is None:
+            self.first_delta = now
+        self.delta_times.append(now)
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """Seconds from request start to the first content delta"""
+        if self.first_delta is None:
+            return None
+        return self.first_delta - self.start
+
+    @property
+    def total_seconds(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def inter_token_latencies(self) -> List[float]:
+        times = self.delta_times
+        return [b - a for a, b in zip(times, times[1:])]
+
+    @property
+    def tokens(self) -> int:
+        """Generated tokens (server usage if reported, otherwise delta count)"""
+        if self.completion_tokens is not None:
+            return self.completion_tokens
+        return len(self.delta_times)
+
+    def to_dict(self) -> Dict:
+        gaps = self.inter_token_latencies
+        decode_seconds = (self.delta_times[-1] - self.first_delta) if len(self.delta_times) > 1 else 0.0
+        total = self.total_seconds
+        return {
+            "ttft_seconds": self.ttft,
+            "total_seconds": total,
+            "deltas": len(self.delta_times),
+            "tokens": self.tokens,
+            "tokens_per_second": self.tokens / total if total > 0 else 0.0,
+            "decode_tokens_per_second": (len(gaps) / decode_seconds) if decode_seconds > 0 else 0.0,
+            "inter_token_ms": {
+                "p50": percentile(gaps, 50) * 1e3,
+                "p90": percentile(gaps, 90) * 1e3,
+                "p99": percentile(gaps, 99) * 1e3,
+                "max": max(gaps) * 1e3 if gaps else 0.0,
+            },
+        }
+
+class ChatStream:
+    """
+    Incremental reader for a streamed /chat/completions (or /responses) call
+
+    Iterating yields content deltas as they arrive; `content` holds the text
+    assembled so far, so parsing can start before generation finishes. Closing
+    the stream early drops the connection.
+    """
+
+    def __init__(self, response: requests.Response, metrics: StreamMetrics):
+        self.response = response
+        self.metrics = metrics
+        self._parts: List[str] = []
+        self.usage: Optional[Dict] = None
+        self.finish_reason: Optional[str] = None
+        self.closed = False
+        self.error: Optional[BaseException] = None  # Set when reading the stream failed
+        self.linger = 0.0  # Seconds the server is expected to stay busy after close()
+        self._done_callbacks: List[Callable[["ChatStream"], None]] = []
+        self._done = False
+
+    def add_done_callback(self, callback: Callable[["ChatStream"], None]):
+        """Call `callback(stream)` once the stream is exhausted or closed"""
+        if self._done:
+            callback(self)
+        else:
+            self._done_callbacks.append(callback)
+
+    def _mark_done(self):
+        self.metrics.finish()
+        if self._done:
+            return
+        self._done = True
+        for callback in self._done_callbacks:
+            callback(self)
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for data in iter_sse_data(self.response):
+                event = json.loads(data)
+                delta = self._parse_event(event)
+                if delta:
+                    self.metrics.record_delta()
+                    self._parts.append(delta)
+                    yield delta
+                if self.closed:
+                    break  # Consumer stopped the stream early
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self._mark_done()
+
+    @property
+    def content(self) -> str:
+        """Text assembled from all deltas received so far"""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def _parse_event(self, event: Dict) -> str:
+        if "error" in event:
+            message = event["error"].get("message", "Unknown error")
+            raise OCRStreamError(message)
+
+        usage = event.get("usage")
+        if usage is None and isinstance(event.get("response"), dict):
+            usage = event["response"].get("usage")
+        if usage:
+            self.usage = usage
+            tokens = usage.get("completion_tokens", usage.get("output_tokens"))
+            if tokens is not None:
+                self.metrics.completion_tokens = tokens
+
+        # /responses streaming events
+        if "type" in event:
+            if event["type"] == "response.output_text.delta":
+                return event.get("delta", "")
+            if event["type"] == "response.completed":
+                self.finish_reason = "stop"
+            return ""
+
+        # /chat/completions chunks
+        choices = event.get("choices") or [{}]
+        choice = choices[0]
+        if choice.get("finish_reason"):
+            self.finish_reason = choice["finish_reason"]
+        return (choice.get("delta") or {}).get("content") or ""
+
+    def read_all(self) -> str:
+        """Consume the remaining stream and return the full content"""
+        for _ in self:
+            pass
+        return self.content
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.metrics.finish()
+            self.response.close()
+            self._mark_done()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class OCRClient:
+    """Thread-safe API client with a persistent connection pool"""
+
+    def __init__(
+        self,
+        api_base: str = DEFAULT_API_BASE,
+        api_key: str = DEFAULT_API_KEY,
+        timeout: float = 120.0,
+        connect_timeout: float = 10.0,
+        pool_connections: int = 4,
+        pool_maxsize: int = 8,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 10.0,
+    ):
+        """
+        Initialize client
+
+        Args:
+            api_base: Base URL including the /v1 prefix
+            api_key: Bearer token sent with every request
+            timeout: Read timeout in seconds (generation can be slow)
+            connect_timeout: TCP connect timeout in seconds
+            pool_connections: Number of host pools to cache
+            pool_maxsize: Maximum keep-alive connections per host
+            max_retries: Retries after the first attempt (0 disables retrying)
+            backoff_base: First backoff delay in seconds
+            backoff_max: Upper bound for a single backoff delay
+        """
+        self.api_base = api_base.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+            max_retries=0,  # Retries are handled here so that 5xx are covered too
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Connection": "keep-alive",
+        })
+
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+        self._stats_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def url(self, path: str) -> str:
+        return f"{self.api_base}/{path.lstrip('/')}"
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given retry attempt (0-based)"""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request with retries on connection errors (connect timeouts
+        included) and 5xx
+
+        The last 5xx response is returned once retries are exhausted so callers
+        can report the server's error body. Connection errors are re-raised
+        after the final attempt; read timeouts are raised at once, since the
+        server may still be working on the request.
+        """
+        kwargs.setdefault("timeout", (self.connect_timeout, self.timeout))
+        url = self.url(path)
+        attempt = 0
+
+        while True:
+            self._count("requests")
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                response.close()
+            except requests.exceptions.ReadTimeout:
+                self._count("failures")
+                raise
+            except requests.exceptions.ConnectionError:  # Includes ConnectTimeout
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+
+            time.sleep(self.backoff_delay(attempt))
+            attempt += 1
+            self._count("retries")
+
+    def post(self, path: str, payload: Any = None, data: Optional[bytes] = None, **kwargs) -> requests.Response:
+        """
+        POST a JSON payload, or a pre-serialized JSON body via `data`
+
+        `data` may also be a re-iterable body with a length, such as
+        upload_body.StreamingJSONBody; it is sent with Content-Length and
+        iterated again on every retry.
+        """
+        headers = {"Content-Type": "application/json"}
+        headers.update(kwargs.pop("headers", {}))
+        if data is None:
+            data = json.dumps(payload).encode("utf-8")
+        return self.request("POST", path, data=data, headers=headers, **kwargs)
+
+    def stream_chat(self, payload: Dict, path: str = "/chat/completions", data: Optional[bytes] = None) -> ChatStream:
+        """
+        Start a streamed generation (`stream: true`)
+
+        `data` is an optional pre-serialized body (bytes or a re-iterable
+        body, see post). It must already carry `"stream": true`.
+
+        Opening the stream goes through request(): connection errors and
+        5xx responses are retried, read timeouts are not. A non-200 status
+        left after retrying raises requests.HTTPError. Once the response
+        headers have arrived nothing is retried, and errors while reading
+        surface from iterating the stream.
+        """
+        body = None
+        if data is None:
+            body = dict(payload)
+            body["stream"] = True
+        metrics = StreamMetrics()
+        response = self.post(path, body, data=data, stream=True)
+        if response.status_code != 200:
+            try:
+                response.raise_for_status()
+            finally:
+                response.close()
+        return ChatStream(response, metrics)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def chat_completion(self, payload: Dict) -> Dict:
+        """Call /chat/completions and return the decoded JSON body"""
+        response = self.post("/chat/completions", payload)
+        response.raise_for_status()
+        return response.json()
+
+    def health(self) -> bool:
+        """Return True if the server answers /health"""
+        try:
+            return self.get("/health", timeout=self.connect_timeout).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    # Async entry points run the pooled sync client on a dedicated thread pool
+    # sized to the connection pool, so keep-alive connections are shared.
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.pool_maxsize,
+                thread_name_prefix="ocr-client",
+            )
+        return self._executor
+
+    async def arequest(self, method: str, path: str, **kwargs) -> requests.Response:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), lambda: self.request(method, path, **kwargs)
+        )
+
+    async def apost(self, path: str, payload: Any = None, **kwargs) -> requests.Response:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), lambda: self.post(path, payload, **kwargs)
+        )
+
+    async def achat_completion(self, payload: Dict) -> Dict:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), lambda: self.chat_completion(payload)
+        )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_default_client: Optional[OCRClient] = None
+_default_lock = threading.Lock()
+
+def get_default_client(**kwargs) -> OCRClient:
+    """Process-wide shared client (created on first use)"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = OCRClient(**kwargs)
+        return _default_client
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Streaming repetition detector for looping OCR output
+Spots a model stuck in a loop (the deepseek-ocr "duplicate output" issue)
+while the text is still streaming, so the request can be cancelled, and cuts
+loops out of stored outputs offline.
+
+Rabin-Karp rolling hashes over character n-grams are kept for a bounded
+window of recent text. A loop is reported when the text becomes periodic: a
+block of `period` characters repeats back to back at least `min_repeats`
+times (multi-line blocks included, which line-based dedup misses). Text that
+merely recurs with other text in between is not a loop: KK and transcript
+tables repeat the same cell text on every row. Blocks with fewer than
+`min_block_content` letters and digits outside markup tags (empty table
+rows, rules) are not loops either. Each character costs O(1) amortized
+work, so very long outputs stay linear.
+
+Usage:
+    python3 repetition_detector.py raw_output.txt
+    cat raw_output.txt | python3 repetition_detector.py --json
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+
+_MOD = (1 << 61) - 1
+_TAG = re.compile(r"<[^>]*>")
+
+@dataclass
+class RepetitionInfo:
+    """Where and how a loop was detected"""
+    kind: str          # "periodic"
+    cut_at: int        # Keep text[:cut_at]
+    detected_at: int   # Character offset at which the loop was recognised
+    period: int        # Block length
+    repeats: int       # Copies seen when detected
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+class RepetitionDetector:
+    """Incremental loop detector fed with streamed text deltas"""
+
+    def __init__(
+        self,
+        ngram: int = 40,
+        window: int = 8192,
+        min_period: int = 8,
+        min_repeats: int = 3,
+        min_loop_chars: int = 120,
+        min_block_content: int = 8,
+    ):
+        """
+        Args:
+            ngram: Characters per hashed n-gram
+            window: How far back (characters) repeats are looked for
+            min_period: Ignore shorter periods (e.g. "-----" table rules)
+            min_repeats: Back-to-back copies of a block that count as a loop
+            min_loop_chars: Minimum total length of a periodic loop region
+            min_block_content: Letters and digits (outside <tags>) a repeated
+                block needs to count as a loop, so empty table rows do not
+        """
+        self.ngram = ngram
+        self.window = window
+        self.min_period = min_period
+        self.min_repeats = min_repeats
+        self.min_loop_chars = min_loop_chars
+        self.min_block_content = min_block_content
+
+        self.length = 0
+        self.info: Optional[RepetitionInfo] = None
+
+        self._base = random.randrange(256, _MOD - 1)
+        self._base_pow = pow(self._base, ngram - 1, _MOD)
+        self._hash = 0
+        self._last_seen: Dict[int, int] = {}
+        self._history = deque()
+
+        self._period = 0
+        self._run = 0
+        self._content_checked = False  # Current run's block already rejected as contentless
+
+        # Only the last `window` characters are needed; trimmed in bulk
+        self._buf = []
+        self._offset = 0
+
+    @property
+    def detected(self) -> bool:
+        return self.info is not None
+
+    def feed(self, delta: str) -> bool:
+        """Add streamed text; return True once a loop has been detected"""
+        if self.info is not None:
+            return True
+        for ch in delta:
+            if self._push(ch):
+                return True
+        return False
+
+    def _char(self, pos: int) -> str:
+        return self._buf[pos - self._offset]
+
+    def _push(self, ch: str) -> bool:
+        i = self.length
+        self.length += 1
+        self._buf.append(ch)
+        if len(self._buf) > 2 * (self.window + self.ngram):
+            drop = len(self._buf) - (self.window + self.ngram)
+            del self._buf[:drop]
+            self._offset += drop
+        n = self.ngram
+
+        # Extend or break the current periodic run with an O(1) comparison
+        if self._period:
+            if self._char(i - self._period) == ch:
+                self._run += 1
+            else:
+                self._period = 0
+                self._run = 0
+                self._content_checked = False
+
+        # Roll the n-gram hash forward
+        if i >= n:
+            self._hash = (self._hash - ord(self._char(i - n)) * self._base_pow) % _MOD
+        self._hash = (self._hash * self._base + ord(ch)) % _MOD
+        if i < n - 1:
+            return False
+
+        h = self._hash
+
+        # A repeated n-gram at distance >= min_period may start a periodic run
+        previous = self._last_seen.get(h)
+        if not self._period and previous is not None:
+            distance = i - previous
+            if distance >= self.min_period and self._same(previous, i):
+                self._period = distance
+                self._run = n
+
+        self._last_seen[h] = i
+        self._history.append((i, h))
+        self._evict(i)
+
+        if self._period and not self._content_checked:
+            region = self._run + self._period
+            repeats = region // self._period
+            if repeats >= self.min_repeats and region >= self.min_loop_chars:
+                loop_start = i - region + 1
+                if not self._has_content(loop_start, self._period):
+                    # Checked once per run, so long empty tables stay linear
+                    self._content_checked = True
+                    return False
+                self.info = RepetitionInfo(
+                    kind="periodic",
+                    cut_at=loop_start + self._period,
+                    detected_at=i + 1,
+                    period=self._period,
+                    repeats=repeats,
+                )
+                return True
+
+        return False
+
+    def _has_content(self, start: int, length: int) -> bool:
+        """Whether text[start:start + length] has enough letters and digits outside tags"""
+        block = "".join(self._buf[start - self._offset:start - self._offset + length])
+        return sum(ch.isalnum() for ch in _TAG.sub("", block)) >= self.min_block_content
+
+    def _same(self, j: int, i: int) -> bool:
+        """Verify that the n-grams ending at j and i are equal (no hash collision)"""
+        n = self.ngram
+        if j - n + 1 < self._offset:
+            return False
+        a = j - n + 1 - self._offset
+        b = i - n + 1 - self._offset
+        return self._buf[a:a + n] == self._buf[b:b + n]
+
+    def _evict(self, i: int):
+        """Forget n-grams that fell out of the window"""
+        horizon = i - self.window
+        history = self._history
+        while history and history[0][0] < horizon:
+            pos, h = history.popleft()
+            if self._last_seen.get(h) == pos:
+                del self._last_seen[h]
+
+def truncate_repetitions(text: str, **kwargs) -> Tuple[str, Optional[RepetitionInfo]]:
+    """
+    Cut a looping output down to the text before the loop (plus one copy)
+
+    Returns:
+        Tuple of (text, info); info is None when no loop was found
+    """
+    detector = RepetitionDetector(**kwargs)
+    detector.feed(text)
+    if detector.info is None:
+        return text, None
+    return text[:detector.info.cut_at].rstrip(), detector.info
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect and cut loops in OCR output")
+    parser.add_argument("file", nargs="?", help="Raw output file (default: stdin)")
+    parser.add_argument("--ngram", type=int, default=40, help="N-gram length in characters")
+    parser.add_argument("--window", type=int, default=8192, help="Look-back window in characters")
+    parser.add_argument("--min-repeats", type=int, default=3, help="Back-to-back copies that form a loop")
+    parser.add_argument("--json", action="store_true", help="Output detection info as JSON")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            raw_text = f.read()
+    else:
+        raw_text = sys.stdin.read()
+
+    text, info = truncate_repetitions(
+        raw_text, ngram=args.ngram, window=args.window, min_repeats=args.min_repeats
+    )
+
+    if args.json:
+        print(json.dumps({
+            "detected": info is not None,
+            "original_chars": len(raw_text),
+            "kept_chars": len(text),
+            "info": info.to_dict() if info else None,
+        }, indent=2))
+        return
+
+    if info is None:
+        print("✅ No repetition loop detected", file=sys.stderr)
+    else:
+        print(f"✂️  {info.kind} loop at char {info.cut_at} "
+              f"(period {info.period}, {info.repeats} copies): "
+              f"kept {len(text)} of {len(raw_text)} chars", file=sys.stderr)
+    print(text)
+
+if __name__ == "__main__":
+    main()
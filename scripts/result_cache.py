@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Content-addressed result cache for OCR requests
+Stores the raw model output (choices[0].message.content) in a local SQLite
+file, keyed by the SHA-256 of the image bytes plus every request parameter
+that changes the output. Re-submitted scans are answered without touching
+the GPU server, and cleaners can be re-run on the cached raw text.
+
+Usage:
+    python3 result_cache.py ocr_cache.db
+    python3 result_cache.py ocr_cache.db --clear
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def hash_bytes(data: bytes) -> str:
+    """SHA-256 hex digest of raw image bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def request_key(
+    image_sha256: str,
+    model_id: str,
+    prompt: str,
+    temperature: float,
+    max_tokens: int
+) -> str:
+    """Cache key for one OCR request (any parameter change is a new key)"""
+    material = json.dumps(
+        [image_sha256, model_id, prompt, float(temperature), int(max_tokens)],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    """SQLite-backed LRU cache of raw OCR outputs, bounded by total size"""
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Open (or create) a cache
+
+        Args:
+            path: SQLite database file
+            max_bytes: Upper bound on stored content size before LRU eviction
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                model_id TEXT NOT NULL,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_access ON results(last_access)"
+        )
+        # Running total of results.size, kept in the same transactions as the
+        # rows so eviction checks do not scan the table (and other processes
+        # sharing the file stay in step)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            """
+            INSERT OR IGNORE INTO meta (name, value)
+            SELECT 'total_size', COALESCE(SUM(size), 0) FROM results
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return cached raw content or None, updating recency on a hit"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, content: str, model_id: str):
+        """Store raw content and evict least recently used entries if over budget"""
+        size = len(content.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO results (key, model_id, content, size, created, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, model_id, content, size, now, now),
+                )
+                self._add_size(size - (row[0] if row else 0))
+                self._evict()
+                self._conn.commit()
+            except BaseException:
+                # Release the write lock; other processes would block on it
+                self._conn.rollback()
+                raise
+
+    def _add_size(self, delta: int):
+        self._conn.execute("UPDATE meta SET value = value + ? WHERE name = 'total_size'", (delta,))
+
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT value FROM meta WHERE name = 'total_size'").fetchone()[0]
+
+    def _evict(self):
+        total = self._total_size()
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        victims = []
+        freed = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM results ORDER BY last_access ASC"
+        ):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+
+        self._conn.executemany("DELETE FROM results WHERE key = ?", victims)
+        self._add_size(-freed)
+        self.evictions += len(victims)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this process plus current store size"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            size = self._total_size()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.execute("UPDATE meta SET value = 0 WHERE name = 'total_size'")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the OCR result cache")
+    parser.add_argument("path", help="Cache database file")
+    parser.add_argument("--clear", action="store_true", help="Remove all cached results")
+    args = parser.parse_args()
+
+    cache = ResultCache(args.path)
+
+    if args.clear:
+        cache.clear()
+        print(f"🗑️  Cleared cache: {args.path}")
+
+    stats = cache.stats()
+    print(f"📦 Cache: {args.path}")
+    print(f"   Entries: {stats['entries']}")
+    print(f"   Size: {stats['size_bytes'] / 1024:.1f} KB / {stats['max_bytes'] / 1024 / 1024:.0f} MB")
+    cache.close()
+
+if __name__ == "__main__":
+    main()
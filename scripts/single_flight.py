@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Single-flight request coalescing for DeepSeek-OCR
+Double submissions and several reviewers opening the same scan produce
+identical requests that overlap in time. SingleFlight lets the first caller
+for a key run the server call while later callers with the same key wait
+for it and receive the same outcome (or exception), so overlapping
+duplicates cost one inference instead of one each.
+
+Keys are result_cache.request_key values (image hash, model, prompt and
+decode parameters), so only requests that would produce identical output
+share a call. Unlike the result cache nothing is kept once the call
+finishes: a duplicate arriving afterwards runs again (or hits the cache).
+
+Usage:
+    coalescer = SingleFlight()
+    outcome, shared = coalescer.do(key, call_server)
+"""
+
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+class _Flight:
+    """One in-flight call; waiters block on `done`"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+class SingleFlight:
+    """Thread-safe coalescing of concurrent calls with the same key"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "executed": 0, "coalesced": 0}
+
+    def do(self, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run func() unless a call with this key is already in flight
+
+        Returns:
+            (result, shared) - shared is True when this caller waited for
+            another caller's call instead of running func itself
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats["executed"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = func()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self) -> Dict:
+        """calls, executed (server calls made), coalesced (calls that waited)"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["coalesce_rate"] = stats["coalesced"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
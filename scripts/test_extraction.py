@@ -2,84 +2,47 @@
 """
 Test KTP/Ijazah extraction via DeepSeek-OCR API
 Usage: python3 test_extraction.py <image_path> [document_type]
+       python3 test_extraction.py --batch <dir|manifest> [--concurrency N]
 """
 
+import argparse
+import asyncio
+import functools
 import sys
 import json
-import base64
 import requests
 import time
+from contextlib import nullcontext
 from pathlib import Path
-from ktp_cleaner import clean_ktp_output
+from typing import Callable
+from batch_checkpoint import BatchCheckpoint, JsonlSink
+from bench_report import BenchRecorder, print_stage_totals
+from concurrency_limit import AdaptiveLimiter
+from image_hash import NearDuplicateIndex
+from ktp_cleaner import StreamingKTPCleaner, clean_ktp_output
+from model_profiles import ProfileStore
+from model_scheduler import ModelAffinityScheduler
+from model_selector import recommend
+from multipage import MultipageExtractor, print_multipage_stats
+from endpoint_pool import EndpointPool
+from fallback_chain import FallbackChain, model_chain, print_fallback_stats
+from ocr_client import ChatStream, OCRClient, get_default_client
+from repetition_detector import RepetitionDetector
+from result_cache import ResultCache, hash_bytes, hash_file, request_key
+from single_flight import SingleFlight
+from token_budget import TokenBudgets, print_budget_report
+from upload_body import IMAGE_PLACEHOLDER, StreamingJSONBody
+from vision_tokens import (
+    apply_plan, budget_for, image_dimensions, plan_resize, predict_prefill_tokens
+)
 
 # API Configuration
 API_BASE = "http://localhost:23333/v1"
 API_KEY = "dummy"  # Not validated by server
 
-def select_optimal_model(doc_type: str = "ktp", priority: str = "balanced") -> dict:
-    """Use model selector to get optimal model"""
-    import subprocess
-    
-    try:
-        result = subprocess.run(
-            ["python3", "scripts/model_selector.py",
-             "--doc-type", doc_type,
-             "--priority", priority,
-             "--json"],
-            capture_output=True,
-            text=True,
-            cwd=Path(__file__).parent
-        )
-        
-        if result.returncode == 0:
-            return json.loads(result.stdout)
-        else:
-            print(f"⚠️  Model selector failed, using default: paddleocr-vl")
-            return {
-                "recommended_model": {
-                    "model_id": "paddleocr-vl",
-                    "vram_gb": 9.0,
-                    "speed_seconds": 10.0,
-                    "accuracy_pct": 100.0
-                }
-            }
-    except Exception as e:
-        print(f"⚠️  Error selecting model: {e}")
-        return {
-            "recommended_model": {
-                "model_id": "paddleocr-vl"
-            }
-        }
-
-def encode_image(image_path: str) -> str:
-    """Encode image to base64"""
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode()
-
-def extract_document(image_path: str, doc_type: str = "ktp", model_id: str = None) -> dict:
-    """Extract data from document image"""
-    
-    # Step 1: Select model if not specified
-    if not model_id:
-        print(f"🔍 Selecting optimal model for {doc_type.upper()}...")
-        model_rec = select_optimal_model(doc_type)
-        model_id = model_rec["recommended_model"]["model_id"]
-        print(f"✅ Selected: {model_id}")
-        print(f"   VRAM: {model_rec['recommended_model'].get('vram_gb', 'N/A')}GB")
-        print(f"   Speed: {model_rec['recommended_model'].get('speed_seconds', 'N/A')}s")
-        print(f"   Accuracy: {model_rec['recommended_model'].get('accuracy_pct', 'N/A')}%")
-        print()
-    
-    # Step 2: Encode image
-    print(f"📷 Encoding image: {image_path}")
-    image_base64 = encode_image(image_path)
-    image_size_kb = len(image_base64) * 3 / 4 / 1024  # Approximate original size
-    print(f"   Size: {image_size_kb:.1f} KB")
-    print()
-    
-    # Step 3: Prepare prompt based on doc type
-    prompts = {
-        "ktp": """Extract all information from this KTP (Indonesian ID card) and return as JSON with these fields:
+# Extraction prompts per document type
+PROMPTS = {
+    "ktp": """Extract all information from this KTP (Indonesian ID card) and return as JSON with these fields:
 - NIK (16 digits)
 - Nama (Full name)
 - Tempat_Lahir (Place of birth)
@@ -96,8 +59,8 @@ def extract_document(image_path: str, doc_type: str = "ktp", model_id: str = Non
 - Berlaku_Hingga (Valid until)
 
 Return only valid JSON, no additional text.""",
-        
-        "ijazah": """Extract all information from this diploma/certificate and return as JSON with these fields:
+    
+    "ijazah": """Extract all information from this diploma/certificate and return as JSON with these fields:
 - Nama (Graduate name)
 - Institusi (Institution name)
 - Program_Studi (Study program)
@@ -107,8 +70,8 @@ Return only valid JSON, no additional text.""",
 - Nomor_Ijazah (Certificate number)
 
 Return only valid JSON, no additional text.""",
-        
-        "sim": """Extract all information from this SIM (Driver's License) and return as JSON with these fields:
+    
+    "sim": """Extract all information from this SIM (Driver's License) and return as JSON with these fields:
 - Nomor_SIM (License number)
 - Nama (Full name)
 - Tempat_Lahir (Place of birth)
@@ -120,116 +83,474 @@ Return only valid JSON, no additional text.""",
 - Golongan (License class)
 
 Return only valid JSON, no additional text."""
+}
+
+def select_optimal_model(doc_type: str = "ktp", priority: str = "balanced", profiles: ProfileStore = None) -> dict:
+    """Use model selector to get optimal model (in-process, memoized per doc type)"""
+    try:
+        return recommend(doc_type, priority, profiles=profiles)
+    except Exception as e:
+        print(f"⚠️  Error selecting model: {e}")
+        return {
+            "recommended_model": {
+                "model_id": "paddleocr-vl",
+                "vram_gb": 9.0,
+                "speed_seconds": 10.0,
+                "accuracy_pct": 100.0
+            }
+        }
+
+def _silent(*args, **kwargs):
+    """Drop progress output (used when verbose=False)"""
+    pass
+
+def _no_stage(stage: str, **fields):
+    """Stand-in for BenchRecorder.stage when no benchmark is recorded"""
+    return nullcontext(fields)
+
+def build_chat_payload(
+    model_id: str,
+    image_base64: str,
+    prompt: str,
+    temperature: float = 0,
+    max_tokens: int = 2048
+) -> dict:
+    """Build the /chat/completions request body for one image"""
+    return {
+        "model": model_id,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{image_base64}"
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": prompt
+                    }
+                ]
+            }
+        ],
+        "temperature": temperature,
+        "max_tokens": max_tokens
     }
+
+def build_result(
+    content: str,
+    doc_type: str,
+    model_id: str,
+    duration: float,
+    image_size_kb: float
+) -> dict:
+    """Clean and structure raw model output into an extraction result"""
     
-    prompt = prompts.get(doc_type, prompts["ktp"])
+    # Clean and structure the output for KTP
+    if doc_type == "ktp":
+        cleaned_result = clean_ktp_output(content)
+        
+        return {
+            "success": True,
+            "model_used": model_id,
+            "duration_seconds": duration,
+            "image_size_kb": image_size_kb,
+            "raw_response": content,
+            "extracted_data": cleaned_result['data'],
+            "validation": cleaned_result['validation'],
+            "fields_count": cleaned_result['fields_extracted']
+        }
     
-    # Step 4: Call API
-    print(f"🚀 Calling DeepSeek-OCR API...")
-    print(f"   Endpoint: {API_BASE}/chat/completions")
-    print(f"   Model: {model_id}")
-    print()
+    # Try to parse as JSON for other document types
+    try:
+        # Extract JSON from markdown code blocks if present
+        if "```json" in content:
+            content = content.split("```json")[1].split("```")[0].strip()
+        elif "```" in content:
+            content = content.split("```")[1].split("```")[0].strip()
+        
+        extracted_data = json.loads(content)
+        
+        return {
+            "success": True,
+            "model_used": model_id,
+            "duration_seconds": duration,
+            "image_size_kb": image_size_kb,
+            "raw_response": content,
+            "extracted_data": extracted_data,
+            "fields_count": len(extracted_data)
+        }
     
-    start_time = time.time()
+    except json.JSONDecodeError:
+        # Return raw text if not valid JSON
+        return {
+            "success": True,
+            "model_used": model_id,
+            "duration_seconds": duration,
+            "image_size_kb": image_size_kb,
+            "raw_response": content,
+            "extracted_data": None,
+            "note": "Response is not valid JSON, returning raw text"
+        }
+
+def early_stop_report(
+    stopped: bool,
+    finish_reason: str,
+    stream_metrics: dict,
+    typical_tokens: int = None
+) -> dict:
+    """Client wait avoided by closing the stream early
     
-    try:
-        response = requests.post(
-            f"{API_BASE}/chat/completions",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {API_KEY}"
-            },
-            json={
-                "model": model_id,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_base64}"
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ],
-                "temperature": 0,
-                "max_tokens": 2048
-            },
-            timeout=120
+    The server does not report how long the output would have been. The
+    estimate is the typical (median) output length learned by TokenBudgets
+    minus the tokens received, priced at the observed inter-token latency;
+    without a learned length it is None. max_tokens is not used: it is a cap,
+    and a finished KTP answer is usually a few tokens from its natural end.
+    """
+    tokens_received = stream_metrics["deltas"]
+    report = {
+        "stopped": stopped and finish_reason is None,
+        "tokens_received": tokens_received,
+        "wait_avoided_tokens": None,
+        "wait_avoided_seconds": None
+    }
+    if report["stopped"] and typical_tokens is not None:
+        remaining = max(0, typical_tokens - tokens_received)
+        report["wait_avoided_tokens"] = remaining
+        report["wait_avoided_seconds"] = remaining * stream_metrics["inter_token_ms"]["p50"] / 1e3
+    return report
+
+def extract_document(
+    image_path: str,
+    doc_type: str = "ktp",
+    model_id: str = None,
+    verbose: bool = True,
+    client: OCRClient = None,
+    cache: ResultCache = None,
+    token_budget=None,
+    stream: bool = False,
+    on_delta: Callable[[str, ChatStream], None] = None,
+    early_stop: bool = False,
+    loop_guard: bool = False,
+    bench: BenchRecorder = None,
+    coalescer: SingleFlight = None,
+    near_dups: NearDuplicateIndex = None,
+    budgets: TokenBudgets = None,
+    profiles: ProfileStore = None
+) -> dict:
+    """Extract data from document image
+    
+    Args:
+        image_path: Path to the document image
+        doc_type: Document type (ktp, ijazah, sim, ...)
+        model_id: Model to use. If None, the model selector picks one.
+        verbose: Print progress. Batch mode turns this off.
+        client: Pooled API client. Defaults to a shared client for API_BASE.
+        cache: Optional result cache. Hits skip the server entirely.
+        token_budget: Image-token budget for the resize planner. An int, or
+            "auto" for the per-doc-type default. None uploads the original.
+        stream: Use SSE streaming and record time-to-first-token metrics.
+        on_delta: Streaming only. Called as (delta, stream) for every delta;
+            stream.content holds the text so far and stream.close() stops early.
+        early_stop: KTP only. Stream and close the generation as soon as every
+            required field is present and valid (implies stream=True).
+        loop_guard: Stream and cancel as soon as the output starts looping,
+            keeping the text before the loop (implies stream=True).
+        bench: Optional recorder for per-stage client timings (client.*
+            stages in the crates/cli bench.rs format). client.serialize
+            only builds the body; base64 and file reads run during the
+            upload and are recorded as client.encode, which is also
+            included in client.http.
+        coalescer: Optional SingleFlight. Concurrent calls for the same image
+            and request parameters share one server call; waiters get the
+            leader's output (their own on_delta is not called).
+        near_dups: Optional perceptual-hash index. Rescans of an earlier image
+            (within its Hamming distance) are flagged but still sent to the
+            server: perceptual hashes do not see the text, so two cards
+            with different NIKs can hash alike.
+        budgets: Optional learned max_tokens table. Sets max_tokens for the
+            doc type and model and learns from the usage of each response.
+        profiles: Optional measured model profiles. Auto-selection ranks by
+            latency and peak memory measured on the target server.
+    """
+    log = print if verbose else _silent
+    stage = bench.stage if bench is not None else _no_stage
+    total_start = time.perf_counter_ns()
+    
+    # Step 1: Select model if not specified
+    if not model_id:
+        log(f"🔍 Selecting optimal model for {doc_type.upper()}...")
+        with stage("client.select_model", doc_type=doc_type):
+            model_rec = select_optimal_model(doc_type, profiles=profiles)
+        model_id = model_rec["recommended_model"]["model_id"]
+        log(f"✅ Selected: {model_id}")
+        log(f"   VRAM: {model_rec['recommended_model'].get('vram_gb', 'N/A')}GB")
+        log(f"   Speed: {model_rec['recommended_model'].get('speed_seconds', 'N/A')}s")
+        log(f"   Accuracy: {model_rec['recommended_model'].get('accuracy_pct', 'N/A')}%")
+        log()
+    
+    # Step 2: Encode image
+    log(f"📷 Encoding image: {image_path}")
+    image_size = Path(image_path).stat().st_size
+    image_size_kb = image_size / 1024
+    log(f"   Size: {image_size_kb:.1f} KB")
+    
+    # The upload streams the file from disk; only resizing and perceptual
+    # hashing decode the image and need its bytes in memory
+    image_bytes = None
+    if token_budget is not None or near_dups is not None:
+        with stage("client.read_file", path=image_path) as fields:
+            with open(image_path, "rb") as f:
+                image_bytes = f.read()
+            fields["bytes"] = len(image_bytes)
+    
+    # Step 3: Prepare prompt based on doc type
+    prompt = PROMPTS.get(doc_type, PROMPTS["ktp"])
+    
+    # Downscale images whose predicted vision tokens exceed the budget
+    vision_report = None
+    if token_budget is not None:
+        budget = budget_for(doc_type, None if token_budget == "auto" else int(token_budget))
+        with stage("client.resize", model=model_id) as fields:
+            width, height = image_dimensions(image_bytes)
+            plan = plan_resize(model_id, width, height, budget)
+            if plan.needs_resize:
+                image_bytes = apply_plan(image_bytes, plan)
+            fields["resized"] = plan.needs_resize
+        if plan.needs_resize:
+            log(f"   Resized: {width}x{height} -> {plan.target_size[0]}x{plan.target_size[1]} "
+                f"({plan.tokens_before} -> {plan.tokens_after} image tokens, "
+                f"{len(image_bytes) / 1024:.1f} KB)")
+        vision_report = plan.to_dict()
+        vision_report["predicted_prefill"] = predict_prefill_tokens(
+            model_id, plan.target_size[0], plan.target_size[1], prompt
         )
+    log()
+    
+    image_source = image_bytes if image_bytes is not None else image_path
+    max_tokens = budgets.max_tokens_for(doc_type, model_id) if budgets is not None else 2048
+    # The image is spliced into the request body at upload time (StreamingJSONBody)
+    payload = build_chat_payload(model_id, IMAGE_PLACEHOLDER, prompt, max_tokens=max_tokens)
+    
+    # Streaming watchers: loop detection and KTP early stop close the stream
+    loop_detector = RepetitionDetector() if loop_guard else None
+    stop_watcher = StreamingKTPCleaner() if early_stop and doc_type == "ktp" else None
+    if loop_detector or stop_watcher:
+        stream = True
+        user_on_delta = on_delta
         
-        duration = time.time() - start_time
-        
-        # Step 5: Parse response
-        if response.status_code != 200:
-            return {
-                "success": False,
-                "error": f"API error: {response.status_code}",
-                "message": response.text
-            }
+        def on_delta(delta, chat_stream):
+            if user_on_delta:
+                user_on_delta(delta, chat_stream)
+            if loop_detector and loop_detector.feed(delta):
+                chat_stream.close()
+            elif stop_watcher and stop_watcher.feed(delta):
+                chat_stream.close()
+    
+    # Identical image + request parameters share cache entries and in-flight calls
+    def request_variant(key: str) -> str:
+        # Early-stopped or loop-cut output is deliberately truncated: keep it apart
+        if stop_watcher:
+            key = hash_bytes(f"{key}:early-stop".encode())
+        if loop_detector:
+            key = hash_bytes(f"{key}:loop-guard".encode())
+        return key
+    
+    request_id = None
+    if cache is not None or coalescer is not None or near_dups is not None:
+        request_id = request_variant(request_key(
+            hash_bytes(image_bytes) if image_bytes is not None else hash_file(image_path),
+            model_id,
+            prompt,
+            payload["temperature"],
+            payload["max_tokens"]
+        ))
+    
+    # Reuse cached raw output
+    start_time = time.perf_counter()
+    content = None
+    if cache is not None:
+        with stage("client.cache_lookup") as fields:
+            content = cache.get(request_id)
+            fields["hit"] = content is not None
+    
+    # Rescans: look up the perceptual hash among earlier requests with the same parameters
+    near_duplicate = None
+    image_code = None
+    if content is None and near_dups is not None:
+        scope = request_variant(request_key(
+            "*", model_id, prompt, payload["temperature"], payload["max_tokens"]
+        ))
+        with stage("client.image_hash") as fields:
+            try:
+                image_code = near_dups.hash_image(image_bytes)
+            except OSError:
+                image_code = None  # Not decodable by Pillow: exact matching only
+            match = near_dups.find(scope, image_code) if image_code is not None else None
+            fields["match"] = match is not None
+        if match:
+            near_duplicate = {"of": match[0], "distance": match[1]}
+            log(f"🪞 Near-duplicate of an earlier image (Hamming distance {match[1]})")
+    
+    if content is not None:
+        log("♻️  Cache hit, skipping API call")
+        log()
+        with stage("client.parse", doc_type=doc_type):
+            result = build_result(content, doc_type, model_id, time.perf_counter() - start_time, image_size_kb)
+        result["cache_hit"] = True
+        if bench is not None:
+            bench.record("client.total", time.perf_counter_ns() - total_start, model=model_id, cache_hit=True)
+        if vision_report:
+            result["vision_tokens"] = vision_report
+        return result
+    
+    # Step 4: Call API
+    if client is None:
+        client = get_default_client(api_base=API_BASE, api_key=API_KEY)
+    
+    log("🚀 Calling DeepSeek-OCR API...")
+    log(f"   Endpoint: {client.api_base}/chat/completions")
+    log(f"   Model: {model_id}")
+    if stream:
+        log("   Streaming: on")
+    log()
+    
+    def record_encode(body: StreamingJSONBody):
+        # Base64 runs while the body uploads, inside client.http
+        if bench is not None:
+            bench.record_seconds("client.encode", body.encode_seconds, model=model_id)
+    
+    def call_server() -> dict:
+        """One server call; coalesced duplicates receive the same outcome"""
+        with stage("client.serialize", model=model_id) as fields:
+            body = StreamingJSONBody({**payload, "stream": True} if stream else payload, image_source)
+            fields["bytes"] = len(body)
         
-        result = response.json()
+        start_time = time.perf_counter()
         
-        if "error" in result:
-            return {
-                "success": False,
-                "error": result["error"].get("message", "Unknown error")
+        if stream:
+            # Step 5: Consume SSE deltas as they arrive
+            with stage("client.http", model=model_id, stream=True):
+                with client.stream_chat(payload, data=body) as chat_stream:
+                    for delta in chat_stream:
+                        if on_delta:
+                            on_delta(delta, chat_stream)
+                    content = chat_stream.content
+                    usage = chat_stream.usage
+            record_encode(body)
+            if loop_detector and loop_detector.detected:
+                content = content[:loop_detector.info.cut_at].rstrip()
+            stream_metrics = chat_stream.metrics.to_dict()
+            if bench is not None and stream_metrics["ttft_seconds"] is not None:
+                bench.record_seconds("client.ttft", stream_metrics["ttft_seconds"], model=model_id)
+            outcome = {
+                "content": content,
+                "usage": usage,
+                "duration": time.perf_counter() - start_time,
+                "stream_metrics": stream_metrics
             }
-        
-        content = result["choices"][0]["message"]["content"]
-        
-        # Clean and structure the output for KTP
-        if doc_type == "ktp":
-            cleaned_result = clean_ktp_output(content)
+            if stop_watcher:
+                typical_tokens = budgets.typical_tokens(doc_type, model_id) if budgets is not None else None
+                outcome["early_stop"] = early_stop_report(
+                    stop_watcher.complete, chat_stream.finish_reason, stream_metrics, typical_tokens
+                )
+            if loop_detector and loop_detector.detected:
+                outcome["repetition"] = loop_detector.info.to_dict()
+                outcome["repetition"]["tokens_received"] = stream_metrics["deltas"]
+            # Natural output length, unless a watcher cut the stream short
+            if chat_stream.finish_reason is not None:
+                outcome["completion_tokens"] = (usage or {}).get("completion_tokens", stream_metrics["deltas"])
+        else:
+            with stage("client.http", model=model_id, stream=False):
+                response = client.post("/chat/completions", payload, data=body)
+            record_encode(body)
             
-            return {
-                "success": True,
-                "model_used": model_id,
-                "duration_seconds": duration,
-                "image_size_kb": image_size_kb,
-                "raw_response": content,
-                "extracted_data": cleaned_result['data'],
-                "validation": cleaned_result['validation'],
-                "fields_count": cleaned_result['fields_extracted']
-            }
-        
-        # Try to parse as JSON for other document types
-        try:
-            # Extract JSON from markdown code blocks if present
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
+            duration = time.perf_counter() - start_time
+            
+            # Step 5: Parse response
+            if response.status_code != 200:
+                return {"failure": {
+                    "success": False,
+                    "error": f"API error: {response.status_code}",
+                    "message": response.text
+                }}
             
-            extracted_data = json.loads(content)
+            with stage("client.decode_json"):
+                result = response.json()
             
-            return {
-                "success": True,
-                "model_used": model_id,
-                "duration_seconds": duration,
-                "image_size_kb": image_size_kb,
-                "raw_response": content,
-                "extracted_data": extracted_data,
-                "fields_count": len(extracted_data)
+            if "error" in result:
+                return {"failure": {
+                    "success": False,
+                    "error": result["error"].get("message", "Unknown error")
+                }}
+            
+            outcome = {
+                "content": result["choices"][0]["message"]["content"],
+                "usage": result.get("usage"),
+                "duration": duration
             }
+            if outcome["usage"] and "completion_tokens" in outcome["usage"]:
+                outcome["completion_tokens"] = outcome["usage"]["completion_tokens"]
         
-        except json.JSONDecodeError:
-            # Return raw text if not valid JSON
-            return {
-                "success": True,
-                "model_used": model_id,
-                "duration_seconds": duration,
-                "image_size_kb": image_size_kb,
-                "raw_response": content,
-                "extracted_data": None,
-                "note": "Response is not valid JSON, returning raw text"
-            }
+        if cache is not None:
+            with stage("client.cache_store"):
+                cache.put(request_id, outcome["content"], model_id)
+        return outcome
+    
+    try:
+        flight_start = time.perf_counter()
+        if coalescer is not None:
+            outcome, shared = coalescer.do(request_id, call_server)
+        else:
+            outcome, shared = call_server(), False
+        
+        if "failure" in outcome:
+            return dict(outcome["failure"])
+        
+        duration = outcome["duration"]
+        if shared:
+            # Waited for an identical request already in flight
+            duration = time.perf_counter() - flight_start
+            log("🔗 Coalesced with an identical in-flight request")
+            log()
+            if bench is not None:
+                bench.record_seconds("client.coalesced_wait", duration, model=model_id)
+        
+        usage = outcome["usage"]
+        with stage("client.parse", doc_type=doc_type):
+            extraction = build_result(outcome["content"], doc_type, model_id, duration, image_size_kb)
+        if bench is not None:
+            bench.record("client.total", time.perf_counter_ns() - total_start, model=model_id,
+                         cache_hit=False, coalesced=shared)
+        if usage:
+            extraction["usage"] = usage
+        for key in ("stream_metrics", "early_stop", "repetition"):
+            if key in outcome:
+                extraction[key] = dict(outcome[key])
+        if shared:
+            extraction["coalesced"] = True
+        else:
+            if image_code is not None:
+                near_dups.add(scope, image_code, request_id)
+            if budgets is not None and "completion_tokens" in outcome:
+                budgets.observe(doc_type, model_id, outcome["completion_tokens"], payload["max_tokens"])
+        if budgets is not None:
+            extraction["max_tokens"] = payload["max_tokens"]
+        if near_duplicate:
+            extraction["near_duplicate"] = near_duplicate
+        if vision_report:
+            vision_report["actual_prefill"] = (usage or {}).get("prompt_tokens")
+            extraction["vision_tokens"] = vision_report
+        return extraction
+    
+    except requests.exceptions.HTTPError as e:
+        return {
+            "success": False,
+            "error": f"API error: {e.response.status_code}",
+            "message": e.response.text
+        }
     
     except requests.exceptions.ConnectionError:
         return {
@@ -265,6 +586,48 @@ def print_result(result: dict):
     print(f"Model Used: {result['model_used']}")
     print(f"Duration: {result['duration_seconds']:.2f} seconds")
     print(f"Image Size: {result['image_size_kb']:.1f} KB")
+    if result.get("cache_hit"):
+        print("Cache: HIT (no API call)")
+    if result.get("coalesced"):
+        print("Coalesced: shared an identical in-flight request")
+    if result.get("fallback", {}).get("escalated"):
+        fallback = result["fallback"]
+        tiers = " -> ".join(attempt["model"] for attempt in fallback["attempts"])
+        print(f"Fallback: {tiers} ({fallback['total_seconds']:.2f}s over all tiers)")
+    if result.get("multipage"):
+        pipeline = result["multipage"]
+        failed = sum(not page.get("success") for page in result["pages"])
+        print(f"Pages: {result['page_count']} at {pipeline['dpi']} DPI ({failed} failed), "
+              f"render {pipeline['render_seconds']:.2f}s + inference {pipeline['inference_seconds']:.2f}s, "
+              f"{pipeline['overlap_seconds']:.2f}s overlapped")
+    if result.get("near_duplicate"):
+        print(f"Near-Duplicate: Hamming distance {result['near_duplicate']['distance']} "
+              f"from an earlier image")
+    if result.get("stream_metrics"):
+        metrics = result["stream_metrics"]
+        itl = metrics["inter_token_ms"]
+        print(f"Time to First Token: {metrics['ttft_seconds'] or 0.0:.3f} seconds")
+        print(f"Inter-token Latency: p50 {itl['p50']:.1f} ms, p90 {itl['p90']:.1f} ms, p99 {itl['p99']:.1f} ms")
+        print(f"Throughput: {metrics['tokens']} tokens, {metrics['tokens_per_second']:.1f} tokens/second")
+    if result.get("early_stop", {}).get("stopped"):
+        early = result["early_stop"]
+        if early["wait_avoided_tokens"] is None:
+            print(f"Early Stop: after {early['tokens_received']} tokens "
+                  f"(no learned output length to estimate the wait avoided)")
+        else:
+            print(f"Early Stop: after {early['tokens_received']} tokens, ~{early['wait_avoided_tokens']} "
+                  f"tokens (~{early['wait_avoided_seconds']:.1f}s) of client wait avoided")
+    if result.get("repetition"):
+        loop = result["repetition"]
+        print(f"Loop Guard: {loop['kind']} repetition cut at char {loop['cut_at']} "
+              f"after {loop['tokens_received']} tokens")
+    if result.get("vision_tokens"):
+        vision = result["vision_tokens"]
+        actual = vision.get("actual_prefill")
+        print(f"Vision Tokens: {vision['tokens_after']} "
+              f"(original {vision['tokens_before']}, budget {vision['budget']})")
+        print(f"Prefill: predicted {vision['predicted_prefill']}, "
+              f"actual {actual if actual is not None else 'N/A'}")
     
     if result.get("extracted_data"):
         print(f"Fields Extracted: {result['fields_count']}")
@@ -309,23 +672,462 @@ def print_result(result: dict):
     print()
     print("=" * 80)
 
+VALID_DOC_TYPES = ["ktp", "ijazah", "sim", "sertifikat", "passport"]
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Test KTP/Ijazah extraction via DeepSeek-OCR API",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Document types:
+  - ktp (default): Indonesian ID card
+  - ijazah: Diploma/Certificate
+  - sim: Driver's License
+
+Examples:
+  python3 test_extraction.py ktp.jpg
+  python3 test_extraction.py diploma.png ijazah
+  python3 test_extraction.py sim.jpg sim
+  python3 test_extraction.py transcript.pdf ijazah --dpi 200
+
+  # Batch mode over a directory or manifest
+  python3 test_extraction.py --batch scans/ --doc-type ktp --concurrency 4
+  python3 test_extraction.py --batch manifest.txt --output results.jsonl
+
+  # Resumable batch: rerun the same command after a crash to continue
+  python3 test_extraction.py --batch scans/ --output results.jsonl --checkpoint results.ckpt
+        """
+    )
+    parser.add_argument("image_path", nargs="?", help="Document image to extract")
+    parser.add_argument("document_type", nargs="?", help="Document type (default: ktp)")
+    parser.add_argument(
+        "--batch",
+        metavar="SOURCE",
+        help="Directory or manifest (.txt/.jsonl) of images to extract concurrently"
+    )
+    parser.add_argument(
+        "--doc-type",
+        default="ktp",
+        help="Default document type for batch items (default: ktp)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Maximum in-flight requests in batch mode (default: 4)"
+    )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        action="store_true",
+        help="Batch mode: start at one in-flight request and adapt to server latency "
+             "(AIMD), with --concurrency as the upper bound"
+    )
+    parser.add_argument("--model", help="Force a model id instead of auto-selection")
+    parser.add_argument(
+        "--fallback",
+        action="store_true",
+        help="Run the doc type's fastest mapped model first and retry documents that fail "
+             "validation on the next one (--model becomes the first tier)"
+    )
+    parser.add_argument(
+        "--model-affinity",
+        action="store_true",
+        help="Batch mode: send documents grouped by model to avoid server model swaps"
+    )
+    parser.add_argument(
+        "--affinity-max-wait",
+        type=float,
+        default=300.0,
+        help="With --model-affinity: seconds a waiting model group may go without a "
+             "dispatch before it preempts the current one (default: 300)"
+    )
+    parser.add_argument(
+        "--dpi",
+        type=int,
+        default=200,
+        help="Rasterization resolution for PDF and multi-page TIFF input (default: 200)"
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        help="Page rasterizer processes for PDF/TIFF input (default: CPU count, at most 4)"
+    )
+    parser.add_argument(
+        "--page-concurrency",
+        type=int,
+        default=2,
+        help="Pages of one PDF/TIFF extracted at the same time (default: 2)"
+    )
+    parser.add_argument(
+        "--api-base",
+        default=API_BASE,
+        help=f"API base URL (default: {API_BASE})"
+    )
+    parser.add_argument(
+        "--endpoints",
+        nargs="+",
+        metavar="URL",
+        help="Spread requests over several servers (least outstanding requests, "
+             "health probing); overrides --api-base"
+    )
+    parser.add_argument(
+        "--hedge",
+        type=float,
+        metavar="PCT",
+        help="With --endpoints and --stream: send a backup request to another server "
+             "when the first token is slower than this TTFT percentile"
+    )
+    parser.add_argument(
+        "--hedge-budget",
+        type=float,
+        default=0.05,
+        help="Largest share of requests that may be hedged (default: 0.05)"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries on connection errors and 5xx responses (default: 3)"
+    )
+    parser.add_argument(
+        "--output",
+        help="Batch mode: write one JSON result per line to this file"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        metavar="LOG",
+        help="Batch mode: record finished items in this log, append to --output "
+             "and skip completed items when the job is restarted"
+    )
+    parser.add_argument(
+        "--skip-failed",
+        action="store_true",
+        help="With --checkpoint: also skip items that failed in an earlier run"
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="DB",
+        help="Cache raw model output in this SQLite file and reuse it for identical requests"
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=512,
+        help="Cache size limit before LRU eviction (default: 512 MB)"
+    )
+    parser.add_argument(
+        "--near-dup",
+        type=int,
+        metavar="BITS",
+        help="Flag rescans whose perceptual hash is within BITS of an earlier image "
+             "(flag only: they are still extracted; requires numpy and Pillow)"
+    )
+    parser.add_argument(
+        "--near-dup-index",
+        metavar="NPZ",
+        help="Load and save the perceptual-hash index here so it survives runs"
+    )
+    parser.add_argument(
+        "--max-tokens-table",
+        metavar="JSON",
+        help="Learn max_tokens per doc type and model from response usage and keep the table here"
+    )
+    parser.add_argument(
+        "--max-tokens-percentile",
+        type=float,
+        default=99,
+        help="Output-length percentile the learned max_tokens is based on (default: 99)"
+    )
+    parser.add_argument(
+        "--max-tokens-headroom",
+        type=float,
+        default=1.25,
+        help="Multiplier on that percentile (default: 1.25)"
+    )
+    parser.add_argument(
+        "--profiles",
+        metavar="PATH",
+        help="Measured model profiles (model_profiles.py ingest): auto-selection ranks "
+             "models by latency and peak memory measured on the server (needs --profile-hardware)"
+    )
+    parser.add_argument(
+        "--profile-hardware",
+        metavar="FINGERPRINT",
+        help="Fingerprint of the server whose profiles to use (model_profiles.py fingerprint, "
+             "run on the server)"
+    )
+    parser.add_argument(
+        "--profile-max-age-days",
+        type=float,
+        default=30.0,
+        help="Ignore profile samples older than this (default: 30)"
+    )
+    parser.add_argument(
+        "--token-budget",
+        metavar="N|auto",
+        help="Downscale images whose predicted vision tokens exceed N "
+             "(auto: per-doc-type default, requires Pillow)"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the response (SSE) and report time-to-first-token metrics"
+    )
+    parser.add_argument(
+        "--early-stop",
+        action="store_true",
+        help="KTP: stop generation once all required fields are extracted and valid (implies --stream)"
+    )
+    parser.add_argument(
+        "--loop-guard",
+        action="store_true",
+        help="Cancel generation when the output starts repeating itself (implies --stream)"
+    )
+    parser.add_argument(
+        "--no-coalesce",
+        action="store_true",
+        help="Batch mode: send duplicate documents separately instead of sharing in-flight calls"
+    )
+    parser.add_argument(
+        "--bench-output",
+        help="Write per-stage client timings (bench.rs JSON: events + stage_totals) to this file"
+    )
+    args = parser.parse_args()
+    if args.profiles and not args.profile_hardware:
+        parser.error("--profiles needs --profile-hardware: profiles are per server, not this machine")
+    return args
+
+def open_client(args: argparse.Namespace, pool_maxsize: int = 10):
+    """OCRClient for --api-base, or an EndpointPool when --endpoints is given"""
+    if args.endpoints:
+        return EndpointPool(
+            args.endpoints,
+            api_key=API_KEY,
+            max_retries=args.retries,
+            hedge_percentile=args.hedge,
+            hedge_budget=args.hedge_budget,
+            pool_maxsize=pool_maxsize,
+        )
+    return OCRClient(
+        api_base=args.api_base, api_key=API_KEY, pool_maxsize=pool_maxsize, max_retries=args.retries
+    )
+
+def open_near_dups(args: argparse.Namespace):
+    """Open the perceptual-hash index if --near-dup was given"""
+    if args.near_dup is None:
+        return None
+    if args.near_dup_index and Path(args.near_dup_index).exists():
+        return NearDuplicateIndex.load(args.near_dup_index, max_distance=args.near_dup)
+    return NearDuplicateIndex(max_distance=args.near_dup)
+
+def close_near_dups(args: argparse.Namespace, near_dups: NearDuplicateIndex):
+    """Print near-duplicate statistics and persist the index"""
+    stats = near_dups.stats
+    print(f"🪞 Near-duplicates: {stats['matches']} of {stats['lookups']} lookups, "
+          f"{len(near_dups)} images indexed")
+    if args.near_dup_index:
+        near_dups.save(args.near_dup_index)
+        print(f"   Index saved to: {args.near_dup_index}")
+    print()
+
+def open_budgets(args: argparse.Namespace):
+    """Load the learned max_tokens table if --max-tokens-table was given"""
+    if not args.max_tokens_table:
+        return None
+    return TokenBudgets(
+        args.max_tokens_table,
+        percentile=args.max_tokens_percentile / 100,
+        headroom=args.max_tokens_headroom
+    )
+
+def open_profiles(args: argparse.Namespace):
+    """Load measured model profiles if --profiles was given"""
+    if not args.profiles:
+        return None
+    return ProfileStore(args.profiles, max_age_days=args.profile_max_age_days, hardware=args.profile_hardware)
+
+def close_budgets(budgets: TokenBudgets):
+    """Print learned budgets and save the table"""
+    print_budget_report(budgets)
+    budgets.save()
+    print(f"   Table saved to: {budgets.path}")
+    print()
+
+def open_cache(args: argparse.Namespace):
+    """Open the result cache if --cache was given"""
+    if not args.cache:
+        return None
+    return ResultCache(args.cache, max_bytes=int(args.cache_max_mb * 1024 * 1024))
+
+def print_cache_stats(cache: ResultCache):
+    """Print cache hit/miss statistics"""
+    stats = cache.stats()
+    print(f"📦 Cache: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_rate'] * 100:.1f}% hit rate), "
+          f"{stats['entries']} entries, {stats['size_bytes'] / 1024:.1f} KB, "
+          f"{stats['evictions']} evicted")
+    print()
+
+def write_bench(bench: BenchRecorder, path: str):
+    """Print client stage totals and save them for compare_bench.py"""
+    print_stage_totals(bench.stage_totals(), "⏱️  Client stages")
+    print()
+    bench.write(path)
+    print(f"💾 Bench JSON saved to: {path}")
+    print()
+
+def normalize_doc_type(doc_type: str) -> str:
+    """Validate doc type, falling back to ktp"""
+    if doc_type not in VALID_DOC_TYPES:
+        print(f"⚠️  Unknown document type: {doc_type}")
+        print(f"   Valid types: {', '.join(VALID_DOC_TYPES)}")
+        print("   Using default: ktp")
+        return "ktp"
+    return doc_type
+
+def run_batch_mode(args: argparse.Namespace):
+    """Extract every image from a directory or manifest concurrently"""
+    from batch_extraction import (
+        collect_items, format_result_line, print_batch_summary, run_batch
+    )
+
+    items = collect_items(args.batch, normalize_doc_type(args.doc_type))
+    if not items:
+        print(f"❌ Error: No images found in: {args.batch}")
+        sys.exit(1)
+
+    # Resume: skip everything the checkpoint already marks done
+    output = JsonlSink(args.output, append=bool(args.checkpoint)) if args.output else None
+    checkpoint = None
+    skipped = 0
+    if args.checkpoint:
+        checkpoint = BatchCheckpoint(args.checkpoint, sink=output, skip_failed=args.skip_failed)
+        pending = [item for item in items if not checkpoint.is_done(item.path, item.doc_type)]
+        skipped = len(items) - len(pending)
+        items = pending
+
+    print()
+    print("🔍 DeepSeek-OCR Batch Extraction")
+    print("=" * 80)
+    print(f"Source: {args.batch}")
+    print(f"Documents: {len(items)}")
+    if checkpoint:
+        print(f"Checkpoint: {args.checkpoint} ({skipped} already completed, skipped)")
+    print(f"Concurrency: {args.concurrency}{' (adaptive upper bound)' if args.adaptive_concurrency else ''}")
+    print("=" * 80)
+    print()
+
+    if not items:
+        print("✅ Nothing left to do")
+        for handle in (checkpoint, output):
+            if handle:
+                handle.close()
+        return
+
+    def on_result(item, result, completed):
+        print(format_result_line(item, result, completed, len(items)))
+        if output:
+            output.write({"path": item.path, "doc_type": item.doc_type, **result})
+        if checkpoint:
+            checkpoint.record(item.path, item.doc_type, result)
+
+    bench = BenchRecorder() if args.bench_output else None
+    profiles = open_profiles(args)
+    
+    def select_model(doc_type: str) -> str:
+        with (bench.stage if bench else _no_stage)("client.select_model", doc_type=doc_type):
+            if args.fallback:
+                return model_chain(doc_type)[0]
+            return select_optimal_model(doc_type, profiles=profiles)["recommended_model"]["model_id"]
+
+    client = open_client(args, pool_maxsize=max(1, args.concurrency))
+    cache = open_cache(args)
+    coalescer = None if args.no_coalesce else SingleFlight()
+    near_dups = open_near_dups(args)
+    budgets = open_budgets(args)
+    extract = functools.partial(
+        extract_document,
+        client=client,
+        cache=cache,
+        token_budget=args.token_budget,
+        stream=args.stream,
+        early_stop=args.early_stop,
+        loop_guard=args.loop_guard,
+        bench=bench,
+        coalescer=coalescer,
+        near_dups=near_dups,
+        budgets=budgets
+    )
+    fallback = FallbackChain(extract) if args.fallback else None
+    multipage = MultipageExtractor(
+        fallback or extract,
+        dpi=args.dpi,
+        render_workers=args.render_workers,
+        page_concurrency=args.page_concurrency,
+    )
+
+    try:
+        summary = asyncio.run(run_batch(
+            items,
+            extract=multipage,
+            select_model=select_model,
+            concurrency=max(1, args.concurrency),
+            model_id=args.model,
+            on_result=on_result,
+            limiter=AdaptiveLimiter(max_limit=max(1, args.concurrency)) if args.adaptive_concurrency else None,
+            scheduler=ModelAffinityScheduler(args.affinity_max_wait) if args.model_affinity else None,
+        ))
+    finally:
+        multipage.close()
+        client.close()
+        if checkpoint:
+            checkpoint.close()
+        if output:
+            output.close()
+
+    if isinstance(client, EndpointPool):
+        summary.endpoints = client.endpoint_stats()
+        if client.hedge_percentile is not None:
+            summary.hedging = client.hedging_stats()
+    summary.skipped = skipped
+    if fallback:
+        summary.fallback = fallback.stats()
+    print_batch_summary(summary)
+    print_multipage_stats(multipage.stats())
+    if coalescer:
+        stats = coalescer.stats()
+        print(f"🔗 Coalescing: {stats['calls']} requests, {stats['executed']} server calls, "
+              f"{stats['coalesced']} coalesced ({stats['coalesce_rate'] * 100:.1f}%)")
+        print()
+    if near_dups:
+        close_near_dups(args, near_dups)
+    if budgets:
+        close_budgets(budgets)
+    if cache:
+        print_cache_stats(cache)
+        cache.close()
+    if output:
+        print(f"💾 Results saved to: {args.output}")
+        print()
+    if bench:
+        write_bench(bench, args.bench_output)
+
 def main():
-    if len(sys.argv) < 2:
+    args = parse_args()
+
+    if args.batch:
+        run_batch_mode(args)
+        return
+
+    if not args.image_path:
         print("Usage: python3 test_extraction.py <image_path> [document_type]")
+        print("       python3 test_extraction.py --batch <dir|manifest> [--concurrency N]")
         print()
-        print("Document types:")
-        print("  - ktp (default): Indonesian ID card")
-        print("  - ijazah: Diploma/Certificate")
-        print("  - sim: Driver's License")
-        print()
-        print("Examples:")
-        print("  python3 test_extraction.py ktp.jpg")
-        print("  python3 test_extraction.py diploma.png ijazah")
-        print("  python3 test_extraction.py sim.jpg sim")
+        print("Run with --help for details.")
         sys.exit(1)
     
-    image_path = sys.argv[1]
-    doc_type = sys.argv[2] if len(sys.argv) > 2 else "ktp"
+    image_path = args.image_path
+    doc_type = args.document_type or "ktp"
     
     # Validate image exists
     if not Path(image_path).exists():
@@ -333,12 +1135,7 @@ def main():
         sys.exit(1)
     
     # Validate doc type
-    valid_types = ["ktp", "ijazah", "sim", "sertifikat", "passport"]
-    if doc_type not in valid_types:
-        print(f"⚠️  Unknown document type: {doc_type}")
-        print(f"   Valid types: {', '.join(valid_types)}")
-        print(f"   Using default: ktp")
-        doc_type = "ktp"
+    doc_type = normalize_doc_type(doc_type)
     
     print()
     print("🔍 DeepSeek-OCR Extraction Test")
@@ -349,10 +1146,41 @@ def main():
     print()
     
     # Extract
-    result = extract_document(image_path, doc_type)
+    client = open_client(args)
+    cache = open_cache(args)
+    near_dups = open_near_dups(args)
+    budgets = open_budgets(args)
+    bench = BenchRecorder() if args.bench_output else None
+    fallback = FallbackChain(extract_document) if args.fallback else None
+    multipage = MultipageExtractor(
+        fallback or extract_document,
+        dpi=args.dpi,
+        render_workers=args.render_workers,
+        page_concurrency=args.page_concurrency,
+    )
+    result = multipage(
+        image_path,
+        doc_type,
+        model_id=args.model,
+        client=client,
+        cache=cache,
+        token_budget=args.token_budget,
+        stream=args.stream,
+        early_stop=args.early_stop,
+        loop_guard=args.loop_guard,
+        bench=bench,
+        near_dups=near_dups,
+        budgets=budgets,
+        profiles=open_profiles(args)
+    )
+    multipage.close()
+    client.close()
     
     # Print result
     print_result(result)
+    if fallback:
+        print_fallback_stats(fallback.stats())
+        print()
     
     # Save to file
     output_file = Path(image_path).stem + "_extracted.json"
@@ -361,6 +1189,16 @@ def main():
     
     print(f"💾 Result saved to: {output_file}")
     print()
+    
+    if near_dups:
+        close_near_dups(args, near_dups)
+    if budgets:
+        close_budgets(budgets)
+    if cache:
+        print_cache_stats(cache)
+        cache.close()
+    if bench:
+        write_bench(bench, args.bench_output)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Learned max_tokens budgets per document type and model
+Every request used to send max_tokens=2048, although a clean KTP answer is
+a few hundred tokens, so a looping generation could burn the whole budget.
+TokenBudgets records completion_tokens (the response `usage` block) per
+(doc type, model) and keeps a streaming estimate of a high percentile with
+the P² algorithm (Jain & Chlamtac, 1985: five markers, O(1) memory and
+time per sample). Once an entry has `min_samples` observations its budget
+is
+
+    max_tokens = round_up(quantile * headroom, 64), clamped to [floor, default]
+
+Rounding to 64 keeps the budget (and so the result-cache key, which
+includes max_tokens) stable while the estimate drifts. The table is saved
+as JSON and reports how much decode capacity it freed: reserved tokens
+below the default on every budgeted request, and the tokens that capped
+runaway generations could otherwise have used.
+
+Usage:
+    python3 test_extraction.py --batch scans/ --max-tokens-table budgets.json
+    python3 token_budget.py budgets.json
+"""
+
+import argparse
+import json
+import math
+import os
+import threading
+from typing import Dict, List, Optional
+
+DEFAULT_MAX_TOKENS = 2048
+BUDGET_STEP = 64
+
+class P2Quantile:
+    """Streaming estimate of one quantile (P² algorithm)"""
+
+    def __init__(self, p: float):
+        if not 0 < p < 1:
+            raise ValueError("p must be between 0 and 1")
+        self.p = p
+        self.count = 0
+        self.heights: List[float] = []            # Marker heights q0..q4
+        self.positions = [1, 2, 3, 4, 5]          # Actual marker positions n0..n4
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value: float):
+        self.count += 1
+        if len(self.heights) < 5:
+            self.heights.append(float(value))
+            self.heights.sort()
+            return
+
+        heights, positions = self.heights, self.positions
+        if value < heights[0]:
+            heights[0] = float(value)
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = float(value)
+            cell = 3
+        else:
+            cell = next(i for i in range(4) if heights[i] <= value < heights[i + 1])
+
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers toward their desired positions
+        for i in range(1, 4):
+            delta = self.desired[i] - positions[i]
+            if (delta >= 1 and positions[i + 1] - positions[i] > 1) or \
+               (delta <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if delta > 0 else -1
+                candidate = self._parabolic(i, step)
+                if not heights[i - 1] < candidate < heights[i + 1]:
+                    candidate = self._linear(i, step)
+                heights[i] = candidate
+                positions[i] += step
+
+    def _parabolic(self, i: int, step: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def _linear(self, i: int, step: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+
+    def value(self) -> Optional[float]:
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            # Exact quantile of the first few samples
+            ordered = sorted(self.heights)
+            return ordered[min(len(ordered) - 1, int(self.p * len(ordered)))]
+        return self.heights[2]
+
+    def to_dict(self) -> Dict:
+        return {
+            "p": self.p,
+            "count": self.count,
+            "heights": self.heights,
+            "positions": self.positions,
+            "desired": self.desired,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "P2Quantile":
+        estimator = cls(data["p"])
+        estimator.count = data["count"]
+        estimator.heights = list(data["heights"])
+        estimator.positions = list(data["positions"])
+        estimator.desired = list(data["desired"])
+        return estimator
+
+class BudgetEntry:
+    """Observed output lengths and freed capacity for one (doc type, model)"""
+
+    def __init__(self, percentile: float):
+        self.quantile = P2Quantile(percentile)
+        self.median = P2Quantile(0.5)
+        self.max_seen = 0
+        self.budgeted = 0        # Requests sent with a learned budget
+        self.reserved_freed = 0  # Sum of (default - budget) over those requests
+        self.capped = 0          # Budgeted requests that hit the learned budget
+        self.runaway_freed = 0   # Sum of (default - budget) over capped requests
+
+    def to_dict(self) -> Dict:
+        return {
+            "quantile": self.quantile.to_dict(),
+            "median": self.median.to_dict(),
+            "max_seen": self.max_seen,
+            "budgeted": self.budgeted,
+            "reserved_freed": self.reserved_freed,
+            "capped": self.capped,
+            "runaway_freed": self.runaway_freed,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "BudgetEntry":
+        entry = cls(data["quantile"]["p"])
+        entry.quantile = P2Quantile.from_dict(data["quantile"])
+        entry.median = P2Quantile.from_dict(data["median"])
+        for key in ("max_seen", "budgeted", "reserved_freed", "capped", "runaway_freed"):
+            setattr(entry, key, data[key])
+        return entry
+
+class TokenBudgets:
+    """Thread-safe table of learned max_tokens budgets"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        percentile: float = 0.99,
+        headroom: float = 1.25,
+        min_samples: int = 20,
+        default: int = DEFAULT_MAX_TOKENS,
+        floor: int = 128,
+    ):
+        """
+        Args:
+            path: JSON file to load from and save to (None: in memory only)
+            percentile: Output-length quantile the budget is based on
+            headroom: Multiplier on that quantile
+            min_samples: Observations before a learned budget is used
+            default: Budget until then, and the upper bound afterwards
+            floor: Lower bound on a learned budget
+        """
+        self.path = path
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.default = default
+        self.floor = floor
+        self.entries: Dict[str, BudgetEntry] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for key, entry in data.get("entries", {}).items():
+                # A different percentile starts over; the old estimate is not comparable
+                if entry["quantile"]["p"] == percentile:
+                    self.entries[key] = BudgetEntry.from_dict(entry)
+
+    @staticmethod
+    def _key(doc_type: str, model_id: str) -> str:
+        return f"{doc_type}|{model_id}"
+
+    def _budget(self, entry: Optional[BudgetEntry]) -> Optional[int]:
+        if entry is None or entry.quantile.count < self.min_samples:
+            return None
+        target = entry.quantile.value() * self.headroom
+        budget = int(math.ceil(target / BUDGET_STEP) * BUDGET_STEP)
+        return max(self.floor, min(self.default, budget))
+
+    def max_tokens_for(self, doc_type: str, model_id: str) -> int:
+        """Budget to send; the default until enough samples were seen"""
+        with self._lock:
+            budget = self._budget(self.entries.get(self._key(doc_type, model_id)))
+        return self.default if budget is None else budget
+
+    def typical_tokens(self, doc_type: str, model_id: str) -> Optional[int]:
+        """Median natural output length; None until enough samples were seen"""
+        with self._lock:
+            entry = self.entries.get(self._key(doc_type, model_id))
+            if entry is None or entry.median.count < self.min_samples:
+                return None
+            return int(round(entry.median.value()))
+
+    def observe(self, doc_type: str, model_id: str, completion_tokens: int, max_tokens: int):
+        """Record one finished generation that was sent with `max_tokens`"""
+        with self._lock:
+            key = self._key(doc_type, model_id)
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = BudgetEntry(self.percentile)
+            entry.quantile.add(completion_tokens)
+            entry.median.add(completion_tokens)
+            entry.max_seen = max(entry.max_seen, completion_tokens)
+            if max_tokens < self.default:
+                entry.budgeted += 1
+                entry.reserved_freed += self.default - max_tokens
+                if completion_tokens >= max_tokens:
+                    entry.capped += 1
+                    entry.runaway_freed += self.default - max_tokens
+
+    def report(self) -> List[Dict]:
+        """One row per (doc type, model) with the current budget and savings"""
+        with self._lock:
+            rows = []
+            for key, entry in sorted(self.entries.items()):
+                doc_type, model_id = key.split("|", 1)
+                budget = self._budget(entry)
+                rows.append({
+                    "doc_type": doc_type,
+                    "model": model_id,
+                    "samples": entry.quantile.count,
+                    "median_tokens": entry.median.value(),
+                    "quantile_tokens": entry.quantile.value(),
+                    "max_seen": entry.max_seen,
+                    "max_tokens": self.default if budget is None else budget,
+                    "learned": budget is not None,
+                    "budgeted": entry.budgeted,
+                    "reserved_freed": entry.reserved_freed,
+                    "capped": entry.capped,
+                    "runaway_freed": entry.runaway_freed,
+                })
+            return rows
+
+    def save(self, path: Optional[str] = None):
+        """Write the table atomically (temp file + rename)"""
+        target = path or self.path
+        if not target:
+            return
+        with self._lock:
+            data = {
+                "percentile": self.percentile,
+                "headroom": self.headroom,
+                "default": self.default,
+                "entries": {key: entry.to_dict() for key, entry in self.entries.items()},
+            }
+        temp = f"{target}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp, target)
+
+def print_budget_report(budgets: TokenBudgets):
+    """Table of learned budgets and the decode capacity they freed"""
+    rows = budgets.report()
+    pct = f"p{budgets.percentile * 100:g}"
+    print(f"🎯 max_tokens budgets ({pct} x {budgets.headroom:g}, default {budgets.default})")
+    print(f"{'Doc type':<10}{'Model':<22}{'Samples':>8}{'p50':>7}{pct:>7}{'Max':>7}"
+          f"{'Budget':>8}{'Freed':>10}{'Capped':>8}")
+    for row in rows:
+        budget = f"{row['max_tokens']}" if row["learned"] else f"({row['max_tokens']})"
+        print(f"{row['doc_type']:<10}{row['model']:<22}{row['samples']:>8}"
+              f"{row['median_tokens'] or 0:>7.0f}{row['quantile_tokens'] or 0:>7.0f}{row['max_seen']:>7}"
+              f"{budget:>8}{row['reserved_freed']:>10}{row['capped']:>8}")
+    reserved = sum(row["reserved_freed"] for row in rows)
+    runaway = sum(row["runaway_freed"] for row in rows)
+    budgeted = sum(row["budgeted"] for row in rows)
+    print(f"Freed: {reserved} reserved decode tokens over {budgeted} budgeted requests; "
+          f"capped runaways could have used up to {runaway} more tokens")
+
+def main():
+    parser = argparse.ArgumentParser(description="Show a learned max_tokens table")
+    parser.add_argument("path", help="Table written by test_extraction.py --max-tokens-table")
+    args = parser.parse_args()
+
+    with open(args.path, "r", encoding="utf-8") as f:
+        settings = json.load(f)
+    budgets = TokenBudgets(
+        args.path,
+        percentile=settings["percentile"],
+        headroom=settings["headroom"],
+        default=settings["default"],
+    )
+    print_budget_report(budgets)
+
+if __name__ == "__main__":
+    main()
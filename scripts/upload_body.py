@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Bounded-memory request bodies for large scans
+Sending an image used to read the whole file, base64-encode it into one
+string and serialize the JSON payload around it: the file, its base64 text
+and the encoded body were all in memory at once, about 3.7x the file size
+per request. A 30 MB A3 ijazah scan costs ~110 MB per in-flight request.
+
+StreamingJSONBody serializes the payload once with a placeholder where the
+image goes, then yields the JSON before it, the base64 of the file read in
+fixed-size chunks, and the JSON after it. The chunk size is a multiple of
+3, so the encoded chunks join without padding. The body length is known
+up front, so requests sends a Content-Length instead of chunked encoding,
+and every iteration reopens the file, so retries and hedged duplicates can
+send the same body again. Memory per request is one read buffer and one
+encoded chunk whatever the image size.
+
+Encoding happens while requests uploads the body, so it is inside the
+caller's HTTP timing. `encode_seconds` adds up the time spent producing
+chunks (file reads and base64) across all iterations, so the cost can be
+reported on its own.
+
+Usage:
+    python3 upload_body.py big_scan.jpg --concurrency 1 4 16
+"""
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Union
+
+IMAGE_PLACEHOLDER = "@@IMAGE_BASE64@@"
+CHUNK_BYTES = 48 * 1024  # Encodes to 64 KiB of base64
+
+def base64_length(size: int) -> int:
+    return 4 * ((size + 2) // 3)
+
+class StreamingJSONBody:
+    """Re-iterable JSON request body with a file streamed in as base64"""
+
+    def __init__(
+        self,
+        payload: Dict,
+        source: Union[str, bytes],
+        placeholder: str = IMAGE_PLACEHOLDER,
+        chunk_size: int = CHUNK_BYTES,
+    ):
+        """
+        Args:
+            payload: Request JSON containing `placeholder` exactly once
+            source: Image path (read in chunks) or encoded image bytes
+            placeholder: String replaced by the base64 image
+            chunk_size: Raw bytes per chunk, rounded down to a multiple of 3
+        """
+        text = json.dumps(payload)
+        if text.count(placeholder) != 1:
+            raise ValueError("payload must contain the image placeholder exactly once")
+        prefix, suffix = text.split(placeholder)
+        self._prefix = prefix.encode("utf-8")
+        self._suffix = suffix.encode("utf-8")
+        self.source = source
+        self.chunk_size = max(3, chunk_size - chunk_size % 3)
+        self.image_size = len(source) if isinstance(source, (bytes, bytearray)) else os.path.getsize(source)
+        self.encode_seconds = 0.0  # Producing chunks, summed over every send
+
+    def __len__(self) -> int:
+        return len(self._prefix) + base64_length(self.image_size) + len(self._suffix)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._prefix
+        for chunk in self._timed(self._chunks()):
+            yield chunk
+        yield self._suffix
+
+    def _chunks(self) -> Iterator[bytes]:
+        if isinstance(self.source, (bytes, bytearray)):
+            view = memoryview(self.source)
+            for offset in range(0, len(view), self.chunk_size):
+                yield base64.b64encode(view[offset:offset + self.chunk_size])
+        else:
+            buffer = bytearray(self.chunk_size)
+            with open(self.source, "rb", buffering=0) as f:
+                while True:
+                    filled = _fill(f, buffer)
+                    if filled:
+                        yield base64.b64encode(memoryview(buffer)[:filled])
+                    if filled < len(buffer):
+                        break
+
+    def _timed(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """Yield from `chunks`, adding the time spent producing them (not sending)"""
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            self.encode_seconds += time.perf_counter() - started
+            if chunk is None:
+                return
+            yield chunk
+
+def _fill(f, buffer: bytearray) -> int:
+    """Read until the buffer is full or the file ends (short reads would break base64 joins)"""
+    view = memoryview(buffer)
+    filled = 0
+    while filled < len(buffer):
+        count = f.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return filled
+
+# Benchmark: peak RSS of N concurrent uploads, buffered vs streamed
+
+class _DiscardHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1 << 20)))
+        body = b'{"choices": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def _bench_payload(image: str) -> Dict:
+    return {
+        "model": "deepseek-ocr",
+        "messages": [{"role": "user", "content": [
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image}"}},
+            {"type": "text", "text": "Extract all fields as JSON."},
+        ]}],
+        "temperature": 0,
+        "max_tokens": 2048,
+    }
+
+def _measure(mode: str, image_path: str, url: str, concurrency: int) -> Dict:
+    """Runs in a fresh process: peak RSS growth while `concurrency` uploads overlap"""
+    import requests
+    import resource  # Unix only; imported here so upload streaming works on Windows
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    barrier = threading.Barrier(concurrency)
+    errors: List[str] = []
+
+    def upload():
+        session = requests.Session()
+        if mode == "buffered":
+            with open(image_path, "rb") as f:
+                image_base64 = base64.b64encode(f.read()).decode()
+            body = json.dumps(_bench_payload(image_base64)).encode("utf-8")
+        else:
+            body = StreamingJSONBody(_bench_payload(IMAGE_PLACEHOLDER), image_path)
+        barrier.wait()
+        response = session.post(url, data=body, headers={"Content-Type": "application/json"})
+        if response.status_code != 200:
+            errors.append(f"HTTP {response.status_code}")
+        session.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=upload) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "peak_rss_mb": (peak_kb - baseline_kb) / 1024,
+        "seconds": time.perf_counter() - start,
+        "errors": errors,
+    }
+
+def run_benchmark(image_path: str, concurrency_levels: List[int]) -> List[Dict]:
+    """Each (mode, concurrency) point runs in its own process against a local discard server"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _DiscardHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    try:
+        for concurrency in concurrency_levels:
+            for mode in ("buffered", "streamed"):
+                with context.Pool(1) as pool:
+                    rows.append(pool.apply(_measure, (mode, image_path, url, concurrency)))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak client RSS of buffered vs streamed image uploads")
+    parser.add_argument("image", help="Image to upload (larger shows the difference better)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                        help="Concurrent uploads per measurement (default: 1 4 16)")
+    args = parser.parse_args()
+
+    size_mb = os.path.getsize(args.image) / (1024 * 1024)
+    print("📦 Upload memory benchmark")
+    print("=" * 80)
+    print(f"Image: {args.image} ({size_mb:.1f} MB)")
+    print()
+    print(f"{'Concurrency':>11}{'Mode':>10}{'Peak RSS MB':>13}{'MB/request':>12}{'Seconds':>9}")
+    for row in run_benchmark(args.image, args.concurrency):
+        per_request = row["peak_rss_mb"] / row["concurrency"]
+        print(f"{row['concurrency']:>11}{row['mode']:>10}{row['peak_rss_mb']:>13.1f}"
+              f"{per_request:>12.1f}{row['seconds']:>9.2f}")
+        for error in row["errors"][:1]:
+            print(f"   ❌ {error}")
+    print("=" * 80)
+
+if __name__ == "__main__":
+    main()
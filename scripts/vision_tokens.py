@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Vision-token-aware resize planner for DeepSeek-OCR uploads
+Reproduces the server's image preprocessing math to predict how many image
+tokens a picture will cost, then picks the largest resolution that stays under
+a per-document-type token budget and re-encodes the image before upload.
+
+Token math mirrors the Rust preprocessors:
+  - deepseek-ocr*: global view padded to base_size plus a crop-tile grid from
+    dynamic_preprocess (2..9 tiles chosen by aspect ratio) when the image is
+    larger than image_size (see build_prompt_artifacts in capture_baseline.py)
+  - paddleocr-vl*, dots-ocr*: smart_resize to a multiple of patch*merge (28)
+    with max_pixels capped at image_size^2, one token per 28x28 cell
+
+Usage:
+    python3 vision_tokens.py ktp.jpg --model paddleocr-vl --doc-type ktp
+    python3 vision_tokens.py scan.png --model deepseek-ocr --budget 400
+"""
+
+import argparse
+import io
+import json
+import math
+import sys
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; planning needs it, prediction does not
+    Image = None
+
+# Server defaults (crates/config: inference.base_size / inference.image_size)
+DEFAULT_BASE_SIZE = 1024
+DEFAULT_IMAGE_SIZE = 640
+
+# DeepSeek-OCR vision encoder
+DEEPSEEK_PATCH_SIZE = 16
+DEEPSEEK_DOWNSAMPLE_RATIO = 4
+DEEPSEEK_MIN_CROPS = 2
+DEEPSEEK_MAX_CROPS = 9
+
+# SigLIP-style encoders (PaddleOCR-VL, dots.ocr): patch 14, 2x2 spatial merge
+SIGLIP_FACTOR = 28
+SIGLIP_MIN_PIXELS = {
+    "paddleocr-vl": 147_384,
+    "dots-ocr": 3_136,
+}
+SIGLIP_MAX_PIXELS = {
+    "paddleocr-vl": 2_822_400,
+    "dots-ocr": 11_289_600,
+}
+
+# Image-token budget per document type (small cards need far fewer tokens)
+DEFAULT_TOKEN_BUDGETS = {
+    "ktp": 400,
+    "sim": 400,
+    "npwp": 400,
+    "receipt": 600,
+    "passport": 600,
+    "kk": 1024,
+    "akta": 1024,
+    "ijazah": 1024,
+    "sertifikat": 1024,
+    "invoice": 1400,
+    "form": 1400,
+}
+
+# Rough characters-per-token ratio for estimating the text part of the prompt
+CHARS_PER_TOKEN = 4.0
+
+@dataclass
+class VisionSettings:
+    """Server-side preprocessing settings"""
+    base_size: int = DEFAULT_BASE_SIZE
+    image_size: int = DEFAULT_IMAGE_SIZE
+    crop_mode: bool = True
+
+@dataclass
+class ResizePlan:
+    """Resize decision for one image"""
+    model_id: str
+    budget: Optional[int]
+    original_size: Tuple[int, int]
+    target_size: Tuple[int, int]
+    tokens_before: int
+    tokens_after: int
+
+    @property
+    def needs_resize(self) -> bool:
+        return self.target_size != self.original_size
+
+    def to_dict(self) -> Dict:
+        data = asdict(self)
+        data["needs_resize"] = self.needs_resize
+        return data
+
+def model_family(model_id: str) -> str:
+    """Map a model id to its vision preprocessing family"""
+    if model_id.startswith("deepseek-ocr"):
+        return "deepseek-ocr"
+    if model_id.startswith("dots-ocr"):
+        return "dots-ocr"
+    return "paddleocr-vl"
+
+def deepseek_crop_grid(
+    width: int,
+    height: int,
+    image_size: int = DEFAULT_IMAGE_SIZE,
+    min_num: int = DEEPSEEK_MIN_CROPS,
+    max_num: int = DEEPSEEK_MAX_CROPS
+) -> Tuple[int, int]:
+    """Tile grid (columns, rows) chosen by dynamic_preprocess"""
+    target_ratios = sorted({
+        (i, j)
+        for n in range(min_num, max_num + 1)
+        for i in range(1, n + 1)
+        for j in range(1, n + 1)
+        if min_num <= i * j <= max_num
+    })
+
+    aspect_ratio = width / height
+    area = width * height
+    best = (1, 1)
+    best_diff = float("inf")
+    for w_ratio, h_ratio in target_ratios:
+        diff = abs(aspect_ratio - w_ratio / h_ratio)
+        if diff < best_diff:
+            best_diff = diff
+            best = (w_ratio, h_ratio)
+        elif abs(diff - best_diff) < sys.float_info.epsilon and \
+                area > 0.5 * image_size * image_size * w_ratio * h_ratio:
+            best = (w_ratio, h_ratio)
+    return best
+
+def deepseek_image_tokens(width: int, height: int, settings: VisionSettings) -> int:
+    """Image tokens for DeepSeek-OCR (global view + local crop tiles)"""
+    if not settings.crop_mode:
+        queries = math.ceil((settings.image_size // DEEPSEEK_PATCH_SIZE) / DEEPSEEK_DOWNSAMPLE_RATIO)
+        return (queries + 1) * queries + 1
+
+    queries_global = math.ceil((settings.base_size // DEEPSEEK_PATCH_SIZE) / DEEPSEEK_DOWNSAMPLE_RATIO)
+    queries_local = math.ceil((settings.image_size // DEEPSEEK_PATCH_SIZE) / DEEPSEEK_DOWNSAMPLE_RATIO)
+    tokens = (queries_global + 1) * queries_global + 1
+
+    if width <= settings.image_size and height <= settings.image_size:
+        return tokens
+
+    cols, rows = deepseek_crop_grid(width, height, settings.image_size)
+    if cols > 1 or rows > 1:
+        tokens += (queries_local * cols + 1) * (queries_local * rows)
+    return tokens
+
+def smart_resize(
+    height: int,
+    width: int,
+    factor: int,
+    min_pixels: int,
+    max_pixels: int
+) -> Tuple[int, int]:
+    """Port of smart_resize from the PaddleOCR-VL/dots.ocr preprocessors"""
+    h = float(max(height, 1))
+    w = float(max(width, 1))
+    if h < factor:
+        w = round(w * factor / h)
+        h = factor
+    if w < factor:
+        h = round(h * factor / w)
+        w = factor
+
+    h_bar = round(h / factor) * factor
+    w_bar = round(w / factor) * factor
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt(h * w / max_pixels)
+        h_bar = math.floor(h / beta / factor) * factor
+        w_bar = math.floor(w / beta / factor) * factor
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (h * w))
+        h_bar = math.ceil(h * beta / factor) * factor
+        w_bar = math.ceil(w * beta / factor) * factor
+    return int(max(h_bar, factor)), int(max(w_bar, factor))
+
+def siglip_image_tokens(width: int, height: int, family: str, settings: VisionSettings) -> int:
+    """Image tokens for PaddleOCR-VL / dots.ocr (one token per merged patch)"""
+    min_pixels = SIGLIP_MIN_PIXELS[family]
+    max_pixels = SIGLIP_MAX_PIXELS[family]
+    if settings.image_size > 0:
+        max_pixels = min(max_pixels, max(settings.image_size ** 2, min_pixels))
+    h_bar, w_bar = smart_resize(height, width, SIGLIP_FACTOR, min_pixels, max_pixels)
+    return (h_bar // SIGLIP_FACTOR) * (w_bar // SIGLIP_FACTOR)
+
+def predict_image_tokens(
+    model_id: str,
+    width: int,
+    height: int,
+    settings: Optional[VisionSettings] = None
+) -> int:
+    """Predict how many image tokens the server will prefill for this image"""
+    settings = settings or VisionSettings()
+    family = model_family(model_id)
+    if family == "deepseek-ocr":
+        return deepseek_image_tokens(width, height, settings)
+    return siglip_image_tokens(width, height, family, settings)
+
+def predict_prefill_tokens(
+    model_id: str,
+    width: int,
+    height: int,
+    prompt: str,
+    settings: Optional[VisionSettings] = None
+) -> int:
+    """Image tokens plus a rough estimate for the prompt text"""
+    text_tokens = math.ceil(len(prompt) / CHARS_PER_TOKEN)
+    return predict_image_tokens(model_id, width, height, settings) + text_tokens
+
+def plan_resize(
+    model_id: str,
+    width: int,
+    height: int,
+    budget: Optional[int],
+    settings: Optional[VisionSettings] = None
+) -> ResizePlan:
+    """
+    Pick the largest resolution (never upscaling) that fits the token budget
+
+    Returns a plan that keeps the original size when it already fits, or when
+    no smaller resolution would lower the token count.
+    """
+    settings = settings or VisionSettings()
+    tokens_before = predict_image_tokens(model_id, width, height, settings)
+    plan = ResizePlan(
+        model_id=model_id,
+        budget=budget,
+        original_size=(width, height),
+        target_size=(width, height),
+        tokens_before=tokens_before,
+        tokens_after=tokens_before,
+    )
+    if budget is None or tokens_before <= budget:
+        return plan
+
+    def size_at(scale: float) -> Tuple[int, int]:
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def tokens_at(scale: float) -> int:
+        w, h = size_at(scale)
+        return predict_image_tokens(model_id, w, h, settings)
+
+    # Token count is monotone in scale: binary search the largest fitting scale
+    low, high = 0.0, 1.0
+    if tokens_at(1e-3) > budget:
+        # Even a thumbnail exceeds the budget: take the cheapest resolution
+        low = _smallest_cheapest_scale(tokens_at)
+    else:
+        for _ in range(24):
+            mid = (low + high) / 2
+            if tokens_at(mid) <= budget:
+                low = mid
+            else:
+                high = mid
+
+    tokens_after = tokens_at(low)
+    if tokens_after >= tokens_before:
+        return plan
+
+    plan.target_size = size_at(low)
+    plan.tokens_after = tokens_after
+    return plan
+
+def _smallest_cheapest_scale(tokens_at) -> float:
+    """Largest scale that still achieves the minimum reachable token count"""
+    floor_tokens = tokens_at(1e-3)
+    low, high = 1e-3, 1.0
+    for _ in range(24):
+        mid = (low + high) / 2
+        if tokens_at(mid) <= floor_tokens:
+            low = mid
+        else:
+            high = mid
+    return low
+
+def image_dimensions(image_bytes: bytes) -> Tuple[int, int]:
+    """(width, height) of an encoded image"""
+    if Image is None:
+        raise RuntimeError("Pillow is required for resize planning: pip install pillow")
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        return img.size
+
+def apply_plan(image_bytes: bytes, plan: ResizePlan, quality: int = 90) -> bytes:
+    """Resize and re-encode as JPEG according to plan (no-op if not needed)"""
+    if not plan.needs_resize:
+        return image_bytes
+    if Image is None:
+        raise RuntimeError("Pillow is required for resize planning: pip install pillow")
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        resized = img.convert("RGB").resize(plan.target_size, Image.BICUBIC)
+    buffer = io.BytesIO()
+    resized.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+def budget_for(doc_type: str, override: Optional[int] = None) -> Optional[int]:
+    """Token budget for a doc type (explicit override wins)"""
+    if override is not None:
+        return override
+    return DEFAULT_TOKEN_BUDGETS.get(doc_type)
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict vision tokens and plan a resize")
+    parser.add_argument("image", help="Image file")
+    parser.add_argument("--model", default="paddleocr-vl", help="Target model id")
+    parser.add_argument("--doc-type", default="ktp", help="Document type for the default budget")
+    parser.add_argument("--budget", type=int, help="Image-token budget (overrides doc type default)")
+    parser.add_argument("--base-size", type=int, default=DEFAULT_BASE_SIZE)
+    parser.add_argument("--image-size", type=int, default=DEFAULT_IMAGE_SIZE)
+    parser.add_argument("--output", help="Write the resized image here")
+    parser.add_argument("--json", action="store_true", help="Output plan as JSON")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        image_bytes = f.read()
+
+    settings = VisionSettings(base_size=args.base_size, image_size=args.image_size)
+    width, height = image_dimensions(image_bytes)
+    plan = plan_resize(args.model, width, height, budget_for(args.doc_type, args.budget), settings)
+
+    if args.json:
+        print(json.dumps(plan.to_dict(), indent=2))
+    else:
+        print(f"🖼️  {args.image}: {width}x{height}")
+        print(f"   Model: {args.model} ({model_family(args.model)})")
+        print(f"   Budget: {plan.budget if plan.budget is not None else 'none'} image tokens")
+        print(f"   Predicted tokens: {plan.tokens_before}")
+        if plan.needs_resize:
+            print(f"   Resize to: {plan.target_size[0]}x{plan.target_size[1]} -> {plan.tokens_after} tokens")
+        else:
+            print("   ✅ No resize needed")
+
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(apply_plan(image_bytes, plan))
+        print(f"💾 Saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()